@@ -7,36 +7,31 @@ import hashlib
 import time
 import os
 import threading
-from flask import Blueprint, request, jsonify, current_app
+import re
+import copy
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, Response, request, jsonify, current_app, send_file, stream_with_context
 from auth import token_required
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import circuit_breaker
+import provider_client
+import singleflight
+import speculation
+import llm_hedge
+import llm_cache
+import prompt_index
+import image_store
+import image_variants
+import cache_backend
+import story_context
+import story_prefetch
 
 # Create a Blueprint for AI routes
 ai_bp = Blueprint('ai', __name__, url_prefix='/api/ai')
 
-# Create a session with connection pooling and retry strategy for faster API calls
-def _create_requests_session():
-    """Create a requests session with connection pooling and retries."""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=0,  # Don't retry at session level, we handle retries manually
-        backoff_factor=0,
-        status_forcelist=[]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=10, pool_maxsize=10)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
-
-_session = None
-
 def _get_session():
-    """Get or create the global requests session."""
-    global _session
-    if _session is None:
-        _session = _create_requests_session()
-    return _session
+    """Return the shared pooled session used for all provider calls."""
+    return provider_client.get_session()
 
 # Simple in-memory job store for dev async image generation
 JOBS = {}  # job_id -> { status: 'pending'|'done'|'error', result: {...} }
@@ -64,15 +59,20 @@ def _save_image_b64(b64, prompt_text=None):
         return None
 
 
-def _picsum_base64_from_prompt(prompt_text: str, width: int = 800, height: int = 450, timeout: int = 20):
+def _picsum_url(prompt_text, width, height):
+    """Deterministic Picsum URL: the same prompt always maps to the same image."""
+    seed = hashlib.sha1((prompt_text or 'seed').encode('utf-8')).hexdigest()[:8]
+    return f'https://picsum.photos/seed/{seed}/{width}/{height}'
+
+
+def _picsum_base64_from_prompt(prompt_text: str, width: int = 800, height: int = 450):
     """Return a deterministic Picsum image as base64 for a prompt.
     Uses a short SHA1 seed so the same prompt yields the same image.
     Returns None on failure.
     """
     try:
-        seed = hashlib.sha1((prompt_text or 'seed').encode('utf-8')).hexdigest()[:8]
-        url = f'https://picsum.photos/seed/{seed}/{width}/{height}'
-        resp = requests.get(url, timeout=timeout)
+        url = _picsum_url(prompt_text, width, height)
+        resp = provider_client.get(url, provider='picsum')
         if resp.status_code == 200:
             return base64.b64encode(resp.content).decode('utf-8')
     except Exception:
@@ -103,7 +103,70 @@ def _extract_prompt_from_payload(payload):
     return (prompt_text or '').strip()
 
 
-def _make_image_cache_key(prompt_text, provider, params=None):
+def _image_params_from_payload(payload):
+    """Extract the cache-relevant image parameters from a request payload."""
+    params = {}
+    try:
+        params_obj = payload.get('parameters') if isinstance(payload, dict) else {}
+        if isinstance(params_obj, dict):
+            params['sampleCount'] = params_obj.get('sampleCount') or params_obj.get('samples') or 1
+            params['aspectRatio'] = params_obj.get('aspectRatio')
+    except Exception:
+        params['sampleCount'] = 1
+    return params
+
+
+# --- image cache keys ---
+# Every image path (sync, async jobs, batches, previews, speculation, warmup)
+# keys through _make_image_cache_key, which hashes a canonical form of the
+# request (v2): whitespace collapsed, case folded, the ", in the style of X"
+# suffix main.js appends split off and normalized the same way, and params
+# reduced to {sampleCount, aspectRatio}. Generation still uses the prompt as
+# sent; only the key is canonical.
+#
+# v1 keys hashed the raw prompt, with {sampleCount, aspectRatio} on the sync
+# route but only {sampleCount} for async jobs. While IMAGE_CACHE_KEY_COMPAT is
+# on, a v2 miss looks up those v1 keys and copies a hit over to the v2 key
+# (blobs are shared, so the copy writes no image bytes).
+
+IMAGE_CACHE_KEY_VERSION = 2
+
+# Parameters handleImageGeneration (static/js/main.js) sends for a new scene.
+# Requests made on the UI's behalf (speculation, warmup) must use the same
+# values, or they warm keys the UI never looks up.
+UI_IMAGE_PARAMETERS = {'sampleCount': 3, 'aspectRatio': '16:9'}
+_STYLE_SUFFIX_RE = re.compile(r',\s*in the style of\s+(.+)$', re.IGNORECASE | re.DOTALL)
+_KEY_COMPAT_MAX = 10000
+_key_compat = OrderedDict()  # v2 key -> (prompt_text, provider, params) it was made from
+_key_compat_lock = threading.Lock()
+KEY_STATS = {'hits': 0, 'compat_hits': 0, 'misses': 0}
+
+
+def _canonical_text(text):
+    return ' '.join((text or '').split()).rstrip(' .').casefold()
+
+
+def _canonical_image_request(prompt_text, params=None):
+    """(prompt, style, params) that identify an image request for caching."""
+    prompt = ' '.join((prompt_text or '').split())
+    style = ''
+    match = _STYLE_SUFFIX_RE.search(prompt)
+    if match:
+        prompt, style = prompt[:match.start()], match.group(1)
+    params = params or {}
+    try:
+        sample_count = int(params.get('sampleCount') or params.get('samples') or 1)
+    except (TypeError, ValueError):
+        sample_count = 1
+    aspect_ratio = params.get('aspectRatio')
+    return _canonical_text(prompt), _canonical_text(style), {
+        'sampleCount': sample_count,
+        'aspectRatio': str(aspect_ratio).replace(' ', '') if aspect_ratio else None,
+    }
+
+
+def _make_image_cache_key_v1(prompt_text, provider, params=None):
+    """The pre-v2 key (raw prompt, params as given); used for compatibility lookups."""
     if params is None:
         params = {}
     try:
@@ -113,52 +176,296 @@ def _make_image_cache_key(prompt_text, provider, params=None):
         return hashlib.sha1((prompt_text + provider).encode('utf-8')).hexdigest()[:16]
 
 
-def _persist_image_cache(key, base64_list, prompt_text):
-    """Persist images and a metadata JSON for a given cache key."""
+def _make_image_cache_key(prompt_text, provider, params=None):
+    prompt, style, canonical = _canonical_image_request(prompt_text, params)
+    norm = (f"v{IMAGE_CACHE_KEY_VERSION}|prompt:{prompt}|style:{style}|provider:{provider}"
+            f"|params:{json.dumps(canonical, sort_keys=True)}")
+    key = f"v{IMAGE_CACHE_KEY_VERSION}-" + hashlib.sha1(norm.encode('utf-8')).hexdigest()[:16]
+    with _key_compat_lock:
+        _key_compat[key] = (prompt_text, provider, dict(params or {}))
+        _key_compat.move_to_end(key)
+        while len(_key_compat) > _KEY_COMPAT_MAX:
+            _key_compat.popitem(last=False)
+    return key
+
+
+def _legacy_image_cache_keys(prompt_text, provider, params=None):
+    """The v1 keys the sync route and async jobs used for this request."""
+    params = params or {}
+    sample_count = params.get('sampleCount') or params.get('samples') or 1
+    keys = [
+        _make_image_cache_key_v1(prompt_text, provider, {'sampleCount': sample_count, 'aspectRatio': params.get('aspectRatio')}),
+        _make_image_cache_key_v1(prompt_text, provider, {'sampleCount': sample_count}),
+    ]
+    return list(dict.fromkeys(keys))
+
+
+def _count_key_lookup(hit):
+    with _key_compat_lock:
+        KEY_STATS['hits' if hit else 'misses'] += 1
+
+
+def _load_compat_image_cache(key, ttl_seconds):
+    """Find a v1 entry for a v2 key and copy it over; return base64 strings or None."""
+    if not current_app.config.get('IMAGE_CACHE_KEY_COMPAT', True):
+        return None
+    with _key_compat_lock:
+        origin = _key_compat.get(key)
+    if origin is None:
+        return None
+    store = image_store.get_store()
+    for old_key in _legacy_image_cache_keys(*origin):
+        cached = store.get_base64(old_key, ttl_seconds=ttl_seconds)
+        if cached is None:
+            continue
+        meta = store.meta(old_key) or {}
+        store.put(key, [base64.b64decode(b) for b in cached], meta.get('prompt'), meta.get('provider'),
+                  meta.get('params'), ts=meta.get('ts'), encoded=cached)
+        print(f"[IMAGE] Compatibility hit: {old_key} -> {key}")
+        with _key_compat_lock:
+            KEY_STATS['compat_hits'] += 1
+        return cached
+    return None
+
+
+def _persist_image_cache(key, base64_list, prompt_text, provider=None, params=None):
+    """Persist images and their metadata for a given cache key (see image_store.py)."""
     try:
-        uploads_dir = os.path.join(current_app.static_folder, 'uploads')
-        os.makedirs(uploads_dir, exist_ok=True)
-        meta = {'key': key, 'files': [], 'prompt': prompt_text, 'ts': int(time.time())}
-        for idx, b64 in enumerate(base64_list):
-            filename = f"img_{key}_{idx}.png"
-            path = os.path.join(uploads_dir, filename)
-            with open(path, 'wb') as f:
-                f.write(base64.b64decode(b64))
-            meta['files'].append(filename)
-
-        meta_path = os.path.join(uploads_dir, f'cache_{key}.json')
-        with open(meta_path, 'w', encoding='utf-8') as f:
-            json.dump(meta, f)
+        store = image_store.get_store()
+        blobs = [base64.b64decode(b64) for b64 in base64_list]
+        # provider/params are recorded so similar-prompt lookups only reuse compatible images
+        store.put(key, blobs, prompt_text, provider,
+                  (params or {}) if provider is not None else None, encoded=list(base64_list))
+        _publish_images(key, blobs, prompt_text, provider, params)
+        # Thumbnail/medium/full WebP (+AVIF) variants are rendered in a process pool
+        image_variants.schedule(store, store.blobs(key), current_app.config)
+        if provider is not None and current_app.config.get('IMAGE_SIMILARITY_ENABLED', False):
+            prompt_index.add(store.uploads_dir, key, prompt_text, provider, params, current_app.config)
         return True
-    except Exception:
+    except Exception as e:
+        print(f"[IMAGE] Cache persist failed for {key}: {str(e)}")
         return False
 
 
 def _load_image_cache(key, ttl_seconds=86400):
     """Return a list of base64 strings if cache exists and is valid; otherwise None."""
     try:
-        uploads_dir = os.path.join(current_app.static_folder, 'uploads')
-        meta_path = os.path.join(uploads_dir, f'cache_{key}.json')
-        if not os.path.exists(meta_path):
+        # Served from the in-memory hot tier when possible (no disk read, no re-encode)
+        cached = image_store.get_store().get_base64(key, ttl_seconds=ttl_seconds)
+        if cached is None:
+            cached = _load_shared_images(key, ttl_seconds)
+        if cached is None:
+            cached = _load_compat_image_cache(key, ttl_seconds)
+        _count_key_lookup(cached is not None)
+        return cached
+    except Exception:
+        return None
+
+
+# --- shared cache backend (see cache_backend.py) ---
+# The local store stays the first tier on every node; with a shared backend
+# (CACHE_BACKEND=redis) new images are also published there, and a local miss
+# is filled from it instead of generating the image again.
+
+def _publish_images(key, blobs, prompt_text, provider, params):
+    try:
+        backend = cache_backend.get_backend()
+        if backend.shared:
+            backend.put_images(key, blobs, {'prompt': prompt_text, 'provider': provider, 'params': params},
+                               current_app.config.get('IMAGE_CACHE_TTL_SECONDS', 60 * 60 * 24))
+    except Exception as e:
+        print(f"[CACHE BACKEND] Publish failed for {key}: {str(e)}")
+
+
+def _load_shared_images(key, ttl_seconds=None):
+    """Fill the local store from the shared backend; return base64 strings or None."""
+    try:
+        backend = cache_backend.get_backend()
+        if not backend.shared:
             return None
-        with open(meta_path, 'r', encoding='utf-8') as f:
-            meta = json.load(f)
-        ts = meta.get('ts', 0)
-        if ttl_seconds and (int(time.time()) - ts) > ttl_seconds:
-            # expired
+        found = backend.get_images(key, ttl_seconds)
+        if found is None:
             return None
-        files = meta.get('files', [])
-        base64_list = []
-        for fname in files:
-            path = os.path.join(uploads_dir, fname)
-            if not os.path.exists(path):
-                return None
-            with open(path, 'rb') as f:
-                b = f.read()
-                base64_list.append(base64.b64encode(b).decode('utf-8'))
-        return base64_list
-    except Exception:
+        blobs, record = found
+        encoded = [base64.b64encode(b).decode('utf-8') for b in blobs]
+        image_store.get_store().put(key, blobs, record.get('prompt'), record.get('provider'),
+                                    record.get('params'), ts=record.get('ts'), encoded=encoded)
+        print(f"[CACHE BACKEND] Shared hit for {key}")
+        return encoded
+    except Exception as e:
+        print(f"[CACHE BACKEND] Lookup failed for {key}: {str(e)}")
+        return None
+
+
+def _publish_job(job_id, job=None):
+    """Write a job's current state to the backend so any worker can report it."""
+    try:
+        job = job if job is not None else JOBS.get(job_id)
+        if job is not None:
+            cache_backend.get_backend().put_job(job_id, job)
+    except Exception as e:
+        print(f"[JOBS] Publish failed for {job_id}: {str(e)}")
+
+
+def _find_job(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        try:
+            job = cache_backend.get_backend().get_job(job_id)
+        except Exception as e:
+            print(f"[JOBS] Lookup failed for {job_id}: {str(e)}")
+    return job
+
+
+def _find_similar_cached(prompt_text, provider, params, cache_key, ttl_seconds=86400):
+    """Return (key, score, base64_list) for a cached near-duplicate prompt, or None.
+
+    Only used when IMAGE_SIMILARITY_ENABLED is set; see prompt_index.py.
+    """
+    if not current_app.config.get('IMAGE_SIMILARITY_ENABLED', False):
+        return None
+    try:
+        uploads_dir = os.path.join(current_app.static_folder, 'uploads')
+        matches = prompt_index.find_similar(uploads_dir, prompt_text, provider, params,
+                                            current_app.config, exclude=cache_key)
+        for score, key in matches:
+            cached = _load_image_cache(key, ttl_seconds=ttl_seconds)
+            if cached:
+                prompt_index.record_hit()
+                print(f"[IMAGE] Similar-prompt hit {key} (similarity {score:.2f})")
+                return key, score, cached
+            prompt_index.discard(key)  # expired or removed on disk
+    except Exception as e:
+        print(f"[IMAGE] Similarity lookup failed: {str(e)}")
+    return None
+
+
+def _similar_image_body(match):
+    key, score, cached = match
+    return {'predictions': [{'bytesBase64Encoded': b} for b in cached], 'cached': True,
+            'similar': {'key': key, 'score': round(score, 3)}}
+
+
+# --- URL response mode ---
+# With {"response": "url"} (or IMAGE_RESPONSE_MODE=url) generate-image answers
+# with cache URLs served by /api/ai/images/<file> instead of base64 JSON.
+
+def _wants_image_urls(data, config):
+    mode = (data or {}).get('response') if isinstance(data, dict) else None
+    return (mode or config.get('IMAGE_RESPONSE_MODE', 'base64')) == 'url'
+
+
+def _image_url_body(key, ttl_seconds=None):
+    """{"images": [{"url"}], "cached": true} for a fresh cache entry, or None."""
+    store = image_store.get_store()
+    files = store.locate(key, ttl_seconds)
+    if not files and (_load_shared_images(key, ttl_seconds) or _load_compat_image_cache(key, ttl_seconds)):
+        files = store.locate(key, ttl_seconds)  # filled from the shared/compat tier
+    _count_key_lookup(bool(files))
+    if not files:
         return None
+    return {'images': [{'url': image_store.url_for_file(f)} for f in files], 'cached': True, 'key': key}
+
+
+def _image_body_as_urls(body, status, cache_key):
+    """Swap a successful base64 body for URLs once its images are in the cache."""
+    if status != 200 or not isinstance(body, dict):
+        return body
+    key = (body.get('similar') or {}).get('key') or cache_key
+    url_body = _image_url_body(key)
+    if url_body is None:
+        return body  # not persisted (pass-through provider): keep base64
+    url_body['cached'] = bool(body.get('cached'))
+    if body.get('similar'):
+        url_body['similar'] = body['similar']
+    return url_body
+
+
+def _build_stability_request(prompt_text, params, config):
+    """Describe a Stability text-to-image call as {url, headers, json, timeout}."""
+    engine = config.get('STABILITY_ENGINE')
+    body = {
+        'text_prompts': [{'text': prompt_text}],
+        'cfg_scale': 7,
+        'height': 1024,
+        'width': 1024,
+        'samples': 1
+    }
+    # if params requested sampleCount override, use it
+    if (params or {}).get('sampleCount'):
+        body['samples'] = int(params.get('sampleCount') or 1)
+    return {
+        'url': f'https://api.stability.ai/v1/generation/{engine}/text-to-image',
+        'headers': {'Authorization': f"Bearer {config.get('STABILITY_API_KEY')}", 'Content-Type': 'application/json'},
+        'json': body,
+        'timeout': provider_client.timeout_for('stability'),
+    }
+
+
+def _extract_stability_b64_list(j):
+    """Return every base64 image (one per requested sample) from common Stability response shapes."""
+    # Check for 'artifacts' or 'images' or 'data'
+    if not isinstance(j, dict):
+        return []
+    for field, names in (('artifacts', ('base64', 'b64', 'b64_json')), ('images', ('b64',)), ('data', ('b64', 'base64'))):
+        items = j.get(field)
+        if not isinstance(items, list):
+            continue
+        b64_list = []
+        for item in items:
+            b64 = next((item.get(n) for n in names if item.get(n)), None) if isinstance(item, dict) else item
+            if b64:
+                b64_list.append(b64)
+        if b64_list:
+            return b64_list
+    return []
+
+
+def _extract_stability_b64(j):
+    """Return the first base64 image from common Stability response shapes."""
+    b64_list = _extract_stability_b64_list(j)
+    return b64_list[0] if b64_list else None
+
+
+def _cached_files(key):
+    """Return the image file paths (relative to static/uploads) of a cache entry."""
+    try:
+        return image_store.get_store().files(key)
+    except Exception:
+        return []
+
+
+def _cache_job_result(key):
+    """Build the job result payload (key, files, file_urls) for a cache entry."""
+    files = _cached_files(key)
+    return {'key': key, 'files': files, 'file_urls': [image_store.url_for_file(n) for n in files]}
+
+
+# --- in-flight coalescing (see singleflight.py) ---
+# A flight's value is either a generate-image outcome {'kind': 'response'}
+# or a background job outcome {'kind': 'job'}. Followers of the other kind
+# pick the result up from the image cache the leader just wrote.
+
+def _image_flight_response(resp, status):
+    """Wrap a generate-image (response, status) as a shareable flight value."""
+    return {'kind': 'response', 'body': resp.get_json(silent=True), 'status': status}
+
+
+def _image_response_from_flight(value, cache_key, cache_ttl):
+    """Return the (body, status) a generate-image caller should send."""
+    if value.get('kind') == 'response' and value.get('body') is not None:
+        return value['body'], value['status']
+    cached = _load_image_cache(cache_key, ttl_seconds=cache_ttl)
+    if cached:
+        return {'predictions': [{'bytesBase64Encoded': b} for b in cached], 'cached': True}, 200
+    return {'error': 'Failed to generate image from any provider.'}, 502
+
+
+def _job_result_from_flight(value, cache_key):
+    """Return the job result for a flight value, or None if generation failed."""
+    if value.get('kind') == 'job':
+        return value['result']
+    return _cache_job_result(cache_key) if _cached_files(cache_key) else None
 
 
 def _synthesize_narrative(prompt_text, paragraphs=3):
@@ -220,175 +527,509 @@ def _extract_user_prompt(payload):
         return "Continue the story"
 
 
-def _call_groq_llm(payload):
-    """Call Groq API for fast, free LLM inference."""
-    try:
-        from flask import current_app, jsonify
-        
-        GROQ_API_KEY = current_app.config.get('GROQ_API_KEY')
-        if not GROQ_API_KEY:
-            return jsonify({'error': 'GROQ_API_KEY not configured'}), 500
-        
-        # Extract prompt from Gemini-style payload
-        user_prompt = _extract_user_prompt(payload)
-        system_instruction = payload.get('systemInstruction', {}).get('parts', [{}])[0].get('text', '')
-        
-        # Groq API (OpenAI-compatible)
-        groq_payload = {
-            "model": "llama-3.3-70b-versatile",  # Fast, free model
+# Upstream endpoints and models for the non-Gemini LLM providers. Gemini
+# uses STORY_API_URL from config.
+LLM_ENDPOINTS = {
+    'groq': 'https://api.groq.com/openai/v1/chat/completions',  # OpenAI-compatible
+    'openai': 'https://api.openai.com/v1/chat/completions',
+    'anthropic': 'https://api.anthropic.com/v1/messages',
+}
+LLM_MODELS = {
+    'groq': 'llama-3.3-70b-versatile',  # Fast, free model
+    'openai': 'gpt-3.5-turbo',  # or "gpt-4" if you have access
+    'anthropic': 'claude-3-haiku-20240307',  # Fast, cheap model
+}
+LLM_KEY_NAMES = {
+    'gemini': 'GEMINI_API_KEY',
+    'groq': 'GROQ_API_KEY',
+    'openai': 'OPENAI_API_KEY',
+    'anthropic': 'ANTHROPIC_API_KEY',
+}
+LLM_LABELS = {'gemini': 'Gemini', 'groq': 'Groq', 'openai': 'OpenAI', 'anthropic': 'Anthropic'}
+# Sampling temperature each provider is called with; Gemini receives the
+# payload's own generationConfig (Anthropic uses its API default of 1.0).
+LLM_TEMPERATURES = {'groq': 0.8, 'openai': 0.8, 'anthropic': 1.0}
+
+
+def _system_instruction(payload):
+    return payload.get('systemInstruction', {}).get('parts', [{}])[0].get('text', '')
+
+
+def _build_llm_request(provider, payload, config, scene_count=1):
+    """Describe the upstream call for `provider` as {url, headers, json, timeout}.
+
+    Shared by the sync routes and the ASGI mode so both send identical
+    requests. Returns None when the provider's API key is not configured.
+    scene_count > 1 is used by the batch route (see _batch_llm_payload).
+    """
+    api_key = config.get(LLM_KEY_NAMES[provider])
+    if not api_key:
+        return None
+
+    if provider == 'gemini':
+        return {
+            'url': f"{config.get('STORY_API_URL')}?key={api_key}",
+            'headers': {},
+            'json': payload,
+            'timeout': provider_client.timeout_for('gemini'),
+        }
+
+    # Extract prompt from Gemini-style payload
+    user_prompt = _extract_user_prompt(payload)
+    system_instruction = _system_instruction(payload)
+
+    if provider == 'anthropic':
+        # Add JSON format instruction to the prompt
+        if scene_count > 1:
+            shape = f'a "scenes" array of exactly {scene_count} objects, each with these fields'
+        else:
+            shape = 'these fields'
+        enhanced_prompt = f"{user_prompt}\n\nRespond with ONLY a JSON object with {shape}: narrative, image_prompt, summary_point"
+        body = {
+            "model": LLM_MODELS['anthropic'],
+            "max_tokens": min(4096, 1024 * scene_count),
+            "messages": [
+                {"role": "user", "content": enhanced_prompt}
+            ],
+            "system": system_instruction or "You are a creative storyteller."
+        }
+        headers = {
+            "x-api-key": api_key,
+            "anthropic-version": "2023-06-01",
+            "Content-Type": "application/json"
+        }
+    else:
+        body = {
+            "model": LLM_MODELS[provider],
             "messages": [
                 {"role": "system", "content": system_instruction or "You are a creative storyteller."},
                 {"role": "user", "content": user_prompt}
             ],
-            "temperature": 0.8,
+            "temperature": LLM_TEMPERATURES[provider],
             "response_format": {"type": "json_object"}
         }
-        
-        print(f"[GROQ] Calling Groq API...")
-        response = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
-            headers={"Authorization": f"Bearer {GROQ_API_KEY}", "Content-Type": "application/json"},
-            json=groq_payload,
-            timeout=15
-        )
-        response.raise_for_status()
-        
-        data = response.json()
+        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+    return {'url': LLM_ENDPOINTS[provider], 'headers': headers, 'json': body, 'timeout': provider_client.timeout_for(provider)}
+
+
+def _normalized_llm_body(narrative_data, used_real_llm=True):
+    """Wrap narrative fields in the Gemini-style body the frontend expects."""
+    normalized = {
+        'narrative': narrative_data.get('narrative', ''),
+        'image_prompt': narrative_data.get('image_prompt', ''),
+        'summary_point': narrative_data.get('summary_point', '')
+    }
+    return {
+        'candidates': [{'content': {'parts': [{'text': json.dumps(normalized)}]}}],
+        'normalized_candidate': normalized,
+        'used_real_llm': used_real_llm
+    }
+
+
+def _request_llm_payload(user_id, data, config):
+    """Return the generate-prompt payload for a request.
+
+    Clients either send a full Gemini-style `payload`, or a
+    {"story": {"id", "prompt", "art_style"}} reference, in which case the
+    payload is assembled from server-side story context (story_context.py).
+    """
+    story = (data or {}).get('story')
+    if isinstance(story, dict) and story.get('id'):
+        return story_context.build_payload(user_id, story, config)
+    return data['payload']
+
+
+CONTEXT_MISSING_BODY = {'error': 'Story context not found on this server; resend the story history.',
+                        'context_missing': True}
+
+
+def _prefetch_digest(provider, payload):
+    """Identity of an assembled payload, used to match prefetched bodies."""
+    return llm_cache.key_for(provider, LLM_MODELS.get(provider, provider), payload)
+
+
+def _schedule_story_prefetch(user_id, session, config):
+    """Prefetch the next scene for the story in a just-saved session."""
+    story_id = (session or {}).get('storyId')
+    if not story_prefetch.enabled(config) or not story_id:
+        return
+    art_style = session.get('artStyle') or 'photorealistic cinematic'
+    app_obj = current_app._get_current_object()
+
+    def prepare(prompt):
+        cfg = current_app.config
+        story = {'id': story_id, 'prompt': prompt, 'art_style': art_style}
+        payload = story_context.build_payload(user_id, story, cfg)
+        provider = cfg.get('LLM_PROVIDER', 'gemini')
+        return provider, payload, _prefetch_digest(provider, payload)
+
+    def build(prompt):
+        with app_obj.app_context():
+            provider, payload, digest = prepare(prompt)
+            if provider == 'mock':
+                body = _mock_llm_body(payload)
+            else:
+                resp, status = _call_llm(provider, payload)
+                if status != 200:
+                    raise Exception(f'{provider} returned {status}')
+                body = resp.get_json(silent=True)
+            print(f"[PREFETCH] Ready: story={story_id} prompt={prompt!r}")
+            return digest, body
+
+    story_prefetch.schedule(user_id, story_id, build, config, digest_for=lambda prompt: prepare(prompt)[2])
+
+
+def _prefetched_llm_body(user_id, data, provider, payload, config):
+    """Return the prefetched body for a story-mode request, or None."""
+    story = data.get('story') if isinstance(data, dict) else None
+    if not story_prefetch.enabled(config) or not isinstance(story, dict) or not story.get('id'):
+        return None
+    body = story_prefetch.take(user_id, story['id'], story.get('prompt') or 'Continue the story.',
+                               _prefetch_digest(provider, payload),
+                               wait=float(config.get('STORY_PREFETCH_WAIT_SECONDS', 30) or 0))
+    if body is None:
+        return None
+    print(f"[PREFETCH] Hit: story={story['id']}")
+    return dict(body, prefetched=True)
+
+
+def _llm_temperature(provider, payload):
+    """Effective sampling temperature of a generate-prompt call."""
+    if provider in LLM_TEMPERATURES:
+        return LLM_TEMPERATURES[provider]
+    try:
+        return float(((payload or {}).get('generationConfig') or {}).get('temperature', 1.0))
+    except (AttributeError, TypeError, ValueError):
+        return 1.0
+
+
+def _llm_cache_probe(provider, payload, data, config):
+    """Look a generate-prompt call up in the response cache.
+
+    Returns (cache_key, temperature, cached_body). cache_key is None when the
+    cache is off, bypassed for this temperature, or the client sent
+    "cache": false (e.g. to regenerate a scene).
+    """
+    if not llm_cache.enabled(config) or (data or {}).get('cache') is False:
+        return None, None, None
+    temperature = _llm_temperature(provider, payload)
+    if llm_cache.bypass(temperature, config):
+        return None, temperature, None
+    model = LLM_MODELS.get(provider) or config.get('STORY_API_URL')
+    key = llm_cache.key_for(provider, model, payload)
+    candidate = llm_cache.lookup(key, temperature, config)
+    if candidate is None:
+        return key, temperature, None
+    body = _normalized_llm_body(candidate)
+    body['cached'] = True
+    return key, temperature, body
+
+
+def _llm_cache_fill(key, temperature, body, config):
+    """Store a successful real-LLM body under the key from _llm_cache_probe."""
+    if key and isinstance(body, dict) and body.get('used_real_llm'):
+        llm_cache.store(key, body.get('normalized_candidate'), temperature, config)
+
+
+def _llm_response_text(provider, data):
+    """Return the generated text from a raw upstream (non-streaming) response."""
+    if provider == 'anthropic':
+        return data['content'][0]['text']
+    if provider in ('groq', 'openai'):
+        return data['choices'][0]['message']['content']
+    return data['candidates'][0]['content']['parts'][0]['text']
+
+
+def _parse_llm_response(provider, data, payload):
+    """Convert a raw upstream JSON response into the client response body."""
+    if provider == 'gemini':
+        return _normalize_gemini_response(data, payload)
+
+    if provider == 'anthropic':
+        content = data['content'][0]['text']
+        # Try to parse JSON from response
+        try:
+            narrative_data = json.loads(content)
+        except Exception:
+            # If not JSON, extract from text
+            narrative_data = {'narrative': content, 'image_prompt': content[:200], 'summary_point': content[:100]}
+    else:
         content = data['choices'][0]['message']['content']
         narrative_data = json.loads(content)
-        
-        # Convert to Gemini-style response
-        normalized = {
-            'narrative': narrative_data.get('narrative', ''),
-            'image_prompt': narrative_data.get('image_prompt', ''),
-            'summary_point': narrative_data.get('summary_point', '')
-        }
-        
-        return jsonify({
-            'candidates': [{'content': {'parts': [{'text': json.dumps(normalized)}]}}],
-            'normalized_candidate': normalized,
-            'used_real_llm': True
-        }), 200
-        
-    except Exception as e:
-        print(f"[GROQ ERROR] {str(e)}")
-        return jsonify({'error': f'Groq API error: {str(e)}'}), 500
 
+    return _normalized_llm_body(narrative_data)
 
-def _call_openai_llm(payload):
-    """Call OpenAI API (GPT models)."""
+
+def _call_llm_provider(provider, payload):
+    """Call a non-Gemini LLM provider and return a Flask (response, status)."""
+    label = LLM_LABELS[provider]
     try:
-        from flask import current_app, jsonify
-        
-        OPENAI_API_KEY = current_app.config.get('OPENAI_API_KEY')
-        if not OPENAI_API_KEY:
-            return jsonify({'error': 'OPENAI_API_KEY not configured'}), 500
-        
-        user_prompt = _extract_user_prompt(payload)
-        system_instruction = payload.get('systemInstruction', {}).get('parts', [{}])[0].get('text', '')
-        
-        openai_payload = {
-            "model": "gpt-3.5-turbo",  # or "gpt-4" if you have access
-            "messages": [
-                {"role": "system", "content": system_instruction or "You are a creative storyteller."},
-                {"role": "user", "content": user_prompt}
-            ],
-            "temperature": 0.8,
-            "response_format": {"type": "json_object"}
-        }
-        
-        print(f"[OPENAI] Calling OpenAI API...")
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"},
-            json=openai_payload,
-            timeout=20
+        spec = _build_llm_request(provider, payload, current_app.config)
+        if spec is None:
+            return jsonify({'error': f'{LLM_KEY_NAMES[provider]} not configured'}), 500
+
+        print(f"[{provider.upper()}] Calling {label} API...")
+        response = provider_client.post(
+            spec['url'],
+            provider=provider,
+            headers=spec['headers'],
+            json=spec['json'],
+            timeout=spec['timeout']
         )
         response.raise_for_status()
-        
-        data = response.json()
-        content = data['choices'][0]['message']['content']
-        narrative_data = json.loads(content)
-        
-        normalized = {
-            'narrative': narrative_data.get('narrative', ''),
-            'image_prompt': narrative_data.get('image_prompt', ''),
-            'summary_point': narrative_data.get('summary_point', '')
-        }
-        
-        return jsonify({
-            'candidates': [{'content': {'parts': [{'text': json.dumps(normalized)}]}}],
-            'normalized_candidate': normalized,
-            'used_real_llm': True
-        }), 200
-        
+        return jsonify(_parse_llm_response(provider, response.json(), payload)), 200
+
     except Exception as e:
-        print(f"[OPENAI ERROR] {str(e)}")
-        return jsonify({'error': f'OpenAI API error: {str(e)}'}), 500
+        print(f"[{provider.upper()} ERROR] {str(e)}")
+        return jsonify({'error': f'{label} API error: {str(e)}'}), 500
+
+
+def _call_groq_llm(payload):
+    """Call Groq API for fast, free LLM inference."""
+    return _call_llm_provider('groq', payload)
+
+
+def _call_openai_llm(payload):
+    """Call OpenAI API (GPT models)."""
+    return _call_llm_provider('openai', payload)
 
 
 def _call_anthropic_llm(payload):
     """Call Anthropic Claude API."""
+    return _call_llm_provider('anthropic', payload)
+
+
+def _first_prompt_text(payload):
+    """Best-effort extraction of the first content text in a payload."""
+    prompt_text = ''
     try:
-        from flask import current_app, jsonify
-        
-        ANTHROPIC_API_KEY = current_app.config.get('ANTHROPIC_API_KEY')
-        if not ANTHROPIC_API_KEY:
-            return jsonify({'error': 'ANTHROPIC_API_KEY not configured'}), 500
-        
-        user_prompt = _extract_user_prompt(payload)
-        system_instruction = payload.get('systemInstruction', {}).get('parts', [{}])[0].get('text', '')
-        
-        # Add JSON format instruction to the prompt
-        enhanced_prompt = f"{user_prompt}\n\nRespond with ONLY a JSON object with these fields: narrative, image_prompt, summary_point"
-        
-        anthropic_payload = {
-            "model": "claude-3-haiku-20240307",  # Fast, cheap model
-            "max_tokens": 1024,
-            "messages": [
-                {"role": "user", "content": enhanced_prompt}
-            ],
-            "system": system_instruction or "You are a creative storyteller."
-        }
-        
-        print(f"[ANTHROPIC] Calling Anthropic API...")
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers={
-                "x-api-key": ANTHROPIC_API_KEY,
-                "anthropic-version": "2023-06-01",
-                "Content-Type": "application/json"
-            },
-            json=anthropic_payload,
-            timeout=20
-        )
-        response.raise_for_status()
-        
-        data = response.json()
-        content = data['content'][0]['text']
-        
-        # Try to parse JSON from response
+        if isinstance(payload, dict):
+            contents = payload.get('contents') or payload.get('messages')
+            if contents and isinstance(contents, list) and len(contents) > 0:
+                first = contents[0]
+                # payload may use parts or text directly
+                if isinstance(first, dict):
+                    parts = first.get('parts') or []
+                    if parts and isinstance(parts, list) and len(parts) > 0:
+                        first_part = parts[0]
+                        if isinstance(first_part, dict):
+                            prompt_text = first_part.get('text','')
+                        else:
+                            prompt_text = str(first_part)
+                    else:
+                        prompt_text = first.get('text','') or ''
+                else:
+                    prompt_text = str(first)
+    except Exception:
+        prompt_text = str(payload)
+    return prompt_text
+
+
+def _mock_llm_body(payload):
+    """Deterministic mock LLM response body for LLM_PROVIDER=mock."""
+    # Try to derive a short prompt text from the payload for better mock outputs
+    prompt_text = _first_prompt_text(payload)
+
+    # Build a richer deterministic narrative for local testing so the
+    # frontend receives a believable story even without a real LLM.
+    narrative = _synthesize_narrative(prompt_text, paragraphs=4)
+    image_prompt = f"{prompt_text[:160]} -- photorealistic cinematic"
+    summary_point = narrative.split('\n')[0][:160]
+
+    # Mark this as mock (not from a real upstream LLM)
+    return _normalized_llm_body({
+        'narrative': narrative,
+        'image_prompt': image_prompt,
+        'summary_point': summary_point
+    }, used_real_llm=False)
+
+
+def _normalize_gemini_text(txt, payload):
+    """Parse a Gemini candidate text into {narrative, image_prompt, summary_point}."""
+    txt = (txt or '').strip()
+
+    # --- Sanitize common LLM artifacts ---
+    try:
+        if txt.startswith('```'):
+            nl = txt.find('\n')
+            if nl != -1:
+                txt = txt[nl+1:]
+            if txt.endswith('```'):
+                txt = txt[:-3].strip()
+    except Exception:
+        pass
+
+    parsed = None
+    try:
+        if '{' in txt and '}' in txt:
+            start = txt.find('{')
+            end = txt.rfind('}')
+            candidate = txt[start:end+1]
+            parsed = json.loads(candidate)
+    except Exception:
+        parsed = None
+
+    if parsed is None:
         try:
-            narrative_data = json.loads(content)
-        except:
-            # If not JSON, extract from text
-            narrative_data = {'narrative': content, 'image_prompt': content[:200], 'summary_point': content[:100]}
-        
-        normalized = {
-            'narrative': narrative_data.get('narrative', ''),
-            'image_prompt': narrative_data.get('image_prompt', ''),
-            'summary_point': narrative_data.get('summary_point', '')
-        }
-        
-        return jsonify({
-            'candidates': [{'content': {'parts': [{'text': json.dumps(normalized)}]}}],
-            'normalized_candidate': normalized,
-            'used_real_llm': True
-        }), 200
+            parsed = json.loads(txt)
+        except Exception:
+            parsed = {'narrative': txt}
+
+    narrative = parsed.get('narrative') or parsed.get('text') or ''
+    image_prompt = parsed.get('image_prompt') or ''
+    summary_point = parsed.get('summary_point') or parsed.get('summary') or ''
+
+    if not image_prompt:
+        short = ''
+        if narrative:
+            short = narrative.split('\n')[0].split('. ')[0][:180]
+        else:
+            try:
+                short = str(payload)[:180]
+            except Exception:
+                short = ''
+        image_prompt = f"{short} -- photorealistic cinematic"
+
+    return {
+        'narrative': narrative,
+        'image_prompt': image_prompt,
+        'summary_point': summary_point
+    }
+
+
+def _normalize_gemini_response(resp_json, payload):
+    """Post-process a Gemini response so it always carries a normalized candidate.
+
+    Ensures candidates[0].content.parts[0].text is a JSON string containing
+    narrative, image_prompt and summary_point, and sets
+    resp_json['normalized_candidate'] so the frontend can rely on it. Some
+    upstream responses have no candidates or free-form text; those are
+    synthesized locally.
+    """
+    try:
+        if not isinstance(resp_json, dict):
+            resp_json = {'raw': resp_json}
+    except Exception:
+        resp_json = {'raw': str(resp_json)}
+    try:
+        print('GENERATE_PROMPT_RAW', str(resp_json)[:1000])
+    except Exception:
+        pass
+    try:
+        cand = resp_json.get('candidates', [])
+
+        def _synthesize_from_payload(reason='fallback'):
+            prompt_text = _first_prompt_text(payload)
+            if not prompt_text:
+                prompt_text = str(payload)[:200]
+
+            narrative = _synthesize_narrative(prompt_text, paragraphs=4)
+            image_prompt = f"{prompt_text[:160]} -- photorealistic cinematic"
+            summary_point = narrative.split('\n')[0][:160]
+            normalized_local = {
+                'narrative': narrative,
+                'image_prompt': image_prompt,
+                'summary_point': summary_point
+            }
+            resp_json['normalized_candidate'] = normalized_local
+            resp_json['used_real_llm'] = False
+            resp_json['candidates'] = [{
+                'content': {
+                    'parts': [{ 'text': json.dumps(normalized_local) }]
+                },
+                'note': f'synthesized because {reason}'
+            }]
+
+        if isinstance(cand, list) and len(cand) > 0:
+            content = cand[0].get('content', {})
+            parts = content.get('parts', [])
+            if not isinstance(parts, list) or len(parts) == 0 or not parts[0].get('text'):
+                _synthesize_from_payload('empty parts from upstream')
+            else:
+                normalized = _normalize_gemini_text(parts[0].get('text', ''), payload)
+                parts[0]['text'] = json.dumps(normalized)
+                try:
+                    print('GENERATE_PROMPT_NORMALIZED', json.dumps(normalized)[:1000])
+                except Exception:
+                    pass
+                resp_json['normalized_candidate'] = normalized
+                resp_json['used_real_llm'] = True
+                content['parts'] = parts
+                cand[0]['content'] = content
+                resp_json['candidates'] = cand
+        else:
+            _synthesize_from_payload('no candidates returned')
+    except Exception:
+        # If any post-processing fails, ignore and return original provider response
+        pass
+    return resp_json
+
+
+def _call_gemini_llm(payload):
+    """Call the Google Gemini API (default provider)."""
+    GEMINI_API_KEY = current_app.config['GEMINI_API_KEY']
+    STORY_API_URL = current_app.config['STORY_API_URL']
+    spec = _build_llm_request('gemini', payload, current_app.config)
+
+    # Route to external Gemini API. FORCED to use real LLM - NO fallback.
+    # Log all requests and responses for debugging.
+    print(f"[LLM FORCE] Attempting to call real Gemini API with key: {GEMINI_API_KEY[:20]}...")
+    print(f"[LLM FORCE] Story API URL: {STORY_API_URL}")
+    try:
+        response = None
+        # (connect, read) tuple; the read part adapts to Gemini's recent p99
+        timeout_secs = spec['timeout'][1]
+        print(f"[LLM FORCE] Attempting to call real Gemini API with timeout={timeout_secs}s")
+        try:
+            print(f"[LLM FORCE] POST to {STORY_API_URL}")
+            response = provider_client.post(
+                spec['url'],
+                provider='gemini',
+                json=spec['json'],
+                timeout=spec['timeout']
+            )
+            print(f"[LLM FORCE] Response status: {response.status_code}")
+            response.raise_for_status()
+            print(f"[LLM FORCE] SUCCESS! Got response")
+        except requests.exceptions.Timeout as e:
+            print(f"[LLM FORCE] TIMEOUT ERROR after {timeout_secs}s: {str(e)}")
+            raise Exception(f"Gemini API timeout after {timeout_secs}s - API is not responding in time")
+        except requests.exceptions.ConnectionError as e:
+            print(f"[LLM FORCE] CONNECTION ERROR: {str(e)}")
+            raise Exception(f"Cannot connect to Gemini API: {str(e)}")
+        except requests.exceptions.RequestException as e:
+            print(f"[LLM FORCE] REQUEST ERROR: {str(e)}")
+            raise
+        if response is None:
+            raise Exception('No response from upstream LLM provider')
+        resp_json = _normalize_gemini_response(response.json(), payload)
+        return jsonify(resp_json), 200
+    except Exception as upstream_err:
+        # Log upstream error on server side (print for now).
+        try:
+            print('[LLM FORCE ERROR] LLM provider error:', str(upstream_err))
+            print('[LLM FORCE ERROR] Full error details:', repr(upstream_err))
+        except Exception:
+            pass
         
-    except Exception as e:
-        print(f"[ANTHROPIC ERROR] {str(e)}")
-        return jsonify({'error': f'Anthropic API error: {str(e)}'}), 500
+        # FORCE real LLM - NEVER fall back to mock. Always return error.
+        print('[LLM FORCE] ABORTING - Mock fallback is disabled. Real LLM is required.')
+        return jsonify({'error': str(upstream_err), 'message': 'LLM provider failed. Real LLM is required.'}), 500
+
+
+# Sync adapters keyed by LLM_PROVIDER value; unknown providers use Gemini.
+LLM_ADAPTERS = {
+    'gemini': _call_gemini_llm,
+    'groq': _call_groq_llm,
+    'openai': _call_openai_llm,
+    'anthropic': _call_anthropic_llm,
+}
+
+
+def _call_llm(provider, payload):
+    """Dispatch a generate-prompt payload to the adapter for `provider`."""
+    return LLM_ADAPTERS.get(provider, _call_gemini_llm)(payload)
 
 
 # --- AI ROUTING ENDPOINTS (Protected) ---
@@ -399,7 +1040,7 @@ def generate_prompt(user_id):
     """Routes the request to the Gemini LLM to generate narrative and prompt."""
     try:
         data = request.get_json()
-        payload = data['payload']
+        payload = _request_llm_payload(user_id, data, current_app.config)
 
         # Log start of request for debugging (do not print secrets)
         try:
@@ -410,575 +1051,674 @@ def generate_prompt(user_id):
         provider = current_app.config.get('LLM_PROVIDER', 'gemini')
         print(f"[LLM] Using provider: {provider}")
 
-        if provider == 'mock':
-            # Try to derive a short prompt text from the payload for better mock outputs
-            prompt_text = ''
-            try:
-                if isinstance(payload, dict):
-                    contents = payload.get('contents') or payload.get('messages')
-                    if contents and isinstance(contents, list) and len(contents) > 0:
-                        first = contents[0]
-                        # payload may use parts or text directly
-                        if isinstance(first, dict):
-                            parts = first.get('parts') or []
-                            if parts and isinstance(parts, list) and len(parts) > 0:
-                                first_part = parts[0]
-                                if isinstance(first_part, dict):
-                                    prompt_text = first_part.get('text','')
-                                else:
-                                    prompt_text = str(first_part)
-                            else:
-                                prompt_text = first.get('text','') or ''
-                        else:
-                            prompt_text = str(first)
-            except Exception:
-                prompt_text = str(payload)
+        prefetched = _prefetched_llm_body(user_id, data, provider, payload, current_app.config)
+        if prefetched is not None:
+            _speculate_image(user_id, data, prefetched)
+            return jsonify(prefetched), 200
 
-            # Build a richer deterministic narrative for local testing so the
-            # frontend receives a believable story even without a real LLM.
-            narrative = _synthesize_narrative(prompt_text, paragraphs=4)
-            image_prompt = f"{prompt_text[:160]} -- photorealistic cinematic"
-            summary_point = narrative.split('\n')[0][:160]
+        if provider == 'mock':
+            body = _mock_llm_body(payload)
+            _speculate_image(user_id, data, body)
+            return jsonify(body), 200
 
-            normalized = {
-                'narrative': narrative,
-                'image_prompt': image_prompt,
-                'summary_point': summary_point
-            }
-            mock_body = {
-                'candidates': [
-                    {
-                        'content': {
-                            'parts': [
-                                { 'text': json.dumps(normalized) }
-                            ]
-                        }
-                    }
-                ],
-                'normalized_candidate': normalized
-            }
-            # Mark this as mock (not from a real upstream LLM)
-            try:
-                mock_body['used_real_llm'] = False
-            except Exception:
-                pass
-            return jsonify(mock_body), 200
+        cache_key, temperature, cached_body = _llm_cache_probe(provider, payload, data, current_app.config)
+        if cached_body is not None:
+            print(f"[LLM] Response cache hit ({cache_key[:12]})")
+            _speculate_image(user_id, data, cached_body)
+            return jsonify(cached_body), 200
 
         # --- Handle alternative LLM providers ---
-        if provider == 'groq':
-            return _call_groq_llm(payload)
-        elif provider == 'openai':
-            return _call_openai_llm(payload)
-        elif provider == 'anthropic':
-            return _call_anthropic_llm(payload)
+        hedge_provider = llm_hedge.hedge_provider_for(provider, current_app.config)
+        if hedge_provider:
+            resp, status = llm_hedge.call_with_hedge(provider, hedge_provider, payload, _call_llm)
+        else:
+            resp, status = _call_llm(provider, payload)
+        if status == 200:
+            body = resp.get_json(silent=True)
+            _llm_cache_fill(cache_key, temperature, body, current_app.config)
+            _speculate_image(user_id, data, body)
+        return resp, status
+
+    except story_context.ContextMissing:
+        return jsonify(CONTEXT_MISSING_BODY), 409
+    except requests.exceptions.HTTPError as e:
+        # Better error handling for external API issues
+        return jsonify({'error': f"LLM API Error: {e.response.text}"}), e.response.status_code
+    except Exception as e:
+        return jsonify({'error': f"Internal Server Error during LLM call: {str(e)}"}), 500
 
-        # Default: Gemini
-        GEMINI_API_KEY = current_app.config['GEMINI_API_KEY']
-        STORY_API_URL = current_app.config['STORY_API_URL']
 
-        # Route to external Gemini API. FORCED to use real LLM - NO fallback.
-        # Log all requests and responses for debugging.
-        print(f"[LLM FORCE] Attempting to call real Gemini API with key: {GEMINI_API_KEY[:20]}...")
-        print(f"[LLM FORCE] Story API URL: {STORY_API_URL}")
-        try:
-            response = None
-            session = _get_session()
-            # AGGRESSIVE timeout - fail fast if API is slow
-            timeout_secs = 8  # Ultra-aggressive 8 second timeout
-            print(f"[LLM FORCE] Attempting to call real Gemini API with timeout={timeout_secs}s")
-            try:
-                print(f"[LLM FORCE] POST to {STORY_API_URL}")
-                response = session.post(
-                    f"{STORY_API_URL}?key={GEMINI_API_KEY}", 
-                    json=payload, 
-                    timeout=timeout_secs
-                )
-                print(f"[LLM FORCE] Response status: {response.status_code}")
-                response.raise_for_status()
-                print(f"[LLM FORCE] SUCCESS! Got response")
-            except requests.exceptions.Timeout as e:
-                print(f"[LLM FORCE] TIMEOUT ERROR after {timeout_secs}s: {str(e)}")
-                raise Exception(f"Gemini API timeout after {timeout_secs}s - API is not responding in time")
-            except requests.exceptions.ConnectionError as e:
-                print(f"[LLM FORCE] CONNECTION ERROR: {str(e)}")
-                raise Exception(f"Cannot connect to Gemini API: {str(e)}")
-            except requests.exceptions.RequestException as e:
-                print(f"[LLM FORCE] REQUEST ERROR: {str(e)}")
-                raise
-            if response is None:
-                raise Exception('No response from upstream LLM provider')
-            # Post-process the LLM response to ensure we always return a JSON
-            # string containing narrative, image_prompt and summary_point in
-            # candidates[0].content.parts[0].text. Some LLM providers may return
-            # free-form text; normalize it so the frontend never sees undefined
-            # for the visual prompt.
-            resp_json = response.json()
-            # Ensure we always expose a normalized candidate to the client.
-            # Some upstream providers return unexpected shapes (no candidates
-            # or free-form text). We'll try to normalize below and always set
-            # resp_json['normalized_candidate'] so the frontend can rely on it.
-            try:
-                if not isinstance(resp_json, dict):
-                    resp_json = {'raw': resp_json}
-            except Exception:
-                resp_json = {'raw': str(resp_json)}
-            try:
-                print('GENERATE_PROMPT_RAW', str(resp_json)[:1000])
-            except Exception:
-                pass
-            try:
-                cand = resp_json.get('candidates', [])
+# --- STREAMING (Server-Sent Events) ---
 
-                def _synthesize_from_payload(reason='fallback'):
-                    prompt_text = ''
-                    try:
-                        if isinstance(payload, dict):
-                            contents = payload.get('contents') or payload.get('messages')
-                            if contents and isinstance(contents, list) and len(contents) > 0:
-                                first = contents[0]
-                                if isinstance(first, dict):
-                                    parts_local = first.get('parts') or []
-                                    if parts_local and isinstance(parts_local, list) and len(parts_local) > 0:
-                                        p0 = parts_local[0]
-                                        prompt_text = p0.get('text','') if isinstance(p0, dict) else str(p0)
-                                    else:
-                                        prompt_text = first.get('text','') or ''
-                                else:
-                                    prompt_text = str(first)
-                        if not prompt_text:
-                            prompt_text = str(payload)[:200]
-                    except Exception:
-                        prompt_text = str(payload)
-
-                    narrative = _synthesize_narrative(prompt_text, paragraphs=4)
-                    image_prompt = f"{prompt_text[:160]} -- photorealistic cinematic"
-                    summary_point = narrative.split('\n')[0][:160]
-                    normalized_local = {
-                        'narrative': narrative,
-                        'image_prompt': image_prompt,
-                        'summary_point': summary_point
-                    }
-                    resp_json['normalized_candidate'] = normalized_local
-                    resp_json['used_real_llm'] = False
-                    resp_json['candidates'] = [{
-                        'content': {
-                            'parts': [{ 'text': json.dumps(normalized_local) }]
-                        },
-                        'note': f'synthesized because {reason}'
-                    }]
-
-                if isinstance(cand, list) and len(cand) > 0:
-                    content = cand[0].get('content', {})
-                    parts = content.get('parts', [])
-                    if not isinstance(parts, list) or len(parts) == 0 or not parts[0].get('text'):
-                        _synthesize_from_payload('empty parts from upstream')
-                    else:
-                        txt = parts[0].get('text', '').strip()
+class _NarrativeStreamExtractor:
+    """Incrementally pull the "narrative" string value out of streamed JSON.
 
-                        # --- Sanitize common LLM artifacts ---
-                        try:
-                            if txt.startswith('```'):
-                                nl = txt.find('\n')
-                                if nl != -1:
-                                    txt = txt[nl+1:]
-                                if txt.endswith('```'):
-                                    txt = txt[:-3].strip()
-                        except Exception:
-                            pass
+    LLMs emit the response object token by token, so the narrative arrives
+    as fragments of a JSON string literal (possibly inside ```json fences).
+    feed() returns the newly decoded narrative text for each chunk. If the
+    output turns out not to be JSON at all, the raw text is passed through.
+    """
 
-                        parsed = None
-                        try:
-                            if '{' in txt and '}' in txt:
-                                start = txt.find('{')
-                                end = txt.rfind('}')
-                                candidate = txt[start:end+1]
-                                parsed = json.loads(candidate)
-                        except Exception:
-                            parsed = None
-
-                        if parsed is None:
-                            try:
-                                parsed = json.loads(txt)
-                            except Exception:
-                                parsed = {'narrative': txt}
-
-                        narrative = parsed.get('narrative') or parsed.get('text') or ''
-                        image_prompt = parsed.get('image_prompt') or ''
-                        summary_point = parsed.get('summary_point') or parsed.get('summary') or ''
-
-                        if not image_prompt:
-                            short = ''
-                            if narrative:
-                                short = narrative.split('\n')[0].split('. ')[0][:180]
-                            else:
-                                try:
-                                    short = str(payload)[:180]
-                                except Exception:
-                                    short = ''
-                            image_prompt = f"{short} -- photorealistic cinematic"
-
-                        normalized = {
-                            'narrative': narrative,
-                            'image_prompt': image_prompt,
-                            'summary_point': summary_point
-                        }
-                        parts[0]['text'] = json.dumps(normalized)
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0
+        self.mode = 'detect'  # detect -> seek -> value -> done | raw
+
+    def feed(self, chunk):
+        self.buffer += chunk or ''
+        out = []
+        if self.mode == 'detect':
+            stripped = self.buffer.lstrip()
+            if not stripped:
+                return ''
+            if stripped[0] in '{`':
+                self.mode = 'seek'
+            else:
+                self.mode = 'raw'
+                self.pos = len(self.buffer)
+                return self.buffer
+        if self.mode == 'raw':
+            text = self.buffer[self.pos:]
+            self.pos = len(self.buffer)
+            return text
+        if self.mode == 'seek':
+            idx = self.buffer.find('"narrative"', self.pos)
+            if idx == -1:
+                return ''
+            colon = self.buffer.find(':', idx + len('"narrative"'))
+            if colon == -1:
+                return ''
+            quote = self.buffer.find('"', colon + 1)
+            if quote == -1:
+                return ''
+            self.pos = quote + 1
+            self.mode = 'value'
+        if self.mode == 'value':
+            buf = self.buffer
+            i = self.pos
+            while i < len(buf):
+                ch = buf[i]
+                if ch == '"':
+                    self.mode = 'done'
+                    i += 1
+                    break
+                if ch == '\\':
+                    if i + 1 >= len(buf):
+                        break  # wait for the rest of the escape
+                    esc = buf[i + 1]
+                    if esc == 'u':
+                        if i + 6 > len(buf):
+                            break
                         try:
-                            print('GENERATE_PROMPT_NORMALIZED', json.dumps(normalized)[:1000])
-                        except Exception:
+                            out.append(chr(int(buf[i + 2:i + 6], 16)))
+                        except ValueError:
                             pass
-                        try:
-                            resp_json['normalized_candidate'] = normalized
-                            resp_json['used_real_llm'] = True
-                        except Exception:
-                            pass
-                        content['parts'] = parts
-                        cand[0]['content'] = content
-                        resp_json['candidates'] = cand
-                else:
-                    _synthesize_from_payload('no candidates returned')
-            except Exception:
-                # If any post-processing fails, ignore and return original provider response
-                pass
+                        i += 6
+                        continue
+                    out.append(self._ESCAPES.get(esc, esc))
+                    i += 2
+                    continue
+                out.append(ch)
+                i += 1
+            self.pos = i
+        return ''.join(out)
+
+
+def _build_llm_stream_request(provider, payload, config):
+    """Streaming variant of _build_llm_request (Gemini SSE / OpenAI / Anthropic)."""
+    spec = _build_llm_request(provider, payload, config)
+    if spec is None:
+        return None
+    if provider == 'gemini':
+        stream_url = config.get('STORY_API_URL').replace(':generateContent', ':streamGenerateContent')
+        spec['url'] = f"{stream_url}?alt=sse&key={config.get(LLM_KEY_NAMES['gemini'])}"
+    else:
+        spec['json'] = dict(spec['json'], stream=True)
+    return spec
+
+
+def _iter_sse_data(response):
+    """Yield the data payload of each event in an upstream SSE response."""
+    data_lines = []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == '':
+            if data_lines:
+                yield '\n'.join(data_lines)
+                data_lines = []
+            continue
+        if line.startswith('data:'):
+            data_lines.append(line[5:].lstrip())
+    if data_lines:
+        yield '\n'.join(data_lines)
+
+
+def _stream_text_deltas(provider, response):
+    """Yield raw text fragments from a provider's streaming response."""
+    for data in _iter_sse_data(response):
+        if data == '[DONE]':
+            break
+        try:
+            event = json.loads(data)
+        except ValueError:
+            continue
+        if provider == 'gemini':
+            for cand in event.get('candidates', [])[:1]:
+                for part in cand.get('content', {}).get('parts', []):
+                    if part.get('text'):
+                        yield part['text']
+        elif provider == 'anthropic':
+            if event.get('type') == 'content_block_delta':
+                text = event.get('delta', {}).get('text')
+                if text:
+                    yield text
+        else:
+            for choice in event.get('choices', [])[:1]:
+                text = (choice.get('delta') or {}).get('content')
+                if text:
+                    yield text
+
+
+def _final_llm_body(provider, full_text, payload):
+    """Normalize the fully streamed text exactly like the non-streaming path."""
+    if provider == 'gemini':
+        data = {'candidates': [{'content': {'parts': [{'text': full_text}]}}]}
+    elif provider == 'anthropic':
+        data = {'content': [{'text': full_text}]}
+    else:
+        data = {'choices': [{'message': {'content': full_text}}]}
+    try:
+        return _parse_llm_response(provider, data, payload)
+    except Exception:
+        # Truncated/invalid JSON: fall back to the lenient Gemini text parser
+        return _normalized_llm_body(_normalize_gemini_text(full_text, payload))
 
-            return jsonify(resp_json), 200
-        except Exception as upstream_err:
-            # Log upstream error on server side (print for now).
-            try:
-                print('[LLM FORCE ERROR] LLM provider error:', str(upstream_err))
-                print('[LLM FORCE ERROR] Full error details:', repr(upstream_err))
-            except Exception:
-                pass
-            
-            # FORCE real LLM - NEVER fall back to mock. Always return error.
-            print('[LLM FORCE] ABORTING - Mock fallback is disabled. Real LLM is required.')
-            return jsonify({'error': str(upstream_err), 'message': 'LLM provider failed. Real LLM is required.'}), 500
-            
 
-    except requests.exceptions.HTTPError as e:
-        # Better error handling for external API issues
-        return jsonify({'error': f"LLM API Error: {e.response.text}"}), e.response.status_code
-    except Exception as e:
-        return jsonify({'error': f"Internal Server Error during LLM call: {str(e)}"}), 500
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
-@ai_bp.route('/generate-image', methods=['POST'])
+@ai_bp.route('/generate-prompt/stream', methods=['POST'])
 @token_required
-def generate_image(user_id):
-    """Routes the request to the Imagen model to generate the image."""
+def generate_prompt_stream(user_id):
+    """Streaming variant of /generate-prompt using Server-Sent Events.
+
+    Emits `token` events ({"text": ...}) with narrative text as the upstream
+    LLM produces it, then a single `final` event carrying the same body the
+    non-streaming route returns (including normalized_candidate). Failures
+    are reported as an `error` event.
+    """
+    data = request.get_json() or {}
     try:
-        data = request.get_json()
-        payload = data['payload']
+        payload = _request_llm_payload(user_id, data, current_app.config)
+    except story_context.ContextMissing:
+        return jsonify(CONTEXT_MISSING_BODY), 409
+    except KeyError:
+        return jsonify({'error': 'payload or story is required'}), 400
+    provider = current_app.config.get('LLM_PROVIDER', 'gemini')
+    if provider != 'mock' and provider not in LLM_KEY_NAMES:
+        provider = 'gemini'
+    config = current_app.config
+    print(f"[LLM STREAM] user={user_id} provider={provider}")
+
+    def generate():
+        yield ': stream opened\n\n'
+        prefetched = _prefetched_llm_body(user_id, data, provider, payload, config)
+        if prefetched is not None:
+            yield _sse_event('token', {'text': prefetched['normalized_candidate']['narrative']})
+            _speculate_image(user_id, data, prefetched)
+            yield _sse_event('final', prefetched)
+            return
+        if provider == 'mock':
+            body = _mock_llm_body(payload)
+            narrative = body['normalized_candidate']['narrative']
+            for i in range(0, len(narrative), 48):
+                yield _sse_event('token', {'text': narrative[i:i + 48]})
+            _speculate_image(user_id, data, body)
+            yield _sse_event('final', body)
+            return
 
-        print(f"\n[IMAGE] ========== IMAGE GENERATION START ==========")
-        print(f"[IMAGE] User: {user_id}")
-        print(f"[IMAGE] Payload keys: {list(payload.keys())}")
+        cache_key, temperature, cached_body = _llm_cache_probe(provider, payload, data, config)
+        if cached_body is not None:
+            yield _sse_event('token', {'text': cached_body['normalized_candidate']['narrative']})
+            _speculate_image(user_id, data, cached_body)
+            yield _sse_event('final', cached_body)
+            return
 
-        GEMINI_API_KEY = current_app.config.get('GEMINI_API_KEY')
-        IMAGE_API_URL = current_app.config.get('IMAGE_API_URL')
+        spec = _build_llm_stream_request(provider, payload, config)
+        if spec is None:
+            yield _sse_event('error', {'error': f'{LLM_KEY_NAMES[provider]} not configured'})
+            return
+        label = LLM_LABELS[provider]
+        response = None
+        try:
+            response = provider_client.post(
+                spec['url'],
+                provider=provider,
+                headers=spec['headers'],
+                json=spec['json'],
+                timeout=spec['timeout'],
+                stream=True
+            )
+            response.raise_for_status()
+            extractor = _NarrativeStreamExtractor()
+            pieces = []
+            for text in _stream_text_deltas(provider, response):
+                pieces.append(text)
+                narrative_delta = extractor.feed(text)
+                if narrative_delta:
+                    yield _sse_event('token', {'text': narrative_delta})
+            body = _final_llm_body(provider, ''.join(pieces), payload)
+            _llm_cache_fill(cache_key, temperature, body, config)
+            _speculate_image(user_id, data, body)
+            yield _sse_event('final', body)
+        except Exception as e:
+            print(f"[LLM STREAM ERROR] {label}: {str(e)}")
+            yield _sse_event('error', {'error': f'{label} API error: {str(e)}', 'message': 'LLM provider failed. Real LLM is required.'})
+        finally:
+            if response is not None:
+                response.close()
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+
+# --- BATCH (multi-scene) GENERATION ---
+
+# Providers asked for all scenes in one structured call; anything else (or a
+# structured call that fails) falls back to parallel single-scene calls.
+LLM_BATCH_PROVIDERS = ('gemini', 'groq', 'openai', 'anthropic')
+
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+
+def _get_batch_executor():
+    global _batch_executor
+    if _batch_executor is None:
+        with _batch_executor_lock:
+            if _batch_executor is None:
+                workers = int(current_app.config.get('LLM_BATCH_MAX_WORKERS', 8) or 8)
+                _batch_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='llm-batch')
+    return _batch_executor
+
+
+def _batch_llm_payload(payload, count):
+    """Turn a single-scene payload into one asking for `count` consecutive scenes."""
+    batch = copy.deepcopy(payload)
+    instruction = (
+        f"Write the next {count} consecutive scenes of the story, each continuing from the previous one. "
+        f'Respond with a JSON object {{"scenes": [...]}} containing exactly {count} objects, '
+        "each with the fields narrative, image_prompt and summary_point as described."
+    )
+    system = _system_instruction(batch)
+    batch['systemInstruction'] = {'parts': [{'text': f"{system}\n\n{instruction}" if system else instruction}]}
+    gen = batch.get('generationConfig')
+    if isinstance(gen, dict) and isinstance(gen.get('responseSchema'), dict):
+        gen['responseSchema'] = {
+            'type': 'OBJECT',
+            'properties': {'scenes': {'type': 'ARRAY', 'items': gen['responseSchema']}},
+            'required': ['scenes']
+        }
+    return batch
 
-        # Route to external Imagen API
-        # If a 'free' provider is selected, generate a free placeholder image
-        # from Picsum (no API key required). We use a deterministic seed based
-        # on the prompt so repeated requests for the same prompt return the
-        # same image.
-        provider = current_app.config.get('IMAGE_PROVIDER', 'google')
-        alternate_url = current_app.config.get('ALTERNATE_IMAGE_API_URL')
-        
-        print(f"[IMAGE] Provider: {provider}")
-        print(f"[IMAGE] Stability API Key configured: {bool(current_app.config.get('STABILITY_API_KEY'))}")
 
-        # Determine prompt and requested sample count for caching
-        prompt_text = _extract_prompt_from_payload(payload)
-        print(f"[IMAGE] Extracted prompt ({len(prompt_text)} chars): {prompt_text[:100]}...")
-        params = {}
+def _single_scene_payload(payload, index, count):
+    """Per-scene payload for the parallel fallback (scenes can't see each other)."""
+    single = copy.deepcopy(payload)
+    note = f"\n\n(This is scene {index + 1} of {count}; advance the story by {index + 1} step(s).)"
+    try:
+        single['contents'][-1]['parts'][0]['text'] += note
+    except (KeyError, IndexError, TypeError):
+        pass
+    return single
+
+
+def _parse_batch_scenes(text, payload):
+    """Extract and normalize the scene objects from a batch response text."""
+    txt = (text or '').strip()
+    if txt.startswith('```'):
+        nl = txt.find('\n')
+        txt = txt[nl + 1:] if nl != -1 else txt
+        if txt.endswith('```'):
+            txt = txt[:-3].strip()
+    try:
+        parsed = json.loads(txt)
+    except Exception:
+        start, end = txt.find('{'), txt.rfind('}')
+        parsed = json.loads(txt[start:end + 1]) if start != -1 and end > start else {}
+    items = parsed.get('scenes') if isinstance(parsed, dict) else parsed
+    scenes = []
+    for item in items if isinstance(items, list) else []:
+        if isinstance(item, dict):
+            # Same sanitization/normalization as a single-scene response
+            scenes.append(_normalize_gemini_text(json.dumps(item), payload))
+    return scenes
+
+
+def _call_llm_batch(provider, payload, count):
+    """One structured upstream call for `count` scenes; returns a list (maybe short)."""
+    batch_payload = _batch_llm_payload(payload, count)
+    spec = _build_llm_request(provider, batch_payload, current_app.config, scene_count=count)
+    if spec is None:
+        raise Exception(f'{LLM_KEY_NAMES[provider]} not configured')
+    print(f"[LLM BATCH] {LLM_LABELS[provider]}: requesting {count} scenes in one call")
+    response = provider_client.post(
+        spec['url'],
+        provider=provider,
+        headers=spec['headers'],
+        json=spec['json'],
+        # spec's timeout is learned from single-scene calls
+        timeout=provider_client.scale_timeout(provider, spec['timeout'], count)
+    )
+    response.raise_for_status()
+    return _parse_batch_scenes(_llm_response_text(provider, response.json()), payload)[:count]
+
+
+def _call_llm_parallel(provider, payload, indexes, count):
+    """Single-scene calls for `indexes`, run concurrently; failed ones are None."""
+    app = current_app._get_current_object()
+
+    def run(index):
+        with app.app_context():
+            single = _single_scene_payload(payload, index, count)
+            if provider == 'mock':
+                return _mock_llm_body(single)['normalized_candidate']
+            resp, status = _call_llm(provider, single)
+            body = resp.get_json(silent=True) or {}
+            return body.get('normalized_candidate') if status == 200 else None
+
+    return list(_get_batch_executor().map(run, indexes))
+
+
+@ai_bp.route('/generate-prompt/batch', methods=['POST'])
+@token_required
+def generate_prompt_batch(user_id):
+    """Generate `count` consecutive scenes for a storyboard in one request.
+
+    Accepts the same `payload` or `story` body as /generate-prompt plus
+    `count`. Returns {"scenes": [{narrative, image_prompt, summary_point}],
+    "mode": "batch" | "parallel" | "mixed"}.
+    """
+    try:
+        data = request.get_json() or {}
+        payload = _request_llm_payload(user_id, data, current_app.config)
+        max_scenes = int(current_app.config.get('LLM_BATCH_MAX_SCENES', 10))
         try:
-            params_obj = payload.get('parameters') if isinstance(payload, dict) else {}
-            if isinstance(params_obj, dict):
-                params['sampleCount'] = params_obj.get('sampleCount') or params_obj.get('samples') or 1
-                params['aspectRatio'] = params_obj.get('aspectRatio')
-        except Exception:
-            params['sampleCount'] = 1
+            count = int(data.get('count') or 1)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'count must be an integer'}), 400
+        if count < 1 or count > max_scenes:
+            return jsonify({'error': f'count must be between 1 and {max_scenes}'}), 400
 
-        cache_key = _make_image_cache_key(prompt_text, provider, params)
-        cache_ttl = current_app.config.get('IMAGE_CACHE_TTL_SECONDS', 60 * 60 * 24)
-        # Try to serve from cache first
-        cached = _load_image_cache(cache_key, ttl_seconds=cache_ttl)
-        if cached:
-            preds = [{'bytesBase64Encoded': b} for b in cached]
-            return jsonify({'predictions': preds, 'cached': True}), 200
+        provider = current_app.config.get('LLM_PROVIDER', 'gemini')
+        print(f"[LLM BATCH] user={user_id} provider={provider} count={count}")
 
-        if provider == 'free':
-            # Derive a seed from the prompt text for variety
+        scenes = []
+        if provider in LLM_BATCH_PROVIDERS and count > 1:
             try:
-                seed = hashlib.sha1(prompt_text.encode('utf-8')).hexdigest()[:8]
-            except Exception:
-                seed = hashlib.sha1(str(time.time()).encode('utf-8')).hexdigest()[:8]
-            picsum_url = f'https://picsum.photos/seed/{seed}/800/450'
-            pic_resp = requests.get(picsum_url)
-            if pic_resp.status_code == 200:
-                img_bytes = pic_resp.content
-                b64 = base64.b64encode(img_bytes).decode('utf-8')
-                # persist small picsum fallback to cache
-                try:
-                    _persist_image_cache(cache_key, [b64], prompt_text)
-                except Exception:
-                    pass
-                return jsonify({'predictions': [{'bytesBase64Encoded': b64}]}), 200
-            # If picsum fails for some reason, fall through to other handlers
+                scenes = _call_llm_batch(provider, payload, count)
+            except Exception as e:
+                print(f"[LLM BATCH] Structured batch call failed, falling back to single calls: {str(e)}")
+                scenes = []
+        batched = len(scenes)
+        if batched < count:
+            scenes.extend(_call_llm_parallel(provider, payload, range(batched, count), count))
+        if any(scene is None for scene in scenes):
+            return jsonify({'error': 'LLM provider failed for one or more scenes.',
+                            'scenes': scenes, 'message': 'LLM provider failed. Real LLM is required.'}), 502
+
+        mode = 'batch' if batched == count else ('mixed' if batched else 'parallel')
+        return jsonify({'scenes': scenes, 'count': count, 'mode': mode,
+                        'used_real_llm': provider != 'mock'}), 200
+    except story_context.ContextMissing:
+        return jsonify(CONTEXT_MISSING_BODY), 409
+    except KeyError:
+        return jsonify({'error': 'payload or story is required'}), 400
+    except Exception as e:
+        return jsonify({'error': f"Internal Server Error during batch LLM call: {str(e)}"}), 500
+
 
-        # If an alternate provider is configured, forward the call there instead
-        if provider != 'google' and alternate_url:
-            # Forward to alternate provider (best-effort: assume compatible request format)
-            alt_resp = requests.post(alternate_url, json=payload)
+def _generate_image_uncached(payload, provider, prompt_text, params, cache_key):
+    """Generate an image after a cache miss; returns a (response, status) tuple.
+
+    Runs once per cache key among concurrent callers (see generate_image).
+    """
+    GEMINI_API_KEY = current_app.config.get('GEMINI_API_KEY')
+    IMAGE_API_URL = current_app.config.get('IMAGE_API_URL')
+    alternate_url = current_app.config.get('ALTERNATE_IMAGE_API_URL')
+
+    if provider == 'free':
+        # Derive a seed from the prompt text for variety
+        try:
+            seed = hashlib.sha1(prompt_text.encode('utf-8')).hexdigest()[:8]
+        except Exception:
+            seed = hashlib.sha1(str(time.time()).encode('utf-8')).hexdigest()[:8]
+        picsum_url = f'https://picsum.photos/seed/{seed}/800/450'
+        pic_resp = provider_client.get(picsum_url)
+        if pic_resp.status_code == 200:
+            img_bytes = pic_resp.content
+            b64 = base64.b64encode(img_bytes).decode('utf-8')
+            # persist small picsum fallback to cache
             try:
-                alt_resp.raise_for_status()
-                return jsonify(alt_resp.json()), 200
-            except requests.exceptions.HTTPError:
-                # Continue to attempt Google Imagen below if alternate provider fails
+                _persist_image_cache(cache_key, [b64], prompt_text, provider, params)
+            except Exception:
                 pass
+            return jsonify({'predictions': [{'bytesBase64Encoded': b64}]}), 200
+        # If picsum fails for some reason, fall through to other handlers
 
-        # Support for cloud Stability.ai and local AUTOMATIC1111 (Stable Diffusion)
-        if provider == 'stability':
-            # Use Stability.ai REST API (v1) - requires STABILITY_API_KEY and engine/model name
-            stability_key = current_app.config.get('STABILITY_API_KEY')
-            engine = current_app.config.get('STABILITY_ENGINE')
-            if not stability_key:
-                return jsonify({'error': 'STABILITY_API_KEY not configured for stability provider.'}), 400
+    # If an alternate provider is configured, forward the call there instead
+    if provider != 'google' and alternate_url:
+        # Forward to alternate provider (best-effort: assume compatible request format)
+        alt_resp = provider_client.post(alternate_url, provider='alternate', json=payload)
+        try:
+            alt_resp.raise_for_status()
+            return jsonify(alt_resp.json()), 200
+        except requests.exceptions.HTTPError:
+            # Continue to attempt Google Imagen below if alternate provider fails
+            pass
 
-            # attempt to extract a simple prompt string from the payload
-            prompt_text = ''
-            try:
-                if isinstance(payload, dict):
-                    inst = payload.get('instances') or payload.get('inputs') or payload.get('prompt')
-                    if isinstance(inst, list) and len(inst) > 0:
-                        first = inst[0]
-                        if isinstance(first, dict):
-                            prompt_text = first.get('prompt') or first.get('text') or ''
-                        else:
-                            prompt_text = str(first)
-                    elif isinstance(inst, str):
-                        prompt_text = inst
+    # Support for cloud Stability.ai and local AUTOMATIC1111 (Stable Diffusion)
+    if provider == 'stability':
+        # Use Stability.ai REST API (v1) - requires STABILITY_API_KEY and engine/model name
+        stability_key = current_app.config.get('STABILITY_API_KEY')
+        engine = current_app.config.get('STABILITY_ENGINE')
+        if not stability_key:
+            return jsonify({'error': 'STABILITY_API_KEY not configured for stability provider.'}), 400
+
+        # attempt to extract a simple prompt string from the payload
+        prompt_text = ''
+        try:
+            if isinstance(payload, dict):
+                inst = payload.get('instances') or payload.get('inputs') or payload.get('prompt')
+                if isinstance(inst, list) and len(inst) > 0:
+                    first = inst[0]
+                    if isinstance(first, dict):
+                        prompt_text = first.get('prompt') or first.get('text') or ''
                     else:
-                        prompt_text = str(payload)
-            except Exception:
-                prompt_text = str(payload)
+                        prompt_text = str(first)
+                elif isinstance(inst, str):
+                    prompt_text = inst
+                else:
+                    prompt_text = str(payload)
+        except Exception:
+            prompt_text = str(payload)
 
-            print(f"[STABILITY] Calling Stability AI...")
-            print(f"[STABILITY] Engine: {engine}")
-            print(f"[STABILITY] Prompt ({len(prompt_text)} chars): {prompt_text[:150]}...")
-
-            stability_url = f'https://api.stability.ai/v1/generation/{engine}/text-to-image'
-            headers = {'Authorization': f'Bearer {stability_key}', 'Content-Type': 'application/json'}
-            body = {
-                'text_prompts': [{'text': prompt_text}],
-                'cfg_scale': 7,
-                'height': 1024,
-                'width': 1024,
-                'samples': 1
-            }
-            try:
-                # if params requested sampleCount override, use it
-                if params.get('sampleCount'):
-                    body['samples'] = int(params.get('sampleCount') or 1)
-                print(f"[STABILITY] POST to {stability_url}")
-                st_resp = requests.post(stability_url, headers=headers, json=body, timeout=60)
-                print(f"[STABILITY] Response status: {st_resp.status_code}")
-                st_resp.raise_for_status()
-                print(f"[STABILITY] SUCCESS!")
-            except requests.exceptions.HTTPError as e:
-                # If Stability returns an API error and fallbacks are enabled, provide Picsum
-                print(f"[STABILITY] HTTP Error: {st_resp.status_code}")
-                print(f"[STABILITY] Response: {st_resp.text[:200]}")
-                if current_app.config.get('USE_IMAGE_FALLBACK', True):
-                    print(f"[STABILITY] Falling back to Picsum...")
-                    b64 = _picsum_base64_from_prompt(prompt_text)
-                    if b64:
-                        try:
-                            _persist_image_cache(cache_key, [b64], prompt_text)
-                        except Exception:
-                            pass
-                        print(f"[STABILITY] Returned Picsum fallback image")
-                        return jsonify({'predictions': [{'bytesBase64Encoded': b64}], 'fallback': 'picsum'}), 200
-                try:
-                    return jsonify({'error': st_resp.json()}), st_resp.status_code
-                except Exception:
-                    return jsonify({'error': 'Stability API Error'}), 502
-            except Exception as e:
-                print(f"[STABILITY] Exception: {str(e)}")
-                if current_app.config.get('USE_IMAGE_FALLBACK', True):
-                    print(f"[STABILITY] Falling back to Picsum due to exception...")
-                    b64 = _picsum_base64_from_prompt(prompt_text)
-                    if b64:
-                        try:
-                            _persist_image_cache(cache_key, [b64], prompt_text)
-                        except Exception:
-                            pass
-                        print(f"[STABILITY] Returned Picsum fallback image")
-                        return jsonify({'predictions': [{'bytesBase64Encoded': b64}], 'fallback': 'picsum'}), 200
-                return jsonify({'error': f'Stability provider request failed: {str(e)}'}), 502
+        print(f"[STABILITY] Calling Stability AI...")
+        print(f"[STABILITY] Engine: {engine}")
+        print(f"[STABILITY] Prompt ({len(prompt_text)} chars): {prompt_text[:150]}...")
 
-            # Parse common response shapes for base64 images
+        try:
+            st_spec = _build_stability_request(prompt_text, params, current_app.config)
+            stability_url = st_spec['url']
+            print(f"[STABILITY] POST to {stability_url}")
+            st_resp = provider_client.post(stability_url, provider='stability', headers=st_spec['headers'], json=st_spec['json'], timeout=st_spec['timeout'])
+            print(f"[STABILITY] Response status: {st_resp.status_code}")
+            st_resp.raise_for_status()
+            print(f"[STABILITY] SUCCESS!")
+        except requests.exceptions.HTTPError as e:
+            # If Stability returns an API error and fallbacks are enabled, provide Picsum
+            print(f"[STABILITY] HTTP Error: {st_resp.status_code}")
+            print(f"[STABILITY] Response: {st_resp.text[:200]}")
+            if current_app.config.get('USE_IMAGE_FALLBACK', True):
+                print(f"[STABILITY] Falling back to Picsum...")
+                b64 = _picsum_base64_from_prompt(prompt_text)
+                if b64:
+                    try:
+                        _persist_image_cache(cache_key, [b64], prompt_text, provider, params)
+                    except Exception:
+                        pass
+                    print(f"[STABILITY] Returned Picsum fallback image")
+                    return jsonify({'predictions': [{'bytesBase64Encoded': b64}], 'fallback': 'picsum'}), 200
             try:
-                j = st_resp.json()
-                # Check for 'artifacts' or 'images' or 'data'
-                b64 = None
-                if isinstance(j, dict):
-                    if 'artifacts' in j and isinstance(j['artifacts'], list) and len(j['artifacts']) > 0:
-                        a = j['artifacts'][0]
-                        b64 = a.get('base64') or a.get('b64') or a.get('b64_json')
-                    if not b64 and 'images' in j and isinstance(j['images'], list) and len(j['images']) > 0:
-                        b64 = j['images'][0].get('b64') if isinstance(j['images'][0], dict) else j['images'][0]
-                    if not b64 and 'data' in j and isinstance(j['data'], list) and len(j['data']) > 0:
-                        d0 = j['data'][0]
-                        if isinstance(d0, dict):
-                            b64 = d0.get('b64') or d0.get('base64')
-                        else:
-                            b64 = d0
-
-                if not b64:
-                    if current_app.config.get('USE_IMAGE_FALLBACK', True):
-                        fb = _picsum_base64_from_prompt(prompt_text)
-                        if fb:
-                            try:
-                                _persist_image_cache(cache_key, [fb], prompt_text)
-                            except Exception:
-                                pass
-                            return jsonify({'predictions': [{'bytesBase64Encoded': fb}], 'fallback': 'picsum'}), 200
-                    return jsonify({'error': 'No image returned by Stability API.'}), 502
-
-                # persist to cache
-                try:
-                    _persist_image_cache(cache_key, [b64], prompt_text)
-                except Exception:
-                    pass
+                return jsonify({'error': st_resp.json()}), st_resp.status_code
+            except Exception:
+                return jsonify({'error': 'Stability API Error'}), 502
+        except Exception as e:
+            print(f"[STABILITY] Exception: {str(e)}")
+            if current_app.config.get('USE_IMAGE_FALLBACK', True):
+                print(f"[STABILITY] Falling back to Picsum due to exception...")
+                b64 = _picsum_base64_from_prompt(prompt_text)
+                if b64:
+                    try:
+                        _persist_image_cache(cache_key, [b64], prompt_text, provider, params)
+                    except Exception:
+                        pass
+                    print(f"[STABILITY] Returned Picsum fallback image")
+                    return jsonify({'predictions': [{'bytesBase64Encoded': b64}], 'fallback': 'picsum'}), 200
+            return jsonify({'error': f'Stability provider request failed: {str(e)}'}), 502
 
-                return jsonify({'predictions': [{'bytesBase64Encoded': b64}]}), 200
-            except Exception as e:
+        # Parse common response shapes for base64 images
+        try:
+            b64_list = _extract_stability_b64_list(st_resp.json())
+
+            if not b64_list:
                 if current_app.config.get('USE_IMAGE_FALLBACK', True):
                     fb = _picsum_base64_from_prompt(prompt_text)
                     if fb:
                         try:
-                            _persist_image_cache(cache_key, [fb], prompt_text)
+                            _persist_image_cache(cache_key, [fb], prompt_text, provider, params)
                         except Exception:
                             pass
                         return jsonify({'predictions': [{'bytesBase64Encoded': fb}], 'fallback': 'picsum'}), 200
-                return jsonify({'error': f'Error parsing Stability response: {str(e)}'}), 500
+                return jsonify({'error': 'No image returned by Stability API.'}), 502
 
-        if provider == 'local_auto':
-            # Forward to a local AUTOMATIC1111 server (assumes /sdapi/v1/txt2img)
-            auto_url = current_app.config.get('AUTOMATIC1111_URL') or 'http://127.0.0.1:7860'
-            txt2img = f"{auto_url.rstrip('/')}/sdapi/v1/txt2img"
-            # derive prompt
-            prompt_text = ''
+            # persist to cache (all sampleCount images, as jobs do)
             try:
-                if isinstance(payload, dict):
-                    inst = payload.get('prompt') or payload.get('prompt_text') or payload.get('inputs') or payload.get('instances')
-                    if isinstance(inst, list) and len(inst) > 0:
-                        first = inst[0]
-                        prompt_text = first.get('prompt') if isinstance(first, dict) else str(first)
-                    elif isinstance(inst, str):
-                        prompt_text = inst
-                if not prompt_text:
-                    prompt_text = str(payload)
+                _persist_image_cache(cache_key, b64_list, prompt_text, provider, params)
             except Exception:
-                prompt_text = str(payload)
-
-            body = {'prompt': prompt_text, 'steps': 20}
-            try:
-                auto_resp = requests.post(txt2img, json=body, timeout=60)
-                auto_resp.raise_for_status()
-            except requests.exceptions.HTTPError:
-                try:
-                    return jsonify({'error': auto_resp.json()}), auto_resp.status_code
-                except Exception:
-                    return jsonify({'error': 'Local AUTOMATIC1111 error'}), 502
-            except Exception as e:
-                return jsonify({'error': f'LOCAL AUTOMATIC1111 request failed: {str(e)}'}), 502
+                pass
 
-            try:
-                j = auto_resp.json()
-                # AUTOMATIC1111 returns images as base64 strings in j['images']
-                if 'images' in j and isinstance(j['images'], list) and len(j['images']) > 0:
-                    b64 = j['images'][0]
+            return jsonify({'predictions': [{'bytesBase64Encoded': b64} for b64 in b64_list]}), 200
+        except Exception as e:
+            if current_app.config.get('USE_IMAGE_FALLBACK', True):
+                fb = _picsum_base64_from_prompt(prompt_text)
+                if fb:
                     try:
-                        _persist_image_cache(cache_key, [b64], prompt_text)
+                        _persist_image_cache(cache_key, [fb], prompt_text, provider, params)
                     except Exception:
                         pass
-                    return jsonify({'predictions': [{'bytesBase64Encoded': b64}]}), 200
-                return jsonify({'error': 'No images returned from local AUTOMATIC1111.'}), 502
-            except Exception as e:
-                return jsonify({'error': f'Error parsing AUTOMATIC1111 response: {str(e)}'}), 500
-
-        response = None
-        for attempt in range(3):
-            try:
-                response = requests.post(f"{IMAGE_API_URL}?key={GEMINI_API_KEY}", json=payload, timeout=60)
-                response.raise_for_status()
-                break
-            except requests.exceptions.RequestException:
-                if attempt == 2:
-                    raise
-                time.sleep(2 ** attempt)
-        if response is None:
-            raise Exception('No response from upstream Image provider')
+                    return jsonify({'predictions': [{'bytesBase64Encoded': fb}], 'fallback': 'picsum'}), 200
+            return jsonify({'error': f'Error parsing Stability response: {str(e)}'}), 500
+
+    if provider == 'local_auto':
+        # Forward to a local AUTOMATIC1111 server (assumes /sdapi/v1/txt2img)
+        auto_url = current_app.config.get('AUTOMATIC1111_URL') or 'http://127.0.0.1:7860'
+        txt2img = f"{auto_url.rstrip('/')}/sdapi/v1/txt2img"
+        # derive prompt
+        prompt_text = ''
         try:
-            response.raise_for_status()
-        except requests.exceptions.HTTPError:
-            # Attempt to parse API error body and log it for debugging
-            try:
-                resp_json = response.json()
-                resp_text = json.dumps(resp_json)
-            except Exception:
-                resp_text = response.text or ''
+            if isinstance(payload, dict):
+                inst = payload.get('prompt') or payload.get('prompt_text') or payload.get('inputs') or payload.get('instances')
+                if isinstance(inst, list) and len(inst) > 0:
+                    first = inst[0]
+                    prompt_text = first.get('prompt') if isinstance(first, dict) else str(first)
+                elif isinstance(inst, str):
+                    prompt_text = inst
+            if not prompt_text:
+                prompt_text = str(payload)
+        except Exception:
+            prompt_text = str(payload)
 
-            # Log upstream image provider error to server logs to aid diagnosis
+        body = {'prompt': prompt_text, 'steps': 20}
+        try:
+            auto_resp = provider_client.post(txt2img, provider='automatic1111', json=body)
+            auto_resp.raise_for_status()
+        except requests.exceptions.HTTPError:
             try:
-                print('Image provider error response:', resp_text)
+                return jsonify({'error': auto_resp.json()}), auto_resp.status_code
             except Exception:
-                pass
+                return jsonify({'error': 'Local AUTOMATIC1111 error'}), 502
+        except Exception as e:
+            return jsonify({'error': f'LOCAL AUTOMATIC1111 request failed: {str(e)}'}), 502
 
-            # Detect the common billed-account error and either return a clear
-            # actionable 402 or a fallback image depending on config.
-            billed_error = 'Imagen API is only accessible to billed users' in resp_text or 'billed' in resp_text
-            if billed_error:
-                # If configured, fall back to a deterministic Picsum image
-                # derived from the visual prompt so the UI still receives a
-                # meaningful image rather than a tiny placeholder.
-                if current_app.config.get('USE_IMAGE_FALLBACK', False):
-                    # Try to extract a prompt to seed Picsum
-                    prompt_text = ''
-                    try:
-                        if isinstance(payload, dict):
-                            inst = payload.get('instances') or payload.get('inputs') or payload.get('prompt')
-                            if inst and isinstance(inst, list) and len(inst) > 0:
-                                first = inst[0]
-                                prompt_text = first.get('prompt') if isinstance(first, dict) else str(first)
-                            elif isinstance(inst, dict):
-                                prompt_text = inst.get('prompt') or inst.get('text') or ''
-                            elif isinstance(inst, str):
-                                prompt_text = inst
-                    except Exception:
-                        prompt_text = str(payload)
+        try:
+            j = auto_resp.json()
+            # AUTOMATIC1111 returns images as base64 strings in j['images']
+            if 'images' in j and isinstance(j['images'], list) and len(j['images']) > 0:
+                b64 = j['images'][0]
+                try:
+                    _persist_image_cache(cache_key, [b64], prompt_text, provider, params)
+                except Exception:
+                    pass
+                return jsonify({'predictions': [{'bytesBase64Encoded': b64}]}), 200
+            return jsonify({'error': 'No images returned from local AUTOMATIC1111.'}), 502
+        except Exception as e:
+            return jsonify({'error': f'Error parsing AUTOMATIC1111 response: {str(e)}'}), 500
 
-                    try:
-                        seed = hashlib.sha1(prompt_text.encode('utf-8')).hexdigest()[:8]
-                        picsum_url = f'https://picsum.photos/seed/{seed}/800/450'
-                        pic_resp = requests.get(picsum_url, timeout=20)
-                        if pic_resp.status_code == 200:
-                            img_bytes = pic_resp.content
-                            b64 = base64.b64encode(img_bytes).decode('utf-8')
-                            return jsonify({'predictions': [{'bytesBase64Encoded': b64}]}), 200
-                    except Exception:
-                        # If Picsum fallback fails, return the configured tiny fallback
-                        fb = current_app.config.get('FALLBACK_IMAGE_BASE64')
-                        return jsonify({'predictions': [{'bytesBase64Encoded': fb}]}), 200
+    response = None
+    for attempt in range(3):
+        try:
+            response = provider_client.post(f"{IMAGE_API_URL}?key={GEMINI_API_KEY}", provider='imagen', json=payload)
+            response.raise_for_status()
+            break
+        except circuit_breaker.CircuitOpenError as e:
+            # Imagen is known-bad right now (e.g. a cached billing error):
+            # go straight to the fallback instead of calling it again.
+            print(f"[IMAGE] {str(e)}")
+            if current_app.config.get('USE_IMAGE_FALLBACK', False):
+                fb = _picsum_base64_from_prompt(prompt_text) or current_app.config.get('FALLBACK_IMAGE_BASE64')
+                return jsonify({'predictions': [{'bytesBase64Encoded': fb}], 'fallback': 'picsum'}), 200
+            return jsonify({'error': f'Image provider unavailable: {str(e)}'}), 503
+        except requests.exceptions.HTTPError:
+            # 4xx won't improve on retry; let the error handling below run
+            if response.status_code < 500 or attempt == 2:
+                break
+            time.sleep(2 ** attempt)
+        except requests.exceptions.RequestException:
+            if attempt == 2:
+                raise
+            time.sleep(2 ** attempt)
+    if response is None:
+        raise Exception('No response from upstream Image provider')
+    try:
+        response.raise_for_status()
+    except requests.exceptions.HTTPError:
+        # Attempt to parse API error body and log it for debugging
+        try:
+            resp_json = response.json()
+            resp_text = json.dumps(resp_json)
+        except Exception:
+            resp_text = response.text or ''
 
-                return jsonify({'error': 'Imagen API requires a billed Google Cloud account. Enable billing or configure an alternative image provider.'}), 402
+        # Log upstream image provider error to server logs to aid diagnosis
+        try:
+            print('Image provider error response:', resp_text)
+        except Exception:
+            pass
 
-            # Other API errors: optionally return a Picsum fallback or propagate
+        # Detect the common billed-account error and either return a clear
+        # actionable 402 or a fallback image depending on config.
+        billed_error = 'Imagen API is only accessible to billed users' in resp_text or 'billed' in resp_text
+        if billed_error:
+            # If configured, fall back to a deterministic Picsum image
+            # derived from the visual prompt so the UI still receives a
+            # meaningful image rather than a tiny placeholder.
             if current_app.config.get('USE_IMAGE_FALLBACK', False):
-                # Try to derive a prompt and return a deterministic Picsum image
+                # Try to extract a prompt to seed Picsum
                 prompt_text = ''
                 try:
                     if isinstance(payload, dict):
@@ -996,57 +1736,234 @@ def generate_image(user_id):
                 try:
                     seed = hashlib.sha1(prompt_text.encode('utf-8')).hexdigest()[:8]
                     picsum_url = f'https://picsum.photos/seed/{seed}/800/450'
-                    pic_resp = requests.get(picsum_url, timeout=20)
+                    pic_resp = provider_client.get(picsum_url, provider='picsum')
                     if pic_resp.status_code == 200:
                         img_bytes = pic_resp.content
                         b64 = base64.b64encode(img_bytes).decode('utf-8')
                         return jsonify({'predictions': [{'bytesBase64Encoded': b64}]}), 200
                 except Exception:
-                    pass
+                    # If Picsum fallback fails, return the configured tiny fallback
+                    fb = current_app.config.get('FALLBACK_IMAGE_BASE64')
+                    return jsonify({'predictions': [{'bytesBase64Encoded': fb}]}), 200
+
+            return jsonify({'error': 'Imagen API requires a billed Google Cloud account. Enable billing or configure an alternative image provider.'}), 402
+
+        # Other API errors: optionally return a Picsum fallback or propagate
+        if current_app.config.get('USE_IMAGE_FALLBACK', False):
+            # Try to derive a prompt and return a deterministic Picsum image
+            prompt_text = ''
+            try:
+                if isinstance(payload, dict):
+                    inst = payload.get('instances') or payload.get('inputs') or payload.get('prompt')
+                    if inst and isinstance(inst, list) and len(inst) > 0:
+                        first = inst[0]
+                        prompt_text = first.get('prompt') if isinstance(first, dict) else str(first)
+                    elif isinstance(inst, dict):
+                        prompt_text = inst.get('prompt') or inst.get('text') or ''
+                    elif isinstance(inst, str):
+                        prompt_text = inst
+            except Exception:
+                prompt_text = str(payload)
 
-                # As a last resort, return the configured tiny fallback image
-                fb = current_app.config.get('FALLBACK_IMAGE_BASE64')
-                return jsonify({'predictions': [{'bytesBase64Encoded': fb}]}), 200
+            try:
+                seed = hashlib.sha1(prompt_text.encode('utf-8')).hexdigest()[:8]
+                picsum_url = f'https://picsum.photos/seed/{seed}/800/450'
+                pic_resp = provider_client.get(picsum_url, provider='picsum')
+                if pic_resp.status_code == 200:
+                    img_bytes = pic_resp.content
+                    b64 = base64.b64encode(img_bytes).decode('utf-8')
+                    return jsonify({'predictions': [{'bytesBase64Encoded': b64}]}), 200
+            except Exception:
+                pass
 
-            return jsonify({'error': f"Image API Error: {resp_text}"}), response.status_code
+            # As a last resort, return the configured tiny fallback image
+            fb = current_app.config.get('FALLBACK_IMAGE_BASE64')
+            return jsonify({'predictions': [{'bytesBase64Encoded': fb}]}), 200
 
-        # Attempt to persist returned images if present in response
-        try:
-            j = response.json()
-            # extract base64(s)
-            b64_list = []
-            if isinstance(j, dict):
-                if 'predictions' in j and isinstance(j['predictions'], list):
-                    for p in j['predictions']:
-                        if isinstance(p, dict) and p.get('bytesBase64Encoded'):
-                            b64_list.append(p.get('bytesBase64Encoded'))
-                        elif isinstance(p, str):
-                            b64_list.append(p)
-                # common other shapes
-                if 'artifacts' in j and isinstance(j['artifacts'], list):
-                    for a in j['artifacts']:
-                        if isinstance(a, dict) and a.get('base64'):
-                            b64_list.append(a.get('base64'))
-                if 'images' in j and isinstance(j['images'], list):
-                    for it in j['images']:
-                        if isinstance(it, dict) and it.get('b64'):
-                            b64_list.append(it.get('b64'))
-                        elif isinstance(it, str):
-                            b64_list.append(it)
-            if b64_list:
-                try:
-                    _persist_image_cache(cache_key, b64_list, prompt_text)
-                except Exception:
-                    pass
-        except Exception:
-            pass
+        return jsonify({'error': f"Image API Error: {resp_text}"}), response.status_code
+
+    # Attempt to persist returned images if present in response
+    try:
+        j = response.json()
+        # extract base64(s)
+        b64_list = []
+        if isinstance(j, dict):
+            if 'predictions' in j and isinstance(j['predictions'], list):
+                for p in j['predictions']:
+                    if isinstance(p, dict) and p.get('bytesBase64Encoded'):
+                        b64_list.append(p.get('bytesBase64Encoded'))
+                    elif isinstance(p, str):
+                        b64_list.append(p)
+            # common other shapes
+            if 'artifacts' in j and isinstance(j['artifacts'], list):
+                for a in j['artifacts']:
+                    if isinstance(a, dict) and a.get('base64'):
+                        b64_list.append(a.get('base64'))
+            if 'images' in j and isinstance(j['images'], list):
+                for it in j['images']:
+                    if isinstance(it, dict) and it.get('b64'):
+                        b64_list.append(it.get('b64'))
+                    elif isinstance(it, str):
+                        b64_list.append(it)
+        if b64_list:
+            try:
+                _persist_image_cache(cache_key, b64_list, prompt_text, provider, params)
+            except Exception:
+                pass
+    except Exception:
+        pass
+
+    return jsonify(response.json()), 200
+
+
+@ai_bp.route('/generate-image', methods=['POST'])
+@token_required
+def generate_image(user_id):
+    """Routes the request to the Imagen model to generate the image."""
+    try:
+        data = request.get_json()
+        payload = data['payload']
+
+        print(f"\n[IMAGE] ========== IMAGE GENERATION START ==========")
+        print(f"[IMAGE] User: {user_id}")
+        print(f"[IMAGE] Payload keys: {list(payload.keys())}")
+
+        # Route to external Imagen API
+        # If a 'free' provider is selected, generate a free placeholder image
+        # from Picsum (no API key required). We use a deterministic seed based
+        # on the prompt so repeated requests for the same prompt return the
+        # same image.
+        provider = current_app.config.get('IMAGE_PROVIDER', 'google')
+        
+        print(f"[IMAGE] Provider: {provider}")
+        print(f"[IMAGE] Stability API Key configured: {bool(current_app.config.get('STABILITY_API_KEY'))}")
+
+        # Determine prompt and requested sample count for caching
+        prompt_text = _extract_prompt_from_payload(payload)
+        print(f"[IMAGE] Extracted prompt ({len(prompt_text)} chars): {prompt_text[:100]}...")
+        params = _image_params_from_payload(payload)
 
-        return jsonify(response.json()), 200
+        cache_key = _make_image_cache_key(prompt_text, provider, params)
+        cache_ttl = current_app.config.get('IMAGE_CACHE_TTL_SECONDS', 60 * 60 * 24)
+        want_urls = _wants_image_urls(data, current_app.config)
+        # Try to serve from cache first
+        if want_urls:
+            url_body = _image_url_body(cache_key, cache_ttl)
+            if url_body:
+                return jsonify(url_body), 200
+        else:
+            cached = _load_image_cache(cache_key, ttl_seconds=cache_ttl)
+            if cached:
+                preds = [{'bytesBase64Encoded': b} for b in cached]
+                return jsonify({'predictions': preds, 'cached': True}), 200
+        similar = _find_similar_cached(prompt_text, provider, params, cache_key, cache_ttl)
+        if similar:
+            body = _similar_image_body(similar)
+            return jsonify(_image_body_as_urls(body, 200, cache_key) if want_urls else body), 200
+
+        value, shared = singleflight.do(
+            cache_key,
+            lambda: _image_flight_response(*_generate_image_uncached(payload, provider, prompt_text, params, cache_key))
+        )
+        if shared:
+            print(f"[IMAGE] Coalesced with in-flight generation for key: {cache_key}")
+        body, status = _image_response_from_flight(value, cache_key, cache_ttl)
+        if want_urls:
+            body = _image_body_as_urls(body, status, cache_key)
+        return jsonify(body), status
         
     except Exception as e:
         return jsonify({'error': f"Internal Server Error during Image call: {str(e)}"}), 500
 
 
+_IMAGE_MIMETYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'webp': 'image/webp', 'avif': 'image/avif'}
+_BLOB_NAME_RE = re.compile(r'([0-9a-f]{64})\.(png|jpg|webp)')
+
+
+_IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def _immutable_headers(resp, etag, vary_accept):
+    if etag:
+        resp.set_etag(etag)
+    resp.headers['Cache-Control'] = _IMMUTABLE_CACHE_CONTROL
+    if vary_accept:
+        resp.vary.add('Accept')
+    return resp
+
+
+@ai_bp.route('/images/<name>', methods=['GET'])
+def cached_image(name):
+    """Serve a cached image by content hash (<sha256>.<ext>).
+
+    send_file handles Range/conditional requests and uses the server's
+    sendfile support when available. Behind nginx, IMAGE_ACCEL_REDIRECT_PREFIX
+    (an internal location aliased to static/uploads) hands the transfer off
+    via X-Accel-Redirect; Flask's USE_X_SENDFILE does the same for
+    Apache/lighttpd.
+
+    When variants were rendered (image_variants.py), the response is the
+    smallest one the Accept header allows, at least ?w=<pixels> wide when
+    given (Vary: Accept).
+
+    The URL names the content, so responses are immutable for a year and
+    carry the content hash recorded in the index as a strong ETag; a
+    matching If-None-Match gets a 304 without the file being opened.
+    """
+    match = _BLOB_NAME_RE.fullmatch(name)
+    if not match:
+        return jsonify({'error': 'Not found'}), 404
+    sha, ext = match.groups()
+    store = image_store.get_store()
+    rel, etag = image_store.blob_path(sha, ext), sha
+    variants = store.variants(sha)
+    variant = image_variants.choose(variants, request.args.get('w', type=int), request.headers.get('Accept'))
+    if variant is not None:
+        rel, ext, etag = variant['path'], variant['format'], variant['digest']
+    if etag and request.if_none_match.contains(etag):
+        return _immutable_headers(Response(status=304), etag, bool(variants))
+    path = store.path(rel)
+    if variant is not None and not os.path.isfile(path):
+        # Variant file missing: fall back to the original
+        rel, ext, etag = image_store.blob_path(sha, match.group(2)), match.group(2), sha
+        path = store.path(rel)
+    if not os.path.isfile(path):
+        # Generated on another node: stream the original from the shared backend
+        backend = cache_backend.get_backend()
+        data = backend.get_blob(sha) if backend.shared else None
+        if data is None:
+            return jsonify({'error': 'Not found'}), 404
+        return _immutable_headers(Response(data, mimetype=_IMAGE_MIMETYPES[match.group(2)]), sha, False)
+    accel_prefix = current_app.config.get('IMAGE_ACCEL_REDIRECT_PREFIX')
+    if accel_prefix:
+        resp = Response(status=200, mimetype=_IMAGE_MIMETYPES[ext])
+        resp.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{rel}"
+    else:
+        resp = send_file(path, mimetype=_IMAGE_MIMETYPES[ext], conditional=True, etag=etag or True)
+    return _immutable_headers(resp, etag, bool(variants))
+
+
+def _image_cache_stats():
+    try:
+        return image_store.get_store().stats()
+    except Exception as e:
+        return {'error': str(e)}
+
+
+def _image_cache_key_stats():
+    with _key_compat_lock:
+        lookups = KEY_STATS['hits'] + KEY_STATS['misses']
+        return dict(KEY_STATS, version=IMAGE_CACHE_KEY_VERSION,
+                    hit_rate=round(KEY_STATS['hits'] / lookups, 3) if lookups else None)
+
+
+def _cache_backend_stats():
+    try:
+        return cache_backend.get_backend().stats()
+    except Exception as e:
+        return {'error': str(e)}
+
+
 @ai_bp.route('/status', methods=['GET'])
 def status():
     """Return active provider configuration (safe, non-secret) for UI debugging."""
@@ -1055,7 +1972,19 @@ def status():
         'image_provider': cfg.get('IMAGE_PROVIDER'),
         'llm_provider': cfg.get('LLM_PROVIDER'),
         'use_mock_fallback': cfg.get('USE_MOCK_FALLBACK', False),
-        'has_gemini_key': bool(cfg.get('GEMINI_API_KEY'))
+        'has_gemini_key': bool(cfg.get('GEMINI_API_KEY')),
+        'http_pools': provider_client.pool_stats(),
+        'circuit_breakers': circuit_breaker.snapshot(),
+        'llm_hedging': dict(llm_hedge.hedge_stats(), enabled=bool(cfg.get('LLM_HEDGE_ENABLED')), secondary=cfg.get('LLM_HEDGE_PROVIDER')),
+        'image_singleflight': singleflight.stats(),
+        'llm_cache': dict(llm_cache.stats(), enabled=llm_cache.enabled(cfg)),
+        'image_similarity': dict(prompt_index.stats(), enabled=bool(cfg.get('IMAGE_SIMILARITY_ENABLED'))),
+        'speculative_images': dict(speculation.stats(), enabled=speculation.enabled(cfg)),
+        'story_prefetch': dict(story_prefetch.stats(), enabled=story_prefetch.enabled(cfg)),
+        'image_cache': _image_cache_stats(),
+        'image_cache_keys': _image_cache_key_stats(),
+        'image_variants': dict(image_variants.stats(), enabled=image_variants.enabled(cfg)),
+        'cache_backend': _cache_backend_stats()
     }), 200
 
 
@@ -1068,59 +1997,50 @@ def cache_invalidate(user_id):
       { "key": "<cache_key>" }
       { "prompt": "...", "provider": "...", "params": {...} }
       { "all": true }
+      { "filter": {"provider", "older_than", "newer_than", "prefix",
+                   "contains", "pattern"}, "dry_run": false }
+
+    Filters are combined with AND; ages are in seconds, pattern is a regular
+    expression searched in the prompt. With "dry_run" (filter or all) nothing
+    is deleted and the match count, bytes and a sample of keys are returned.
+    Up to CACHE_INVALIDATE_SYNC_MAX matches are deleted inline; larger
+    deletions run as a background job (202) whose progress is polled at
+    /cache/invalidate/<job_id>.
 
     Returns which files were removed.
     """
     try:
         data = request.get_json() or {}
-        uploads_dir = os.path.join(current_app.static_folder, 'uploads')
-        os.makedirs(uploads_dir, exist_ok=True)
+        store = image_store.get_store()
+        backend = cache_backend.get_backend()
+        shared = backend if backend.shared else None
 
-        removed = []
+        dry_run = bool(data.get('dry_run'))
+        sync_max = int(current_app.config.get('CACHE_INVALIDATE_SYNC_MAX', 200))
+        if 'filter' in data or (data.get('all') and (dry_run or store.totals()[0] > sync_max)):
+            try:
+                filters = _invalidation_filters(data.get('filter'))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            if not filters and not data.get('all'):
+                return jsonify({'success': False, 'error': 'Empty filter; pass "all": true to remove everything.'}), 400
+            return _bulk_invalidate(user_id, filters, dry_run, clear_all=not filters)
 
         # Remove everything
         if data.get('all'):
-            for fname in os.listdir(uploads_dir):
-                if fname.startswith('cache_') or fname.startswith('img_'):
-                    try:
-                        path = os.path.join(uploads_dir, fname)
-                        os.remove(path)
-                        removed.append(fname)
-                    except Exception:
-                        pass
+            removed = store.clear()
+            prompt_index.clear()
+            if shared:
+                shared.clear_images()
             return jsonify({'success': True, 'removed': removed}), 200
 
-        # If key supplied, remove cache_{key}.json and referenced files
+        # If key supplied, remove the entry and its files
         key = data.get('key')
         if key:
-            meta_path = os.path.join(uploads_dir, f'cache_{key}.json')
-            if os.path.exists(meta_path):
-                try:
-                    with open(meta_path, 'r', encoding='utf-8') as f:
-                        meta = json.load(f)
-                    for fname in meta.get('files', []):
-                        path = os.path.join(uploads_dir, fname)
-                        if os.path.exists(path):
-                            try:
-                                os.remove(path)
-                                removed.append(fname)
-                            except Exception:
-                                pass
-                except Exception:
-                    pass
-                try:
-                    os.remove(meta_path)
-                    removed.append(os.path.basename(meta_path))
-                except Exception:
-                    pass
-            # Also attempt to remove any imgs matching the key prefix
-            for fname in os.listdir(uploads_dir):
-                if fname.startswith(f'img_{key}_'):
-                    try:
-                        os.remove(os.path.join(uploads_dir, fname))
-                        removed.append(fname)
-                    except Exception:
-                        pass
+            removed = store.delete(key)
+            prompt_index.discard(key)
+            if shared:
+                shared.delete_images(key)
             return jsonify({'success': True, 'removed': removed}), 200
 
         # If prompt/provider/params provided, compute the cache key and delete
@@ -1129,34 +2049,12 @@ def cache_invalidate(user_id):
         params = data.get('params') or {}
         if prompt:
             key = _make_image_cache_key(prompt, provider, params)
-            # Recurse into key path removal (reuse above logic)
-            meta_path = os.path.join(uploads_dir, f'cache_{key}.json')
-            if os.path.exists(meta_path):
-                try:
-                    with open(meta_path, 'r', encoding='utf-8') as f:
-                        meta = json.load(f)
-                    for fname in meta.get('files', []):
-                        path = os.path.join(uploads_dir, fname)
-                        if os.path.exists(path):
-                            try:
-                                os.remove(path)
-                                removed.append(fname)
-                            except Exception:
-                                pass
-                except Exception:
-                    pass
-                try:
-                    os.remove(meta_path)
-                    removed.append(os.path.basename(meta_path))
-                except Exception:
-                    pass
-            for fname in os.listdir(uploads_dir):
-                if fname.startswith(f'img_{key}_'):
-                    try:
-                        os.remove(os.path.join(uploads_dir, fname))
-                        removed.append(fname)
-                    except Exception:
-                        pass
+            removed = []
+            for k in [key] + _legacy_image_cache_keys(prompt, provider, params):
+                removed.extend(store.delete(k))
+                prompt_index.discard(k)
+                if shared:
+                    shared.delete_images(k)
             return jsonify({'success': True, 'removed': removed, 'key': key}), 200
 
         return jsonify({'success': False, 'error': 'No valid cache delete parameters provided.'}), 400
@@ -1164,35 +2062,158 @@ def cache_invalidate(user_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# --- BULK CACHE INVALIDATION ---
+# Filters are resolved through the image_store index (select_keys) and the
+# matches are deleted in short transactions (delete_batches). Large
+# deletions run on a background thread as a job whose progress is published
+# like any other job, so every worker can report it.
+
+_INVALIDATE_FILTERS = ('provider', 'older_than', 'newer_than', 'prefix', 'contains', 'pattern')
+_INVALIDATE_SAMPLE = 20
+
+
+def _invalidation_filters(spec):
+    """Validate a cache/invalidate "filter" object into select_keys() arguments."""
+    if spec is None:
+        return {}
+    if not isinstance(spec, dict):
+        raise ValueError('filter must be an object')
+    unknown = sorted(set(spec) - set(_INVALIDATE_FILTERS))
+    if unknown:
+        raise ValueError(f"unknown filter field(s): {', '.join(unknown)}")
+    filters = {}
+    for name in ('provider', 'prefix', 'contains', 'pattern'):
+        value = spec.get(name)
+        if value is None:
+            continue
+        if not isinstance(value, str) or not value:
+            raise ValueError(f'{name} must be a non-empty string')
+        filters[name] = value
+    for name in ('older_than', 'newer_than'):
+        value = spec.get(name)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f'{name} must be a non-negative number of seconds')
+        filters[name] = int(value)
+    if 'pattern' in filters:
+        try:
+            re.compile(filters['pattern'])
+        except re.error as e:
+            raise ValueError(f'invalid pattern: {str(e)}')
+    return filters
+
+
+def _delete_cache_keys(keys, clear_all=False, progress=None):
+    """Delete keys from the store, prompt index and shared backend in batches.
+
+    progress(deleted, freed) is called after every batch. With clear_all the
+    store and shared backend are cleared at the end as well (legacy files and
+    entries written meanwhile). Returns (removed files, freed bytes).
+    """
+    store = image_store.get_store()
+    backend = cache_backend.get_backend()
+    shared = backend if backend.shared else None
+    batch = int(current_app.config.get('CACHE_INVALIDATE_BATCH', 100) or 100)
+    removed, freed, deleted = [], 0, 0
+    for chunk, chunk_removed, chunk_freed in store.delete_batches(keys, batch):
+        for key in chunk:
+            prompt_index.discard(key)
+            if shared and not clear_all:
+                shared.delete_images(key)
+        removed.extend(chunk_removed)
+        freed += chunk_freed
+        deleted += len(chunk)
+        if progress:
+            progress(deleted, freed)
+    if clear_all:
+        removed.extend(store.clear())
+        prompt_index.clear()
+        if shared:
+            shared.clear_images()
+    return removed, freed
+
+
+def _invalidation_job_body(job_id, job):
+    return {'job_id': job_id, 'status': job.get('status'), 'dry_run': False,
+            'filter': job.get('filter'), 'progress': dict(job.get('progress') or {}),
+            'result': job.get('result')}
+
+
+def _run_invalidation_job(job_id, keys, clear_all, app_obj):
+    with app_obj.app_context():
+        job = JOBS[job_id]
+        job['status'] = 'running'
+        _publish_job(job_id)
+
+        def progress(deleted, freed):
+            job['progress'].update(deleted=deleted, bytes=freed)
+            _publish_job(job_id)
+
+        try:
+            removed, freed = _delete_cache_keys(keys, clear_all, progress)
+            job['status'] = 'done'
+            job['result'] = {'deleted': len(keys), 'files_removed': len(removed), 'bytes': freed}
+            print(f"[CACHE] Invalidation job {job_id} removed {len(keys)} entries ({freed} bytes)")
+        except Exception as e:
+            print(f"[CACHE] ❌ Invalidation job {job_id} failed: {str(e)}")
+            job['status'] = 'error'
+            job['result'] = {'error': str(e)}
+        _publish_job(job_id)
+
+
+def _bulk_invalidate(user_id, filters, dry_run, clear_all=False):
+    matched = image_store.get_store().select_keys(**filters)
+    keys = [key for key, _ in matched]
+    total_bytes = sum(size for _, size in matched)
+    if dry_run:
+        return jsonify({'success': True, 'dry_run': True, 'filter': filters, 'matched': len(keys),
+                        'bytes': total_bytes, 'keys': keys[:_INVALIDATE_SAMPLE]}), 200
+
+    if len(keys) <= int(current_app.config.get('CACHE_INVALIDATE_SYNC_MAX', 200)):
+        removed, freed = _delete_cache_keys(keys, clear_all)
+        return jsonify({'success': True, 'removed': removed, 'deleted': len(keys), 'bytes': freed}), 200
+
+    job_id = hashlib.sha1(f"invalidate:{user_id}:{len(keys)}:{time.time()}".encode('utf-8')).hexdigest()[:16]
+    JOBS[job_id] = {'status': 'pending', 'result': None, 'ts': int(time.time()), 'user_id': user_id,
+                    'filter': filters, 'progress': {'total': len(keys), 'deleted': 0, 'bytes': 0}}
+    _publish_job(job_id)
+    app_obj = current_app._get_current_object()
+    threading.Thread(target=_run_invalidation_job, args=(job_id, keys, clear_all, app_obj), daemon=True).start()
+    return jsonify(dict(_invalidation_job_body(job_id, JOBS[job_id]), success=True)), 202
+
+
+@ai_bp.route('/cache/invalidate/<job_id>', methods=['GET'])
+@token_required
+def cache_invalidate_job(user_id, job_id):
+    """Return the status and progress of a background cache invalidation."""
+    try:
+        job = _find_job(job_id)
+        if not job or 'progress' not in job:
+            return jsonify({'error': 'Job not found'}), 404
+        if job.get('user_id') != user_id:
+            return jsonify({'error': 'Unauthorized'}), 403
+        return jsonify(_invalidation_job_body(job_id, job)), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @ai_bp.route('/cache/list', methods=['GET'])
 @token_required
 def cache_list(user_id):
-    """Return a list of cache entries (safe metadata only).
+    """Return a list of cache entries (safe metadata only), newest first.
 
-    Each entry includes: key, prompt, ts, files (filenames) and file_urls (relative paths)
+    Each entry includes: key, prompt, ts, files (filenames) and file_urls (relative paths).
+    Optional ?limit=&offset= query parameters page through the index.
     """
     try:
-        uploads_dir = os.path.join(current_app.static_folder, 'uploads')
-        os.makedirs(uploads_dir, exist_ok=True)
+        limit = request.args.get('limit', type=int)
+        offset = request.args.get('offset', default=0, type=int)
         entries = []
-        for fname in os.listdir(uploads_dir):
-            if not fname.startswith('cache_') or not fname.endswith('.json'):
-                continue
-            meta_path = os.path.join(uploads_dir, fname)
-            try:
-                with open(meta_path, 'r', encoding='utf-8') as f:
-                    meta = json.load(f)
-                key = meta.get('key') or fname.replace('cache_', '').replace('.json', '')
-                prompt = meta.get('prompt')
-                ts = meta.get('ts')
-                files = meta.get('files', [])
-                file_urls = [f"/static/uploads/{n}" for n in files]
-                entries.append({'key': key, 'prompt': prompt, 'ts': ts, 'files': files, 'file_urls': file_urls})
-            except Exception:
-                # ignore broken entries
-                continue
-        # sort by ts desc
-        entries.sort(key=lambda e: e.get('ts', 0), reverse=True)
+        for entry in image_store.get_store().list_entries(limit=limit, offset=offset):
+            files = entry.get('files', [])
+            entries.append({'key': entry['key'], 'prompt': entry.get('prompt'), 'ts': entry.get('ts'),
+                            'files': files, 'file_urls': [image_store.url_for_file(n) for n in files]})
         return jsonify({'entries': entries}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1230,7 +2251,7 @@ def generate_main_image(user_id):
 
         seed = hashlib.sha1(prompt_text.encode('utf-8')).hexdigest()[:8]
         picsum_url = f'https://picsum.photos/seed/{seed}/1200/675'
-        pic_resp = requests.get(picsum_url, timeout=20)
+        pic_resp = provider_client.get(picsum_url, provider='picsum')
         if pic_resp.status_code == 200:
             img_bytes = pic_resp.content
             b64 = base64.b64encode(img_bytes).decode('utf-8')
@@ -1273,7 +2294,7 @@ def generate_preview(user_id):
         width = 512
         height = 288
         picsum_url = f'https://picsum.photos/seed/{seed}/{width}/{height}'
-        pic_resp = requests.get(picsum_url, timeout=10)
+        pic_resp = provider_client.get(picsum_url, provider='picsum')
         if pic_resp.status_code == 200:
             img_bytes = pic_resp.content
             b64 = base64.b64encode(img_bytes).decode('utf-8')
@@ -1284,6 +2305,155 @@ def generate_preview(user_id):
         return jsonify({'error': f'Internal Server Error during preview generation: {str(e)}'}), 500
 
 
+def _generate_job_image(prompt_text, provider, params, cache_key):
+    """Generate and cache an image for a background job.
+
+    Jobs share cache keys with the sync route, so they generate what it
+    would for the same params: params['sampleCount'] Stability images, or
+    the same 800x450 Picsum image. Returns the job result payload, or None
+    if every provider failed.
+    """
+    # Try Stability AI first
+    b64_list = []
+    if provider == 'stability':
+        if current_app.config.get('STABILITY_API_KEY'):
+            print(f"[STABILITY] Calling Stability AI API...")
+            try:
+                st_spec = _build_stability_request(prompt_text, params, current_app.config)
+                stability_response = provider_client.post(st_spec['url'], provider='stability', headers=st_spec['headers'],
+                                                          json=st_spec['json'], timeout=st_spec['timeout'])
+                
+                print(f"[STABILITY] Response status: {stability_response.status_code}")
+                
+                if stability_response.status_code == 200:
+                    b64_list = _extract_stability_b64_list(stability_response.json())
+                    if b64_list:
+                        print(f"[STABILITY] ✅ SUCCESS! {len(b64_list)} image(s) generated")
+                    else:
+                        print(f"[STABILITY] ⚠️ No artifacts in response")
+                else:
+                    error_text = stability_response.text[:200]
+                    print(f"[STABILITY] ❌ API Error: {error_text}")
+            except Exception as e:
+                print(f"[STABILITY] ❌ Exception: {str(e)}")
+        else:
+            print(f"[STABILITY] ⚠️ STABILITY_API_KEY not configured")
+    
+    # Fallback to Picsum (the sync route's size) if Stability failed
+    if not b64_list:
+        print(f"[IMAGE] Falling back to Picsum...")
+        b64 = _picsum_base64_from_prompt(prompt_text)
+        if b64:
+            b64_list = [b64]
+            print(f"[IMAGE] Picsum fallback success")
+        else:
+            print(f"[IMAGE] ❌ Picsum also failed")
+    
+    # If we got images (from Stability or Picsum), cache them
+    if b64_list:
+        # persist to cache using existing helper
+        try:
+            _persist_image_cache(cache_key, b64_list, prompt_text, provider, params)
+            print(f"[IMAGE] Cached with key: {cache_key}")
+        except Exception as e:
+            print(f"[IMAGE] Cache persist error: {str(e)}")
+        return _cache_job_result(cache_key)
+    return None
+
+
+def _job_image_key(payload):
+    """Return (prompt_text, provider, params, cache_key) for a job payload."""
+    prompt_text = _extract_prompt_from_payload(payload) or 'async'
+    provider = current_app.config.get('IMAGE_PROVIDER', 'google')
+    # Same params as the sync route, so jobs and sync requests share entries
+    params = _image_params_from_payload(payload)
+    return prompt_text, provider, params, _make_image_cache_key(prompt_text, provider, params)
+
+
+def _cached_job_result(prompt_text, provider, params, cache_key):
+    """Job result for an exact or similar cache hit, or None on a miss."""
+    cache_ttl = current_app.config.get('IMAGE_CACHE_TTL_SECONDS', 60 * 60 * 24)
+    if _load_image_cache(cache_key, ttl_seconds=cache_ttl):
+        print(f"[IMAGE] Cache hit for key: {cache_key}")
+        return _cache_job_result(cache_key)
+    similar = _find_similar_cached(prompt_text, provider, params, cache_key, cache_ttl)
+    if similar:
+        return dict(_cache_job_result(similar[0]), similar={'key': similar[0], 'score': round(similar[1], 3)})
+    return None
+
+
+def _run_image_job(payload):
+    """Resolve one job payload to (status, result): cache first, then generate."""
+    prompt_text, provider, params, cache_key = _job_image_key(payload)
+    print(f"[IMAGE] Starting async image generation for prompt: {prompt_text[:100]}...")
+    if speculation.claim(cache_key):
+        print(f"[IMAGE] Speculative generation used for key: {cache_key}")
+
+    # If cache already exists, return that quickly
+    cached = _cached_job_result(prompt_text, provider, params, cache_key)
+    if cached is not None:
+        return 'done', cached
+
+    value, shared = singleflight.do(
+        cache_key,
+        lambda: {'kind': 'job', 'result': _generate_job_image(prompt_text, provider, params, cache_key)}
+    )
+    if shared:
+        print(f"[IMAGE] Coalesced with in-flight generation for key: {cache_key}")
+    result = _job_result_from_flight(value, cache_key)
+    if result is not None:
+        return 'done', result
+
+    # If everything failed, mark job as error
+    print(f"[IMAGE] ❌ All image generation methods failed")
+    return 'error', {'error': 'Failed to generate image from any provider.'}
+
+
+def _speculative_payload(image_prompt, art_style, config):
+    """The payload handleImageGeneration will send for an unedited image_prompt."""
+    sample_count = int(config.get('SPECULATIVE_IMAGE_SAMPLE_COUNT', UI_IMAGE_PARAMETERS['sampleCount']))
+    return {
+        'instances': [{'prompt': f"{image_prompt.strip()}, in the style of {art_style}"}],
+        'parameters': dict(UI_IMAGE_PARAMETERS, sampleCount=sample_count)
+    }
+
+
+def _speculate_image(user_id, data, body):
+    """Warm the image cache for a fresh candidate (SPECULATIVE_IMAGES_ENABLED).
+
+    Only story-mode requests carry the art style the UI will append, so
+    requests without one are not speculated on.
+    """
+    try:
+        config = current_app.config
+        if not speculation.enabled(config) or not isinstance(body, dict):
+            return
+        story = (data or {}).get('story') if isinstance(data, dict) else None
+        art_style = (story or {}).get('art_style') or (data or {}).get('art_style')
+        image_prompt = (body.get('normalized_candidate') or {}).get('image_prompt')
+        if not art_style or not image_prompt:
+            return
+        prompt_text, provider, params, cache_key = _job_image_key(_speculative_payload(image_prompt, art_style, config))
+        cache_ttl = config.get('IMAGE_CACHE_TTL_SECONDS', 60 * 60 * 24)
+        if _load_image_cache(cache_key, ttl_seconds=cache_ttl):
+            speculation.skip_cached()
+            return
+        app_obj = current_app._get_current_object()
+
+        def work():
+            with app_obj.app_context():
+                value, _ = singleflight.do(
+                    cache_key,
+                    lambda: {'kind': 'job', 'result': _generate_job_image(prompt_text, provider, params, cache_key)}
+                )
+                return _job_result_from_flight(value, cache_key) is not None
+
+        if speculation.submit(user_id, cache_key, work, config):
+            print(f"[SPECULATE] Queued image for key: {cache_key}")
+    except Exception as e:
+        print(f"[SPECULATE] Skipped: {str(e)}")
+
+
 def _async_generate_and_cache(job_id, payload, user_id, app_obj=None):
     """Background worker that generates an AI image using Stability API
     or falls back to Picsum. This allows the UI to poll for completion
@@ -1295,142 +2465,18 @@ def _async_generate_and_cache(job_id, payload, user_id, app_obj=None):
         if app_obj:
             ctx = app_obj.app_context()
             ctx.push()
-        prompt_text = _extract_prompt_from_payload(payload) or 'async'
-        
-        print(f"[IMAGE] Starting async image generation for prompt: {prompt_text[:100]}...")
-
-        provider = current_app.config.get('IMAGE_PROVIDER', 'google')
-        params = {}
-        try:
-            params_obj = payload.get('parameters') if isinstance(payload, dict) else {}
-            if isinstance(params_obj, dict):
-                params['sampleCount'] = params_obj.get('sampleCount') or params_obj.get('samples') or 1
-        except Exception:
-            params['sampleCount'] = 1
-
-        cache_key = _make_image_cache_key(prompt_text, provider, params)
-
-        # If cache already exists, return that quickly
-        cache_ttl = current_app.config.get('IMAGE_CACHE_TTL_SECONDS', 60 * 60 * 24)
-        cached = _load_image_cache(cache_key, ttl_seconds=cache_ttl)
-        if cached:
-            print(f"[IMAGE] Cache hit for key: {cache_key}")
-            # build file urls from persisted files
-            uploads_dir = os.path.join(current_app.static_folder, 'uploads')
-            meta_path = os.path.join(uploads_dir, f'cache_{cache_key}.json')
-            files = []
-            try:
-                with open(meta_path, 'r', encoding='utf-8') as f:
-                    meta = json.load(f)
-                    files = meta.get('files', [])
-            except Exception:
-                files = []
-
-            JOBS[job_id]['status'] = 'done'
-            JOBS[job_id]['result'] = {'key': cache_key, 'files': files, 'file_urls': [f"/static/uploads/{n}" for n in files]}
-            if app_obj:
-                ctx.pop()
-            return
-
-        # Try Stability AI first
-        img_bytes = None
-        if provider == 'stability':
-            STABILITY_API_KEY = current_app.config.get('STABILITY_API_KEY')
-            STABILITY_ENGINE = current_app.config.get('STABILITY_ENGINE', 'stable-diffusion-xl-1024-v1-0')
-            
-            if STABILITY_API_KEY:
-                print(f"[STABILITY] Calling Stability AI API...")
-                try:
-                    stability_response = requests.post(
-                        f"https://api.stability.ai/v1/generation/{STABILITY_ENGINE}/text-to-image",
-                        headers={
-                            "Content-Type": "application/json",
-                            "Accept": "application/json",
-                            "Authorization": f"Bearer {STABILITY_API_KEY}"
-                        },
-                        json={
-                            "text_prompts": [{"text": prompt_text, "weight": 1.0}],
-                            "cfg_scale": 7,
-                            "height": 1024,
-                            "width": 1024,
-                            "samples": 1,
-                            "steps": 30
-                        },
-                        timeout=60
-                    )
-                    
-                    print(f"[STABILITY] Response status: {stability_response.status_code}")
-                    
-                    if stability_response.status_code == 200:
-                        response_data = stability_response.json()
-                        artifacts = response_data.get('artifacts', [])
-                        if artifacts and 'base64' in artifacts[0]:
-                            img_bytes = base64.b64decode(artifacts[0]['base64'])
-                            print(f"[STABILITY] ✅ SUCCESS! Image generated ({len(img_bytes)} bytes)")
-                        else:
-                            print(f"[STABILITY] ⚠️ No artifacts in response")
-                    else:
-                        error_text = stability_response.text[:200]
-                        print(f"[STABILITY] ❌ API Error: {error_text}")
-                except Exception as e:
-                    print(f"[STABILITY] ❌ Exception: {str(e)}")
-            else:
-                print(f"[STABILITY] ⚠️ STABILITY_API_KEY not configured")
-        
-        # Fallback to Picsum if Stability failed
-        if img_bytes is None:
-            print(f"[IMAGE] Falling back to Picsum...")
-            try:
-                seed = hashlib.sha1(prompt_text.encode('utf-8')).hexdigest()[:8]
-            except Exception:
-                seed = hashlib.sha1(str(time.time()).encode('utf-8')).hexdigest()[:8]
-            width = 1200
-            height = 675
-            picsum_url = f'https://picsum.photos/seed/{seed}/{width}/{height}'
-            pic_resp = requests.get(picsum_url, timeout=30)
-            if pic_resp.status_code == 200:
-                img_bytes = pic_resp.content
-                print(f"[IMAGE] Picsum fallback success ({len(img_bytes)} bytes)")
-            else:
-                print(f"[IMAGE] ❌ Picsum also failed")
-        
-        # If we got an image (from Stability or Picsum), cache it
-        if img_bytes:
-            b64 = base64.b64encode(img_bytes).decode('utf-8')
-            # persist to cache using existing helper
-            try:
-                _persist_image_cache(cache_key, [b64], prompt_text)
-                print(f"[IMAGE] Cached with key: {cache_key}")
-            except Exception as e:
-                print(f"[IMAGE] Cache persist error: {str(e)}")
-
-            # Read back metadata to report files
-            uploads_dir = os.path.join(current_app.static_folder, 'uploads')
-            meta_path = os.path.join(uploads_dir, f'cache_{cache_key}.json')
-            files = []
-            try:
-                with open(meta_path, 'r', encoding='utf-8') as f:
-                    meta = json.load(f)
-                    files = meta.get('files', [])
-            except Exception:
-                files = []
-
-            JOBS[job_id]['status'] = 'done'
-            JOBS[job_id]['result'] = {'key': cache_key, 'files': files, 'file_urls': [f"/static/uploads/{n}" for n in files]}
-            if app_obj:
-                ctx.pop()
-            return
-
-        # If everything failed, mark job as error
-        print(f"[IMAGE] ❌ All image generation methods failed")
-        JOBS[job_id]['status'] = 'error'
-        JOBS[job_id]['result'] = {'error': 'Failed to generate image from any provider.'}
+        _publish_job(job_id)
+        status, result = _run_image_job(payload)
+        JOBS[job_id]['status'] = status
+        JOBS[job_id]['result'] = result
+        _publish_job(job_id)
         if app_obj:
             ctx.pop()
     except Exception as e:
         print(f"[IMAGE] ❌ Fatal error: {str(e)}")
         JOBS[job_id]['status'] = 'error'
         JOBS[job_id]['result'] = {'error': str(e)}
+        _publish_job(job_id)
         if app_obj:
             try:
                 ctx.pop()
@@ -1438,6 +2484,77 @@ def _async_generate_and_cache(job_id, payload, user_id, app_obj=None):
                 pass
 
 
+# --- BATCH IMAGE JOBS ---
+# One aggregated job per batch: cache hits are resolved while the request is
+# handled, misses run on a shared pool of IMAGE_BATCH_CONCURRENCY workers so
+# concurrent batches together never exceed that many provider calls.
+
+_image_batch_executor = None
+_image_batch_executor_lock = threading.Lock()
+_image_batch_lock = threading.Lock()
+
+
+def _get_image_batch_executor():
+    global _image_batch_executor
+    if _image_batch_executor is None:
+        with _image_batch_executor_lock:
+            if _image_batch_executor is None:
+                workers = int(current_app.config.get('IMAGE_BATCH_CONCURRENCY', 4) or 4)
+                _image_batch_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-batch')
+    return _image_batch_executor
+
+
+def _batch_item_payload(item):
+    """Accept a bare prompt string or a generate-image-async style payload."""
+    if isinstance(item, str):
+        return {'instances': [{'prompt': item}]}
+    if isinstance(item, dict):
+        return item.get('payload') or item
+    raise ValueError('each item must be a prompt string or a payload object')
+
+
+def _batch_progress(job):
+    counts = {'pending': 0, 'running': 0, 'done': 0, 'error': 0}
+    for item in job['items']:
+        counts[item['status']] = counts.get(item['status'], 0) + 1
+    return dict(counts, total=len(job['items']))
+
+
+def _finish_batch_item(job_id, index, status, result):
+    with _image_batch_lock:
+        job = JOBS[job_id]
+        job['items'][index].update(status=status, result=result)
+        progress = _batch_progress(job)
+        if progress['done'] + progress['error'] == progress['total']:
+            job['status'] = 'done' if progress['done'] else 'error'
+        else:
+            job['status'] = 'running'
+        snapshot = dict(job, items=[dict(item) for item in job['items']])
+    _publish_job(job_id, snapshot)
+
+
+def _run_batch_item(job_id, index, payload, app_obj):
+    with app_obj.app_context():
+        with _image_batch_lock:
+            JOBS[job_id]['items'][index]['status'] = 'running'
+        try:
+            status, result = _run_image_job(payload)
+        except Exception as e:
+            print(f"[IMAGE BATCH] ❌ Item {index} failed: {str(e)}")
+            status, result = 'error', {'error': str(e)}
+        _finish_batch_item(job_id, index, status, result)
+
+
+def _batch_job_body(job_id, job):
+    with _image_batch_lock:
+        return {
+            'job_id': job_id,
+            'status': job.get('status'),
+            'progress': _batch_progress(job),
+            'items': [dict(item) for item in job['items']],
+        }
+
+
 @ai_bp.route('/generate-image-async', methods=['POST'])
 @token_required
 def generate_image_async(user_id):
@@ -1454,6 +2571,7 @@ def generate_image_async(user_id):
         # create a stable job id
         job_id = hashlib.sha1(f"{prompt_text}:{time.time()}".encode('utf-8')).hexdigest()[:16]
         JOBS[job_id] = {'status': 'pending', 'result': None, 'ts': int(time.time()), 'user_id': user_id}
+        _publish_job(job_id)
 
         # start background thread, pass real app object so worker can push app context
         app_obj = current_app._get_current_object()
@@ -1465,17 +2583,68 @@ def generate_image_async(user_id):
         return jsonify({'error': str(e)}), 500
 
 
+@ai_bp.route('/generate-image-batch', methods=['POST'])
+@token_required
+def generate_image_batch(user_id):
+    """Enqueue many image generations as one aggregated job.
+
+    Body: {"items": [prompt string or payload, ...]}. Cache hits are resolved
+    immediately; misses are generated in the background with at most
+    IMAGE_BATCH_CONCURRENCY provider calls at a time. Poll the returned
+    job_id with /generate-image-job/<job_id> for per-item status.
+    """
+    try:
+        data = request.get_json() or {}
+        items = data.get('items') or data.get('prompts')
+        max_items = int(current_app.config.get('IMAGE_BATCH_MAX_ITEMS', 50))
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'items must be a non-empty list'}), 400
+        if len(items) > max_items:
+            return jsonify({'error': f'at most {max_items} items per batch'}), 400
+        try:
+            payloads = [_batch_item_payload(item) for item in items]
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        job_id = hashlib.sha1(f"batch:{user_id}:{len(payloads)}:{time.time()}".encode('utf-8')).hexdigest()[:16]
+        job = {'status': 'pending', 'result': None, 'ts': int(time.time()), 'user_id': user_id, 'items': []}
+        misses = []
+        for index, payload in enumerate(payloads):
+            prompt_text, provider, params, cache_key = _job_image_key(payload)
+            cached = _cached_job_result(prompt_text, provider, params, cache_key)
+            if cached is not None:
+                job['items'].append({'index': index, 'status': 'done', 'result': cached, 'cached': True})
+            else:
+                job['items'].append({'index': index, 'status': 'pending', 'result': None})
+                misses.append((index, payload))
+        job['status'] = 'running' if misses else 'done'
+        JOBS[job_id] = job
+        _publish_job(job_id)
+        print(f"[IMAGE BATCH] job={job_id} items={len(payloads)} cache_hits={len(payloads) - len(misses)}")
+
+        app_obj = current_app._get_current_object()
+        executor = _get_image_batch_executor()
+        for index, payload in misses:
+            executor.submit(_run_batch_item, job_id, index, payload, app_obj)
+
+        return jsonify(_batch_job_body(job_id, job)), (202 if misses else 200)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @ai_bp.route('/generate-image-job/<job_id>', methods=['GET'])
 @token_required
 def generate_image_job_status(user_id, job_id):
     """Return the status and result of an async image generation job."""
     try:
-        job = JOBS.get(job_id)
+        job = _find_job(job_id)  # may have been created by another worker/node
         if not job:
             return jsonify({'error': 'Job not found'}), 404
         # For security, ensure the requesting user owns the job (dev scaffold only)
         if job.get('user_id') != user_id:
             return jsonify({'error': 'Unauthorized'}), 403
+        if 'items' in job:
+            return jsonify(_batch_job_body(job_id, job)), 200
         return jsonify({'job_id': job_id, 'status': job.get('status'), 'result': job.get('result')}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,435 @@
+# ai_service_async.py
+"""ASGI serving mode for the AI generation routes.
+
+In this mode the upstream-bound `/api/ai/*` routes run as coroutines on a
+shared httpx.AsyncClient, so one process can keep thousands of generations
+in flight instead of parking a WSGI worker thread on each. Everything else
+(auth, story, cache admin, job polling, static files, CORS preflights) is
+handed to the regular Flask app through asgiref's WSGI adapter, so both
+modes share the same in-memory stores.
+
+Request building and response normalization come from ai_service so the
+two modes send and return exactly the same payloads. Cache file I/O runs in
+worker threads (inside an app context) to keep it off the event loop.
+
+Run with:  uvicorn asgi:app   (pip install uvicorn httpx asgiref)
+"""
+
+import asyncio
+import base64
+import json
+import time
+import hashlib
+
+try:
+    import httpx
+    from asgiref.wsgi import WsgiToAsgi
+    ASYNC_AVAILABLE = True
+except ImportError:
+    ASYNC_AVAILABLE = False
+
+import ai_service
+import circuit_breaker
+import llm_hedge
+import provider_client
+import singleflight
+import speculation
+import story_context
+from ai_service import JOBS
+from auth import resolve_session_user
+
+
+def _json_bytes(body):
+    return json.dumps(body).encode('utf-8')
+
+
+class AsyncAIApp:
+    """ASGI application wrapping a Flask app created by create_app()."""
+
+    def __init__(self, flask_app):
+        if not ASYNC_AVAILABLE:
+            raise RuntimeError('ASGI mode requires httpx and asgiref (pip install httpx asgiref uvicorn)')
+        self.flask_app = flask_app
+        self.config = flask_app.config
+        self.wsgi = WsgiToAsgi(flask_app)
+        self._client = None
+        self._tasks = set()  # strong refs so background jobs aren't GC'd
+        self.routes = {
+            ('POST', '/api/ai/generate-prompt'): self.generate_prompt,
+            ('POST', '/api/ai/generate-image'): self.generate_image,
+            ('POST', '/api/ai/generate-image-async'): self.generate_image_async,
+            ('POST', '/api/ai/generate-main-image'): self.generate_main_image,
+            ('POST', '/api/ai/generate-preview'): self.generate_preview,
+        }
+
+    # --- plumbing ---
+
+    @property
+    def client(self):
+        if self._client is None:
+            limits = httpx.Limits(
+                max_connections=self.config.get('ASYNC_HTTP_MAX_CONNECTIONS', 1000),
+                max_keepalive_connections=self.config.get('ASYNC_HTTP_MAX_KEEPALIVE', 100),
+            )
+            self._client = httpx.AsyncClient(limits=limits, follow_redirects=True)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def run_sync(self, fn, *args):
+        """Run a blocking helper (file I/O) in a worker thread with an app context."""
+        def call():
+            with self.flask_app.app_context():
+                return fn(*args)
+        return await asyncio.to_thread(call)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        handler = None
+        if scope['type'] == 'http':
+            handler = self.routes.get((scope.get('method'), scope.get('path')))
+        if handler is None:
+            await self.wsgi(scope, receive, send)
+            return
+
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        user_id, error = resolve_session_user(headers.get('authorization'))
+        if error:
+            await self._send_json(send, {'error': error}, 401)
+            return
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            data = {}
+
+        try:
+            result = await handler(user_id, data or {})
+        except Exception as e:
+            result = ({'error': f'Internal Server Error: {str(e)}'}, 500)
+
+        if result is None:
+            # Handler declined (e.g. provider without an async adapter):
+            # replay the buffered body into the sync Flask route.
+            await self.wsgi(scope, self._replay(body), send)
+            return
+        await self._send_json(send, result[0], result[1])
+
+    @staticmethod
+    def _replay(body):
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            return {'type': 'http.disconnect'}
+        return receive
+
+    @staticmethod
+    async def _send_json(send, body, status=200):
+        data = _json_bytes(body)
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(data)).encode('latin-1')),
+                (b'access-control-allow-origin', b'*'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': data})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for task in list(self._tasks):
+                    task.cancel()
+                await self.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # --- upstream helpers ---
+
+    async def _upstream(self, provider, method, url, **kwargs):
+        """Async counterpart of provider_client.request (breaker + latency)."""
+        circuit_breaker.check(provider)
+        connect, read = kwargs.pop('timeout', None) or provider_client.timeout_for(provider)
+        kwargs['timeout'] = httpx.Timeout(read, connect=connect)
+        started = time.monotonic()
+        try:
+            resp = await self.client.request(method, url, **kwargs)
+        except Exception as e:
+            if isinstance(e, httpx.TimeoutException):
+                provider_client.record_timeout(provider)
+            circuit_breaker.record_exception(provider, e)
+            raise
+        if resp.status_code < 500:
+            provider_client.record_latency(provider, (time.monotonic() - started) * 1000.0)
+        circuit_breaker.record_response(provider, resp.status_code, resp.text if resp.status_code >= 400 else '')
+        return resp
+
+    async def _picsum_b64(self, prompt_text, width, height):
+        try:
+            resp = await self._upstream('picsum', 'GET', ai_service._picsum_url(prompt_text, width, height))
+            if resp.status_code == 200:
+                return base64.b64encode(resp.content).decode('utf-8')
+        except Exception:
+            return None
+        return None
+
+    async def _stability_b64(self, prompt_text, params):
+        """Return (b64 list, error) for a Stability text-to-image call."""
+        spec = ai_service._build_stability_request(prompt_text, params, self.config)
+        try:
+            print(f"[STABILITY ASYNC] POST to {spec['url']}")
+            resp = await self._upstream('stability', 'POST', spec['url'], headers=spec['headers'], json=spec['json'], timeout=spec['timeout'])
+            print(f"[STABILITY ASYNC] Response status: {resp.status_code}")
+            resp.raise_for_status()
+            b64_list = ai_service._extract_stability_b64_list(resp.json())
+            if not b64_list:
+                return None, 'No image returned by Stability API.'
+            return b64_list, None
+        except Exception as e:
+            print(f"[STABILITY ASYNC] Exception: {str(e)}")
+            return None, f'Stability provider request failed: {str(e)}'
+
+    # --- routes ---
+
+    async def _llm_call(self, provider, payload):
+        """Call one LLM provider; returns (body, status)."""
+        label = ai_service.LLM_LABELS[provider]
+        spec = ai_service._build_llm_request(provider, payload, self.config)
+        if spec is None:
+            return {'error': f'{ai_service.LLM_KEY_NAMES[provider]} not configured'}, 500
+        try:
+            resp = await self._upstream(provider, 'POST', spec['url'], headers=spec['headers'], json=spec['json'], timeout=spec['timeout'])
+            resp.raise_for_status()
+            return ai_service._parse_llm_response(provider, resp.json(), payload), 200
+        except httpx.TimeoutException:
+            return {'error': f"{label} API timeout after {spec['timeout'][1]}s - API is not responding in time",
+                    'message': 'LLM provider failed. Real LLM is required.'}, 500
+        except Exception as e:
+            print(f"[LLM ASYNC ERROR] {label}: {str(e)}")
+            return {'error': f'{label} API error: {str(e)}', 'message': 'LLM provider failed. Real LLM is required.'}, 500
+
+    async def _hedged_llm_call(self, primary, secondary, payload):
+        """asyncio counterpart of llm_hedge.call_with_hedge; the loser is cancelled."""
+        llm_hedge._bump('requests')
+        tasks = {asyncio.ensure_future(self._llm_call(primary, payload)): primary}
+        done, _ = await asyncio.wait(set(tasks), timeout=llm_hedge.hedge_delay_seconds(primary, self.config))
+        hedged = False
+        first_error = None
+        while True:
+            for task in done:
+                body, status = task.result()
+                provider = tasks.pop(task)
+                if status == 200:
+                    for other in tasks:
+                        other.cancel()
+                    llm_hedge._bump('primary_wins' if provider == primary else 'secondary_wins')
+                    return body, status
+                if provider == primary:
+                    first_error = (body, status)
+            if not hedged:
+                tasks[asyncio.ensure_future(self._llm_call(secondary, payload))] = secondary
+                llm_hedge._bump('hedges_fired')
+                hedged = True
+            if not tasks:
+                break
+            done, _ = await asyncio.wait(set(tasks), return_when=asyncio.FIRST_COMPLETED)
+        llm_hedge._bump('failures')
+        return first_error or ({'error': 'All hedged LLM providers failed.'}, 500)
+
+    async def generate_prompt(self, user_id, data):
+        try:
+            payload = ai_service._request_llm_payload(user_id, data, self.config)
+        except story_context.ContextMissing:
+            return dict(ai_service.CONTEXT_MISSING_BODY), 409
+        provider = self.config.get('LLM_PROVIDER', 'gemini')
+        print(f"[LLM ASYNC] user={user_id} provider={provider}")
+        # May wait on an in-flight prefetch: keep it off the event loop
+        prefetched = await self.run_sync(ai_service._prefetched_llm_body, user_id, data, provider, payload, self.config)
+        if prefetched is not None:
+            await self.run_sync(ai_service._speculate_image, user_id, data, prefetched)
+            return prefetched, 200
+        if provider == 'mock':
+            body = ai_service._mock_llm_body(payload)
+            await self.run_sync(ai_service._speculate_image, user_id, data, body)
+            return body, 200
+        if provider not in ai_service.LLM_KEY_NAMES:
+            provider = 'gemini'
+        cache_key, temperature, cached_body = ai_service._llm_cache_probe(provider, payload, data, self.config)
+        if cached_body is not None:
+            await self.run_sync(ai_service._speculate_image, user_id, data, cached_body)
+            return cached_body, 200
+        hedge_provider = llm_hedge.hedge_provider_for(provider, self.config)
+        if hedge_provider:
+            body, status = await self._hedged_llm_call(provider, hedge_provider, payload)
+        else:
+            body, status = await self._llm_call(provider, payload)
+        if status == 200:
+            ai_service._llm_cache_fill(cache_key, temperature, body, self.config)
+            await self.run_sync(ai_service._speculate_image, user_id, data, body)
+        return body, status
+
+    async def generate_image(self, user_id, data):
+        provider = self.config.get('IMAGE_PROVIDER', 'google')
+        if provider not in ('stability', 'free'):
+            return None  # no async adapter; serve through the sync route
+        payload = data['payload']
+        prompt_text = ai_service._extract_prompt_from_payload(payload)
+        params = ai_service._image_params_from_payload(payload)
+        cache_key = ai_service._make_image_cache_key(prompt_text, provider, params)
+        cache_ttl = self.config.get('IMAGE_CACHE_TTL_SECONDS', 60 * 60 * 24)
+        want_urls = ai_service._wants_image_urls(data, self.config)
+
+        if want_urls:
+            url_body = await self.run_sync(ai_service._image_url_body, cache_key, cache_ttl)
+            if url_body:
+                return url_body, 200
+        else:
+            cached = await self.run_sync(ai_service._load_image_cache, cache_key, cache_ttl)
+            if cached:
+                return {'predictions': [{'bytesBase64Encoded': b} for b in cached], 'cached': True}, 200
+        similar = await self.run_sync(ai_service._find_similar_cached, prompt_text, provider, params, cache_key, cache_ttl)
+        if similar:
+            body = ai_service._similar_image_body(similar)
+            if want_urls:
+                body = await self.run_sync(ai_service._image_body_as_urls, body, 200, cache_key)
+            return body, 200
+
+        async def generate():
+            body, status = await self._generate_image_uncached(provider, prompt_text, params, cache_key)
+            return {'kind': 'response', 'body': body, 'status': status}
+
+        value, _ = await singleflight.do_async(cache_key, generate)
+        body, status = await self.run_sync(ai_service._image_response_from_flight, value, cache_key, cache_ttl)
+        if want_urls:
+            body = await self.run_sync(ai_service._image_body_as_urls, body, status, cache_key)
+        return body, status
+
+    async def _generate_image_uncached(self, provider, prompt_text, params, cache_key):
+        body = {}
+        if provider == 'free':
+            b64 = await self._picsum_b64(prompt_text, 800, 450)
+            if not b64:
+                return {'error': 'Picsum image fetch failed.'}, 502
+            b64_list = [b64]
+        else:
+            if not self.config.get('STABILITY_API_KEY'):
+                return {'error': 'STABILITY_API_KEY not configured for stability provider.'}, 400
+            b64_list, error = await self._stability_b64(prompt_text, params)
+            if not b64_list:
+                if not self.config.get('USE_IMAGE_FALLBACK', True):
+                    return {'error': error}, 502
+                b64 = await self._picsum_b64(prompt_text, 800, 450)
+                if not b64:
+                    return {'error': error}, 502
+                b64_list = [b64]
+                body['fallback'] = 'picsum'
+
+        await self.run_sync(ai_service._persist_image_cache, cache_key, b64_list, prompt_text, provider, params)
+        body['predictions'] = [{'bytesBase64Encoded': b64} for b64 in b64_list]
+        return body, 200
+
+    async def generate_image_async(self, user_id, data):
+        payload = data.get('payload') or data
+        prompt_text = ai_service._extract_prompt_from_payload(payload) or str(time.time())
+        job_id = hashlib.sha1(f"{prompt_text}:{time.time()}".encode('utf-8')).hexdigest()[:16]
+        JOBS[job_id] = {'status': 'pending', 'result': None, 'ts': int(time.time()), 'user_id': user_id}
+        await self.run_sync(ai_service._publish_job, job_id)
+        self._spawn(self._image_job(job_id, payload))
+        return {'job_id': job_id, 'status': 'pending'}, 202
+
+    async def _image_job(self, job_id, payload):
+        """Coroutine counterpart of ai_service._async_generate_and_cache."""
+        try:
+            JOBS[job_id]['status'] = 'running'
+            prompt_text = ai_service._extract_prompt_from_payload(payload) or 'async'
+            provider = self.config.get('IMAGE_PROVIDER', 'google')
+            params = ai_service._image_params_from_payload(payload)
+            cache_key = ai_service._make_image_cache_key(prompt_text, provider, params)
+            cache_ttl = self.config.get('IMAGE_CACHE_TTL_SECONDS', 60 * 60 * 24)
+            speculation.claim(cache_key)
+
+            cached = await self.run_sync(ai_service._load_image_cache, cache_key, cache_ttl)
+            similar = None
+            if not cached:
+                similar = await self.run_sync(ai_service._find_similar_cached, prompt_text, provider, params, cache_key, cache_ttl)
+            if cached:
+                result = await self.run_sync(ai_service._cache_job_result, cache_key)
+            elif similar:
+                result = await self.run_sync(ai_service._cache_job_result, similar[0])
+                result['similar'] = {'key': similar[0], 'score': round(similar[1], 3)}
+            else:
+                async def generate():
+                    return {'kind': 'job', 'result': await self._generate_job_image(provider, prompt_text, params, cache_key)}
+
+                value, _ = await singleflight.do_async(cache_key, generate)
+                result = await self.run_sync(ai_service._job_result_from_flight, value, cache_key)
+            if result is None:
+                JOBS[job_id]['status'] = 'error'
+                JOBS[job_id]['result'] = {'error': 'Failed to generate image from any provider.'}
+            else:
+                JOBS[job_id]['result'] = result
+                JOBS[job_id]['status'] = 'done'
+        except asyncio.CancelledError:
+            JOBS[job_id]['status'] = 'error'
+            JOBS[job_id]['result'] = {'error': 'Job cancelled during shutdown.'}
+            raise
+        except Exception as e:
+            JOBS[job_id]['status'] = 'error'
+            JOBS[job_id]['result'] = {'error': str(e)}
+        await self.run_sync(ai_service._publish_job, job_id)
+
+    async def _generate_job_image(self, provider, prompt_text, params, cache_key):
+        # Same images as the sync route for these params (see ai_service._generate_job_image)
+        b64_list = None
+        if provider == 'stability' and self.config.get('STABILITY_API_KEY'):
+            b64_list, _ = await self._stability_b64(prompt_text, params)
+        if not b64_list:
+            b64 = await self._picsum_b64(prompt_text, 800, 450)
+            b64_list = [b64] if b64 else None
+        if not b64_list:
+            return None
+        await self.run_sync(ai_service._persist_image_cache, cache_key, b64_list, prompt_text, provider, params)
+        return await self.run_sync(ai_service._cache_job_result, cache_key)
+
+    async def generate_main_image(self, user_id, data):
+        payload = data.get('payload') or {}
+        b64 = await self._picsum_b64(ai_service._extract_prompt_from_payload(payload), 1200, 675)
+        if b64:
+            return {'predictions': [{'bytesBase64Encoded': b64}]}, 200
+        if self.config.get('USE_IMAGE_FALLBACK', False):
+            return {'predictions': [{'bytesBase64Encoded': self.config.get('FALLBACK_IMAGE_BASE64')}]}, 200
+        return {'error': 'Picsum image fetch failed.'}, 502
+
+    async def generate_preview(self, user_id, data):
+        payload = data.get('payload') or data
+        prompt_text = ai_service._extract_prompt_from_payload(payload) or 'preview'
+        b64 = await self._picsum_b64(prompt_text, 512, 288)
+        if b64:
+            return {'predictions': [{'bytesBase64Encoded': b64}], 'preview': True}, 200
+        return {'error': 'Preview fetch failed'}, 502
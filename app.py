@@ -18,7 +18,12 @@ except ImportError:
     def init_firebase(): pass
 
 # --- FLASK APP FACTORY ---
-def create_app(config_class=Config):
+def create_app(config_class=Config, asgi=False):
+    """Build the Flask app.
+
+    With asgi=True the app is wrapped in the async serving mode from
+    ai_service_async (AI routes as coroutines, everything else via Flask).
+    """
     app = Flask(__name__, static_folder='static', template_folder='templates')
     app.config.from_object(config_class)
     
@@ -54,12 +59,20 @@ def create_app(config_class=Config):
     def prompts_json():
         return jsonify({}), 200
 
+    if asgi:
+        from ai_service_async import AsyncAIApp
+        return AsyncAIApp(app)
     return app
 
 # --- MAIN EXECUTION ---
 if __name__ == '__main__':
     # NOTE: You must install Flask and requests (pip install Flask requests)
     # The debug flag must be False in production
+    if Config.SERVE_MODE == 'asgi':
+        # Async serving mode: requires uvicorn, httpx and asgiref
+        import uvicorn
+        uvicorn.run('asgi:app', port=5000)
+        raise SystemExit(0)
     app = create_app()
     # Run the dev server
     # Disable the auto-reloader when we start the server from scripts so
@@ -0,0 +1,9 @@
+# asgi.py
+"""ASGI entry point for the async serving mode.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+
+from app import create_app
+
+app = create_app(asgi=True)
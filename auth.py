@@ -41,21 +41,32 @@ def generate_token():
     return secrets.token_hex(32)
 
 
+def resolve_session_user(token_header):
+    """Resolve an Authorization header to a user id.
+
+    Returns (user_id, None) on success or (None, error_message) otherwise.
+    Shared by token_required and the ASGI routes in ai_service_async.
+    """
+    if not token_header or not token_header.startswith('Bearer '):
+        return None, 'Authorization token is missing or invalid'
+    token = token_header.split(' ', 1)[1]
+    username_lower = SESSIONS.get(token)
+    if not username_lower:
+        return None, 'Invalid or expired token'
+    user = USERS.get(username_lower)
+    if not user:
+        return None, 'Invalid session user'
+    return user.get('id'), None
+
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token_header = request.headers.get('Authorization')
-        if not token_header or not token_header.startswith('Bearer '):
-            return jsonify({'error': 'Authorization token is missing or invalid'}), 401
-        token = token_header.split(' ', 1)[1]
-        username_lower = SESSIONS.get(token)
-        if not username_lower:
-            return jsonify({'error': 'Invalid or expired token'}), 401
-        user = USERS.get(username_lower)
-        if not user:
-            return jsonify({'error': 'Invalid session user'}), 401
+        user_id, error = resolve_session_user(request.headers.get('Authorization'))
+        if error:
+            return jsonify({'error': error}), 401
         # Pass user id as the first arg to handlers (existing convention)
-        return f(user.get('id'), *args, **kwargs)
+        return f(user_id, *args, **kwargs)
     return decorated
 
 
@@ -0,0 +1,304 @@
+# cache_backend.py
+"""Pluggable backend for image-cache and job state shared between workers.
+
+Each worker keeps its own JOBS dict and serves images from its local
+image_store. The backend is where that state is published so that other
+workers and nodes can find it:
+
+  - FilesystemBackend (CACHE_BACKEND=filesystem, the default): images are the
+    local image_store itself; job snapshots are JSON files in JOB_STATE_DIR
+    (default <instance>/jobs), shared by the workers of one node.
+  - RedisBackend (CACHE_BACKEND=redis): images and job snapshots live in a
+    Redis-protocol server (CACHE_REDIS_URL), shared by every node. Images are
+    stored content-addressed (blob:<sha256>) with a small JSON record per
+    cache key (img:<key>), both expiring after IMAGE_CACHE_TTL_SECONDS; jobs
+    expire after JOB_TTL_SECONDS.
+
+`shared` tells callers whether the backend holds images beyond the local
+store (and so is worth a lookup after a local miss).
+
+RespClient is a minimal, dependency-free client for the Redis protocol
+(RESP2): one connection per thread, reconnecting once on a broken socket.
+"""
+
+import hashlib
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+from flask import current_app
+
+import image_store
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+class BackendError(Exception):
+    pass
+
+
+class RespClient:
+    """Tiny RESP2 client: command(*args) -> reply (bytes/int/list/None)."""
+
+    def __init__(self, url, timeout=5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int((parsed.path or '/0').lstrip('/') or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.sock = sock
+        self._local.reader = sock.makefile('rb')
+        if self.password:
+            self._roundtrip(('AUTH', self.password))
+        if self.db:
+            self._roundtrip(('SELECT', self.db))
+
+    def close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            try:
+                self._local.reader.close()
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = None
+
+    @staticmethod
+    def _encode(args):
+        out = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if isinstance(arg, bytes):
+                data = arg
+            else:
+                data = str(arg).encode('utf-8')
+            out.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        return b''.join(out)
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError('connection closed by server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise BackendError(rest.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            size = int(rest)
+            if size < 0:
+                return None
+            data = self._local.reader.read(size + 2)
+            return data[:-2]
+        if kind == b'*':
+            count = int(rest)
+            return None if count < 0 else [self._read_reply() for _ in range(count)]
+        raise BackendError(f'unexpected reply {line!r}')
+
+    def _roundtrip(self, args):
+        self._local.sock.sendall(self._encode(args))
+        return self._read_reply()
+
+    def command(self, *args):
+        for attempt in (0, 1):
+            if getattr(self._local, 'sock', None) is None:
+                self._connect()
+            try:
+                return self._roundtrip(args)
+            except (ConnectionError, OSError):
+                self.close()
+                if attempt:
+                    raise
+
+
+class FilesystemBackend:
+    """Local image_store plus job snapshots as JSON files (one node)."""
+
+    name = 'filesystem'
+    shared = False
+
+    def __init__(self, store, jobs_dir, job_ttl):
+        self.store = store
+        self.jobs_dir = jobs_dir
+        self.job_ttl = job_ttl
+        self._puts = 0
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    def _job_path(self, job_id):
+        return os.path.join(self.jobs_dir, f'{os.path.basename(job_id)}.json')
+
+    def put_job(self, job_id, job):
+        fd, tmp = tempfile.mkstemp(dir=self.jobs_dir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(job, f)
+            os.replace(tmp, self._job_path(job_id))
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self._puts += 1
+        if self._puts % 100 == 0:
+            self.prune_jobs()
+
+    def get_job(self, job_id):
+        path = self._job_path(job_id)
+        try:
+            if self.job_ttl and time.time() - os.path.getmtime(path) > self.job_ttl:
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def prune_jobs(self):
+        cutoff = time.time() - self.job_ttl if self.job_ttl else None
+        removed = 0
+        for name in os.listdir(self.jobs_dir):
+            path = os.path.join(self.jobs_dir, name)
+            try:
+                if cutoff is not None and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def put_images(self, key, blobs, meta, ttl_seconds=None):
+        self.store.put(key, blobs, meta.get('prompt'), meta.get('provider'), meta.get('params'), ts=meta.get('ts'))
+
+    def get_images(self, key, ttl_seconds=None):
+        blobs = self.store.get(key, ttl_seconds)
+        return (blobs, self.store.meta(key)) if blobs is not None else None
+
+    def get_blob(self, sha):
+        return None  # blobs are served from the local store directly
+
+    def delete_images(self, key):
+        self.store.delete(key)
+
+    def clear_images(self):
+        self.store.clear()
+
+    def stats(self):
+        return {'backend': self.name, 'jobs_dir': self.jobs_dir}
+
+
+class RedisBackend:
+    """Images and job snapshots in a Redis-protocol server (all nodes)."""
+
+    name = 'redis'
+    shared = True
+
+    def __init__(self, client, prefix='storygen:', job_ttl=86400, image_ttl=86400):
+        self.client = client
+        self.prefix = prefix
+        self.job_ttl = int(job_ttl or 0)
+        self.image_ttl = int(image_ttl or 0)
+        self.stats_counters = {'image_hits': 0, 'image_misses': 0, 'image_puts': 0, 'job_puts': 0}
+
+    def _k(self, *parts):
+        return self.prefix + ':'.join(parts)
+
+    def _set(self, key, value, ttl):
+        if ttl:
+            self.client.command('SET', key, value, 'EX', ttl)
+        else:
+            self.client.command('SET', key, value)
+
+    def put_job(self, job_id, job):
+        self._set(self._k('job', job_id), json.dumps(job), self.job_ttl)
+        self.stats_counters['job_puts'] += 1
+
+    def get_job(self, job_id):
+        raw = self.client.command('GET', self._k('job', job_id))
+        return json.loads(raw) if raw else None
+
+    def put_images(self, key, blobs, meta, ttl_seconds=None):
+        ttl = int(ttl_seconds or self.image_ttl)
+        shas = []
+        for data in blobs:
+            sha = hashlib.sha256(data).hexdigest()
+            self._set(self._k('blob', sha), data, ttl)
+            shas.append(sha)
+        # The record goes last: readers only see entries whose blobs exist
+        record = dict(meta, blobs=shas, ts=int(meta.get('ts') or time.time()))
+        self._set(self._k('img', key), json.dumps(record), ttl)
+        self.stats_counters['image_puts'] += 1
+
+    def get_images(self, key, ttl_seconds=None):
+        raw = self.client.command('GET', self._k('img', key))
+        record = json.loads(raw) if raw else None
+        if record and ttl_seconds and time.time() - record.get('ts', 0) > ttl_seconds:
+            record = None
+        blobs = None
+        if record and record.get('blobs'):
+            blobs = self.client.command('MGET', *[self._k('blob', sha) for sha in record['blobs']])
+        if not blobs or any(b is None for b in blobs):
+            self.stats_counters['image_misses'] += 1
+            return None
+        self.stats_counters['image_hits'] += 1
+        return blobs, record
+
+    def get_blob(self, sha):
+        return self.client.command('GET', self._k('blob', sha))
+
+    def delete_images(self, key):
+        # Blobs may be shared with other keys; they expire on their own
+        self.client.command('DEL', self._k('img', key))
+
+    def clear_images(self):
+        for pattern in (self._k('img', '*'), self._k('blob', '*')):
+            cursor = b'0'
+            while True:
+                cursor, keys = self.client.command('SCAN', cursor, 'MATCH', pattern, 'COUNT', 500)
+                if keys:
+                    self.client.command('DEL', *keys)
+                if cursor in (b'0', 0):
+                    break
+
+    def stats(self):
+        return dict(self.stats_counters, backend=self.name, prefix=self.prefix)
+
+
+def get_backend(config=None):
+    """Return the configured backend for the current app (created once)."""
+    if config is None:
+        config = current_app.config
+    name = (config.get('CACHE_BACKEND') or 'filesystem').lower()
+    if name == 'redis':
+        url = config.get('CACHE_REDIS_URL') or 'redis://localhost:6379/0'
+        key = ('redis', url, config.get('CACHE_KEY_PREFIX', 'storygen:'))
+    elif name == 'filesystem':
+        store = image_store.get_store(config=config)
+        jobs_dir = config.get('JOB_STATE_DIR') or os.path.join(current_app.instance_path, 'jobs')
+        key = ('filesystem', store.uploads_dir, store.index_path, os.path.abspath(jobs_dir))
+    else:
+        raise ValueError(f'Unknown CACHE_BACKEND: {name}')
+    backend = _backends.get(key)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(key)
+            if backend is None:
+                job_ttl = int(config.get('JOB_TTL_SECONDS', 86400) or 0)
+                if name == 'redis':
+                    backend = RedisBackend(RespClient(key[1]), key[2], job_ttl,
+                                           int(config.get('IMAGE_CACHE_TTL_SECONDS', 86400) or 0))
+                else:
+                    backend = FilesystemBackend(store, key[3], job_ttl)
+                _backends[key] = backend
+    return backend
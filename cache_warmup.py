@@ -0,0 +1,138 @@
+# cache_warmup.py
+"""Pre-seed the image cache from a list of prompts (tools/warm_image_cache.py).
+
+Each line of the input is either a plain prompt or a JSON object
+{"prompt", "art_style", "params"}. It is turned into the payload the UI
+sends ("<prompt>, in the style of <art_style>", params over the UI's
+defaults, ai_service.UI_IMAGE_PARAMETERS). Keys are computed with _job_image_key/_make_image_cache_key and
+images are generated with _generate_job_image, which persists through
+_persist_image_cache, so the entries are ordinary cache entries the server
+hits.
+
+Prompts already in the cache are skipped, and several prompts mapping to
+the same key are generated once. At most `concurrency` generations run at a
+time. With a state file, every finished key is appended to it, so an
+interrupted run resumes where it stopped. Failed keys are retried on the
+next run.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from flask import current_app
+
+import ai_service
+import singleflight
+
+
+def parse_line(line):
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if line.startswith('{'):
+        item = json.loads(line)
+        if not isinstance(item, dict) or not item.get('prompt'):
+            raise ValueError(f'item without a prompt: {line[:80]}')
+        return item
+    return {'prompt': line}
+
+
+def load_items(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [item for item in (parse_line(line) for line in f) if item is not None]
+
+
+def item_payload(item):
+    """The generate-image-async payload the UI would send for this item."""
+    prompt = item['prompt'].strip()
+    if item.get('art_style'):
+        prompt = f"{prompt}, in the style of {item['art_style']}"
+    params = dict(ai_service.UI_IMAGE_PARAMETERS, **(item.get('params') or {}))
+    return {'instances': [{'prompt': prompt}], 'parameters': params}
+
+
+def _load_state(state_path):
+    done = set()
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by an interrupted run
+                if record.get('status') == 'done':
+                    done.add(record['key'])
+    except OSError:
+        pass
+    return done
+
+
+def warm(items, concurrency=4, state_path=None, dry_run=False, report=print):
+    """Generate cache entries for items that are not cached yet.
+
+    Must run inside an app context. Returns a summary dict.
+    """
+    app_obj = current_app._get_current_object()
+    cache_ttl = app_obj.config.get('IMAGE_CACHE_TTL_SECONDS', 60 * 60 * 24)
+    done_before = _load_state(state_path) if state_path else set()
+    summary = {'items': len(items), 'unique': 0, 'cached': 0, 'resumed': 0,
+               'generated': 0, 'failed': 0, 'dry_run': dry_run}
+
+    todo = {}
+    for item in items:
+        prompt_text, provider, params, cache_key = ai_service._job_image_key(item_payload(item))
+        if cache_key in todo:
+            continue
+        todo[cache_key] = (prompt_text, provider, params)
+    summary['unique'] = len(todo)
+
+    pending = []
+    for cache_key, job in todo.items():
+        if ai_service._load_image_cache(cache_key, ttl_seconds=cache_ttl):
+            summary['cached' if cache_key not in done_before else 'resumed'] += 1
+        else:
+            pending.append((cache_key, job))
+    report(f"[WARMUP] {summary['unique']} unique prompts: {summary['cached'] + summary['resumed']} "
+           f"already cached, {len(pending)} to generate")
+    if dry_run or not pending:
+        return summary
+
+    lock = threading.Lock()
+    started = time.time()
+    state = open(state_path, 'a', encoding='utf-8') if state_path else None
+
+    def generate(cache_key, job):
+        prompt_text, provider, params = job
+        with app_obj.app_context():
+            value, _ = singleflight.do(
+                cache_key,
+                lambda: {'kind': 'job', 'result': ai_service._generate_job_image(prompt_text, provider, params, cache_key)}
+            )
+            return ai_service._job_result_from_flight(value, cache_key) is not None
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, int(concurrency)), thread_name_prefix='cache-warmup') as pool:
+            futures = {pool.submit(generate, key, job): key for key, job in pending}
+            for finished, future in enumerate(as_completed(futures), 1):
+                key = futures[future]
+                try:
+                    ok = future.result()
+                except Exception as e:
+                    print(f"[WARMUP] ❌ {key}: {str(e)}")
+                    ok = False
+                with lock:
+                    summary['generated' if ok else 'failed'] += 1
+                    if state:
+                        state.write(json.dumps({'key': key, 'status': 'done' if ok else 'failed',
+                                                'ts': int(time.time())}) + '\n')
+                        state.flush()
+                elapsed = time.time() - started
+                eta = elapsed / finished * (len(pending) - finished)
+                report(f"[WARMUP] {finished}/{len(pending)} generated={summary['generated']} "
+                       f"failed={summary['failed']} elapsed={elapsed:.0f}s eta={eta:.0f}s")
+    finally:
+        if state:
+            state.close()
+    return summary
@@ -0,0 +1,203 @@
+# circuit_breaker.py
+"""Per-provider circuit breakers with negative caching of permanent errors.
+
+Each upstream provider (gemini, groq, stability, imagen, picsum, ...) has a
+breaker with the usual three states:
+
+  closed     requests flow; consecutive failures are counted
+  open       requests are rejected immediately until the cool-down ends
+  half_open  a limited number of probe requests are let through; a success
+             closes the breaker, a failure re-opens it
+
+Failures are classified. Transient ones (timeouts, connection errors, 5xx)
+open the breaker after BREAKER_FAILURE_THRESHOLD in a row. Permanent ones
+(bad credentials, billing, exhausted quota) open it at once for the longer
+BREAKER_PERMANENT_COOLDOWN_SECONDS, so e.g. an Imagen "billed users" error
+is not rediscovered on every request.
+
+provider_client consults the breaker before every call and raises
+CircuitOpenError (a requests ConnectionError) when it is open, so existing
+fallback paths (Picsum, hedging) kick in without waiting for a timeout.
+"""
+
+import threading
+import time
+
+import requests
+from flask import current_app, has_app_context
+
+from config import Config
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Markers in upstream error bodies that mean retrying soon is pointless
+PERMANENT_ERROR_MARKERS = (
+    'billed users',
+    'billing',
+    'insufficient_quota',
+    'quota exceeded',
+    'exceeded your current quota',
+    'credit balance',
+    'invalid api key',
+    'invalid_api_key',
+    'api key not valid',
+    'permission_denied',
+)
+
+_lock = threading.Lock()
+BREAKERS = {}  # provider -> state dict (see _new_state)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling a provider whose breaker is open."""
+
+    def __init__(self, provider, reason=None, retry_after=None):
+        self.provider = provider
+        self.reason = reason
+        self.retry_after = retry_after
+        msg = f"Circuit open for provider '{provider}'"
+        if reason:
+            msg += f" ({reason})"
+        if retry_after is not None:
+            msg += f"; retry in {int(retry_after)}s"
+        super().__init__(msg)
+
+
+def _config_value(name, default=None):
+    if has_app_context():
+        return current_app.config.get(name, default)
+    return getattr(Config, name, default)
+
+
+def _new_state():
+    return {
+        'state': CLOSED,
+        'failures': 0,
+        'opened_at': None,
+        'open_until': None,
+        'reason': None,
+        'permanent': False,
+        'probes_in_flight': 0,
+        'rejected': 0,
+        'trips': 0,
+    }
+
+
+def _state(provider):
+    st = BREAKERS.get(provider)
+    if st is None:
+        st = BREAKERS[provider] = _new_state()
+    return st
+
+
+def classify_error(status_code=None, text=''):
+    """Classify an upstream outcome as 'ok', 'client', 'transient' or 'permanent'."""
+    body = (text or '').lower()
+    if status_code is not None and status_code < 400:
+        return 'ok'
+    if any(marker in body for marker in PERMANENT_ERROR_MARKERS):
+        return 'permanent'
+    if status_code in (401, 402, 403):
+        return 'permanent'
+    if status_code is None or status_code >= 500 or status_code in (408, 429):
+        return 'transient'
+    return 'client'  # other 4xx: our request was bad, the provider is healthy
+
+
+def allow_request(provider):
+    """Return True if a call to `provider` may proceed (may reserve a probe)."""
+    if not _config_value('BREAKER_ENABLED', True):
+        return True
+    now = time.time()
+    with _lock:
+        st = _state(provider)
+        if st['state'] == OPEN:
+            if now < (st['open_until'] or 0):
+                st['rejected'] += 1
+                return False
+            st['state'] = HALF_OPEN
+            st['probes_in_flight'] = 0
+        if st['state'] == HALF_OPEN:
+            if st['probes_in_flight'] >= int(_config_value('BREAKER_HALF_OPEN_PROBES', 1)):
+                st['rejected'] += 1
+                return False
+            st['probes_in_flight'] += 1
+        return True
+
+
+def check(provider):
+    """Raise CircuitOpenError if `provider` is not currently accepting calls."""
+    if allow_request(provider):
+        return
+    with _lock:
+        st = _state(provider)
+        retry_after = max(0, (st['open_until'] or time.time()) - time.time())
+        reason = st['reason']
+    raise CircuitOpenError(provider, reason=reason, retry_after=retry_after)
+
+
+def record_success(provider):
+    with _lock:
+        st = _state(provider)
+        st.update(state=CLOSED, failures=0, opened_at=None, open_until=None,
+                  reason=None, permanent=False, probes_in_flight=0)
+
+
+def record_failure(provider, permanent=False, reason=None):
+    now = time.time()
+    with _lock:
+        st = _state(provider)
+        st['failures'] += 1
+        if st['state'] == HALF_OPEN:
+            st['probes_in_flight'] = max(0, st['probes_in_flight'] - 1)
+        threshold = int(_config_value('BREAKER_FAILURE_THRESHOLD', 5))
+        if permanent or st['state'] == HALF_OPEN or st['failures'] >= threshold:
+            if permanent:
+                cooldown = float(_config_value('BREAKER_PERMANENT_COOLDOWN_SECONDS', 600))
+            else:
+                cooldown = float(_config_value('BREAKER_RESET_SECONDS', 30))
+            if st['state'] != OPEN:
+                st['trips'] += 1
+            st.update(state=OPEN, opened_at=now, open_until=now + cooldown,
+                      reason=(reason or '')[:200] or None, permanent=bool(permanent))
+            print(f"[BREAKER] {provider} OPEN for {int(cooldown)}s ({'permanent' if permanent else 'transient'}): {st['reason']}")
+
+
+def record_response(provider, status_code, text=''):
+    """Feed an HTTP outcome into the breaker using classify_error()."""
+    kind = classify_error(status_code, text)
+    if kind in ('ok', 'client'):
+        record_success(provider)
+    else:
+        record_failure(provider, permanent=(kind == 'permanent'), reason=f"HTTP {status_code}: {(text or '')[:160]}")
+
+
+def record_exception(provider, exc):
+    """Feed a transport-level exception (timeout, connection) into the breaker."""
+    if isinstance(exc, CircuitOpenError):
+        return
+    record_failure(provider, permanent=False, reason=f"{type(exc).__name__}: {str(exc)[:160]}")
+
+
+def snapshot():
+    """Return a JSON-safe view of every breaker for /api/ai/status."""
+    now = time.time()
+    with _lock:
+        out = {}
+        for provider, st in BREAKERS.items():
+            view = dict(st)
+            if view['state'] == OPEN and view['open_until']:
+                view['retry_after'] = max(0, int(view['open_until'] - now))
+            out[provider] = view
+        return out
+
+
+def reset(provider=None):
+    """Close one breaker (or all of them)."""
+    with _lock:
+        if provider is None:
+            BREAKERS.clear()
+        else:
+            BREAKERS.pop(provider, None)
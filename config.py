@@ -73,6 +73,196 @@ class Config:
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY') or None  # Free trial credits
     ANTHROPIC_API_KEY = os.environ.get('ANTHROPIC_API_KEY') or None  # Free credits
 
+    # --- OUTBOUND HTTP POOL CONFIG ---
+    # All provider calls share one keep-alive session (see provider_client.py).
+    # HTTP_POOL_MAXSIZE is the number of warm connections kept per host;
+    # HTTP_POOL_SIZES overrides it per provider, e.g. "stability=20,gemini=16".
+    HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))
+    HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 10))
+    HTTP_POOL_SIZES = os.environ.get('HTTP_POOL_SIZES', '')
+
+    # --- SERVING MODE ---
+    # 'wsgi' = classic Flask dev server / gunicorn (default, good for dev)
+    # 'asgi' = async AI routes on an event loop (run `uvicorn asgi:app`)
+    SERVE_MODE = os.environ.get('SERVE_MODE', 'wsgi').lower()
+    # Async HTTP client limits used in ASGI mode
+    ASYNC_HTTP_MAX_CONNECTIONS = int(os.environ.get('ASYNC_HTTP_MAX_CONNECTIONS', 1000))
+    ASYNC_HTTP_MAX_KEEPALIVE = int(os.environ.get('ASYNC_HTTP_MAX_KEEPALIVE', 100))
+
+    # --- LLM HEDGING (opt-in) ---
+    # When enabled, a generate-prompt request that hasn't been answered by
+    # LLM_PROVIDER within its recent LLM_HEDGE_PERCENTILE latency is also sent
+    # to LLM_HEDGE_PROVIDER; the first successful answer wins.
+    LLM_HEDGE_ENABLED = os.environ.get('LLM_HEDGE_ENABLED', 'False').lower() == 'true'
+    LLM_HEDGE_PROVIDER = os.environ.get('LLM_HEDGE_PROVIDER') or None
+    LLM_HEDGE_PERCENTILE = float(os.environ.get('LLM_HEDGE_PERCENTILE', 95))
+    # Until LLM_HEDGE_MIN_SAMPLES latencies are known, hedge after this delay
+    LLM_HEDGE_MIN_SAMPLES = int(os.environ.get('LLM_HEDGE_MIN_SAMPLES', 20))
+    LLM_HEDGE_DEFAULT_DELAY_MS = int(os.environ.get('LLM_HEDGE_DEFAULT_DELAY_MS', 2000))
+    LLM_HEDGE_MIN_DELAY_MS = int(os.environ.get('LLM_HEDGE_MIN_DELAY_MS', 250))
+    LLM_HEDGE_MAX_WORKERS = int(os.environ.get('LLM_HEDGE_MAX_WORKERS', 32))
+    # Hedged calls can't be interrupted once started: cap each one so a losing
+    # call frees its worker within this many seconds
+    LLM_HEDGE_CALL_TIMEOUT = float(os.environ.get('LLM_HEDGE_CALL_TIMEOUT', 15))
+
+    # --- CIRCUIT BREAKERS ---
+    # A provider's breaker opens after BREAKER_FAILURE_THRESHOLD consecutive
+    # transient failures (timeouts, 5xx) for BREAKER_RESET_SECONDS, then lets
+    # BREAKER_HALF_OPEN_PROBES probe requests through. Permanent errors (auth,
+    # billing, quota) open it immediately for BREAKER_PERMANENT_COOLDOWN_SECONDS.
+    BREAKER_ENABLED = os.environ.get('BREAKER_ENABLED', 'True').lower() == 'true'
+    BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))
+    BREAKER_RESET_SECONDS = int(os.environ.get('BREAKER_RESET_SECONDS', 30))
+    BREAKER_HALF_OPEN_PROBES = int(os.environ.get('BREAKER_HALF_OPEN_PROBES', 1))
+    BREAKER_PERMANENT_COOLDOWN_SECONDS = int(os.environ.get('BREAKER_PERMANENT_COOLDOWN_SECONDS', 600))
+
+    # --- ADAPTIVE TIMEOUTS ---
+    # Read timeouts follow each provider's recent p99 latency (from a rolling
+    # LATENCY_WINDOW_SECONDS histogram) times ADAPTIVE_TIMEOUT_HEADROOM,
+    # clamped per provider (PROVIDER_TIMEOUT_BOUNDS, e.g. "gemini=3:20").
+    # Fixed defaults apply until ADAPTIVE_TIMEOUT_MIN_SAMPLES calls are seen.
+    ADAPTIVE_TIMEOUTS_ENABLED = os.environ.get('ADAPTIVE_TIMEOUTS_ENABLED', 'True').lower() == 'true'
+    ADAPTIVE_TIMEOUT_HEADROOM = float(os.environ.get('ADAPTIVE_TIMEOUT_HEADROOM', 1.5))
+    ADAPTIVE_TIMEOUT_MIN_SAMPLES = int(os.environ.get('ADAPTIVE_TIMEOUT_MIN_SAMPLES', 30))
+    LATENCY_WINDOW_SECONDS = int(os.environ.get('LATENCY_WINDOW_SECONDS', 900))
+    PROVIDER_CONNECT_TIMEOUT = float(os.environ.get('PROVIDER_CONNECT_TIMEOUT', 3.05))
+    PROVIDER_TIMEOUT_BOUNDS = os.environ.get('PROVIDER_TIMEOUT_BOUNDS', '')
+
+    # --- LLM RESPONSE CACHE (opt-in) ---
+    # Identical generate-prompt payloads are answered from an in-memory LRU
+    # (LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_SECONDS). Calls hotter than
+    # LLM_CACHE_MAX_TEMPERATURE skip it; above LLM_CACHE_VARIETY_TEMPERATURE
+    # up to LLM_CACHE_VARIANTS answers per prompt are kept and rotated.
+    LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_ENABLED', 'False').lower() == 'true'
+    LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 1000))
+    LLM_CACHE_TTL_SECONDS = int(os.environ.get('LLM_CACHE_TTL_SECONDS', 3600))
+    LLM_CACHE_MAX_TEMPERATURE = float(os.environ.get('LLM_CACHE_MAX_TEMPERATURE', 1.0))
+    LLM_CACHE_VARIETY_TEMPERATURE = float(os.environ.get('LLM_CACHE_VARIETY_TEMPERATURE', 0.3))
+    LLM_CACHE_VARIANTS = int(os.environ.get('LLM_CACHE_VARIANTS', 3))
+
+    # --- SIMILAR-PROMPT IMAGE REUSE (opt-in) ---
+    # Serve a cached image whose prompt has word-shingle Jaccard similarity
+    # >= IMAGE_SIMILARITY_THRESHOLD with the requested one (same provider and
+    # params only). The MinHash/LSH index is rebuilt from cache metadata every
+    # IMAGE_SIMILARITY_REFRESH_SECONDS.
+    IMAGE_SIMILARITY_ENABLED = os.environ.get('IMAGE_SIMILARITY_ENABLED', 'False').lower() == 'true'
+    IMAGE_SIMILARITY_THRESHOLD = float(os.environ.get('IMAGE_SIMILARITY_THRESHOLD', 0.8))
+    IMAGE_SIMILARITY_SHINGLE = int(os.environ.get('IMAGE_SIMILARITY_SHINGLE', 2))
+    IMAGE_SIMILARITY_REFRESH_SECONDS = int(os.environ.get('IMAGE_SIMILARITY_REFRESH_SECONDS', 300))
+
+    # --- SERVER-SIDE STORY CONTEXT ---
+    # generate-prompt requests that reference a story id get their context
+    # assembled here: the last STORY_CONTEXT_RECENT_SCENES narratives plus a
+    # rolling one-line-per-scene summary, within STORY_CONTEXT_TOKEN_BUDGET.
+    STORY_CONTEXT_TOKEN_BUDGET = int(os.environ.get('STORY_CONTEXT_TOKEN_BUDGET', 1500))
+    STORY_CONTEXT_RECENT_SCENES = int(os.environ.get('STORY_CONTEXT_RECENT_SCENES', 3))
+    STORY_CONTEXT_MAX_SUMMARY_ITEMS = int(os.environ.get('STORY_CONTEXT_MAX_SUMMARY_ITEMS', 40))
+    STORY_CONTEXT_MAX_STORIES = int(os.environ.get('STORY_CONTEXT_MAX_STORIES', 10000))
+
+    # --- BATCH SCENE GENERATION ---
+    # /generate-prompt/batch asks the provider for up to LLM_BATCH_MAX_SCENES
+    # consecutive scenes in one structured call, falling back to parallel
+    # single-scene calls (at most LLM_BATCH_MAX_WORKERS at a time).
+    LLM_BATCH_MAX_SCENES = int(os.environ.get('LLM_BATCH_MAX_SCENES', 10))
+    LLM_BATCH_MAX_WORKERS = int(os.environ.get('LLM_BATCH_MAX_WORKERS', 8))
+
+    # --- BATCH IMAGE GENERATION ---
+    # /generate-image-batch accepts up to IMAGE_BATCH_MAX_ITEMS prompts; cache
+    # misses across all batches share IMAGE_BATCH_CONCURRENCY worker threads.
+    IMAGE_BATCH_MAX_ITEMS = int(os.environ.get('IMAGE_BATCH_MAX_ITEMS', 50))
+    IMAGE_BATCH_CONCURRENCY = int(os.environ.get('IMAGE_BATCH_CONCURRENCY', 4))
+
+    # --- SPECULATIVE IMAGE GENERATION (opt-in) ---
+    # After generate-prompt, pre-generate the image for the returned
+    # image_prompt on SPECULATIVE_WORKERS low-priority threads, at most
+    # SPECULATIVE_MAX_PER_USER per user per SPECULATIVE_WINDOW_SECONDS.
+    # SPECULATIVE_IMAGE_SAMPLE_COUNT must match what the UI will request:
+    # handleImageGeneration asks for 3 images for a new scene (1 only when
+    # the narration was posted to the storyboard first).
+    SPECULATIVE_IMAGES_ENABLED = os.environ.get('SPECULATIVE_IMAGES_ENABLED', 'False').lower() == 'true'
+    SPECULATIVE_MAX_PER_USER = int(os.environ.get('SPECULATIVE_MAX_PER_USER', 20))
+    SPECULATIVE_WINDOW_SECONDS = int(os.environ.get('SPECULATIVE_WINDOW_SECONDS', 3600))
+    SPECULATIVE_MAX_QUEUE = int(os.environ.get('SPECULATIVE_MAX_QUEUE', 16))
+    SPECULATIVE_WORKERS = int(os.environ.get('SPECULATIVE_WORKERS', 1))
+    SPECULATIVE_IMAGE_SAMPLE_COUNT = int(os.environ.get('SPECULATIVE_IMAGE_SAMPLE_COUNT', 3))
+
+    # --- NEXT-SCENE PREFETCH (opt-in) ---
+    # After save-session, generate the next scene for STORY_PREFETCH_PROMPTS
+    # ("|"-separated; default the Continue button's prompt) in the background
+    # so an unedited continue is answered instantly.
+    STORY_PREFETCH_ENABLED = os.environ.get('STORY_PREFETCH_ENABLED', 'False').lower() == 'true'
+    STORY_PREFETCH_PROMPTS = os.environ.get('STORY_PREFETCH_PROMPTS') or None
+    STORY_PREFETCH_MAX_STORIES = int(os.environ.get('STORY_PREFETCH_MAX_STORIES', 2))
+    STORY_PREFETCH_WORKERS = int(os.environ.get('STORY_PREFETCH_WORKERS', 2))
+    # A continue that arrives while its prefetch is running waits this long
+    # for it rather than calling the LLM a second time
+    STORY_PREFETCH_WAIT_SECONDS = float(os.environ.get('STORY_PREFETCH_WAIT_SECONDS', 30))
+
+    # --- IMAGE CACHE STORE ---
+    # SQLite index of the image cache (see image_store.py). Defaults to a file
+    # in the Flask instance folder, one per uploads directory.
+    IMAGE_CACHE_INDEX_PATH = os.environ.get('IMAGE_CACHE_INDEX_PATH') or None
+    # Image cache keys are canonical (v2); while this is on, a miss also looks
+    # up the pre-v2 key of the request and copies a hit over to the v2 key.
+    IMAGE_CACHE_KEY_COMPAT = os.environ.get('IMAGE_CACHE_KEY_COMPAT', 'True').lower() == 'true'
+    # Disk budget (0 = unlimited) enforced by a background janitor that also
+    # removes entries older than IMAGE_CACHE_TTL_SECONDS. Eviction policy:
+    # "lru" (least recently used) or "lfu" (least frequently used).
+    IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 0))
+    IMAGE_CACHE_MAX_ENTRIES = int(os.environ.get('IMAGE_CACHE_MAX_ENTRIES', 0))
+    IMAGE_CACHE_EVICTION = os.environ.get('IMAGE_CACHE_EVICTION', 'lru')
+    IMAGE_CACHE_JANITOR_INTERVAL = int(os.environ.get('IMAGE_CACHE_JANITOR_INTERVAL', 60))
+    IMAGE_CACHE_JANITOR_BATCH = int(os.environ.get('IMAGE_CACHE_JANITOR_BATCH', 100))
+    # In-memory hot tier (raw bytes + base64 of recently used entries, LRU)
+    # per worker; 0 disables it. Entries are revalidated against the index
+    # after IMAGE_HOT_TIER_MAX_AGE seconds so deletions by other workers show.
+    IMAGE_HOT_TIER_MAX_BYTES = int(os.environ.get('IMAGE_HOT_TIER_MAX_BYTES', 64 * 1024 * 1024))
+    IMAGE_HOT_TIER_MAX_AGE = int(os.environ.get('IMAGE_HOT_TIER_MAX_AGE', 60))
+
+    # --- IMAGE RESPONSES ---
+    # Default generate-image response format when the request doesn't ask for
+    # one ("base64" for legacy clients, or "url" for /api/ai/images links).
+    # IMAGE_ACCEL_REDIRECT_PREFIX: internal nginx location aliased to
+    # static/uploads; /api/ai/images then answers with X-Accel-Redirect.
+    # (USE_X_SENDFILE=True is Flask's equivalent for X-Sendfile servers.)
+    IMAGE_RESPONSE_MODE = os.environ.get('IMAGE_RESPONSE_MODE', 'base64')
+    IMAGE_ACCEL_REDIRECT_PREFIX = os.environ.get('IMAGE_ACCEL_REDIRECT_PREFIX') or None
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', 'False').lower() == 'true'
+
+    # --- IMAGE VARIANTS ---
+    # Compressed thumbnail/medium/full variants rendered in a process pool
+    # after each image is cached (needs Pillow; see image_variants.py).
+    # Formats: "webp" and optionally "avif".
+    IMAGE_VARIANTS_ENABLED = os.environ.get('IMAGE_VARIANTS_ENABLED', 'True').lower() == 'true'
+    IMAGE_VARIANT_WIDTHS = os.environ.get('IMAGE_VARIANT_WIDTHS', '256,768')
+    IMAGE_VARIANT_FORMATS = os.environ.get('IMAGE_VARIANT_FORMATS', 'webp')
+    IMAGE_VARIANT_QUALITY = int(os.environ.get('IMAGE_VARIANT_QUALITY', 80))
+    IMAGE_VARIANT_WORKERS = int(os.environ.get('IMAGE_VARIANT_WORKERS', 2))
+
+    # --- SHARED CACHE BACKEND ---
+    # Where image-cache and job state is shared (see cache_backend.py):
+    # "filesystem" (workers of one node; job snapshots in JOB_STATE_DIR,
+    # default <instance>/jobs) or "redis" (every node, via CACHE_REDIS_URL).
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'filesystem')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    CACHE_KEY_PREFIX = os.environ.get('CACHE_KEY_PREFIX', 'storygen:')
+    JOB_STATE_DIR = os.environ.get('JOB_STATE_DIR') or None
+    JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', 60 * 60 * 24))
+
+    # --- BULK CACHE INVALIDATION ---
+    # /api/ai/cache/invalidate filters (provider, age, prefix, prompt text)
+    # matching more than CACHE_INVALIDATE_SYNC_MAX entries are deleted by a
+    # background job, CACHE_INVALIDATE_BATCH entries per transaction.
+    CACHE_INVALIDATE_SYNC_MAX = int(os.environ.get('CACHE_INVALIDATE_SYNC_MAX', 200))
+    CACHE_INVALIDATE_BATCH = int(os.environ.get('CACHE_INVALIDATE_BATCH', 100))
+
+    # --- IMAGE GENERATION COALESCING ---
+    # Concurrent cache misses for the same image cache key share one upstream
+    # generation; waiters give up and generate themselves after
+    # SINGLEFLIGHT_WAIT_SECONDS.
+    SINGLEFLIGHT_ENABLED = os.environ.get('SINGLEFLIGHT_ENABLED', 'True').lower() == 'true'
+    SINGLEFLIGHT_WAIT_SECONDS = int(os.environ.get('SINGLEFLIGHT_WAIT_SECONDS', 120))
+
     # --- Google OAuth2 configuration (optional) ---
     # To enable "Sign in with Google" set these environment variables in a
     # .env file or your environment. The redirect URI should point to
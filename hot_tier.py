@@ -0,0 +1,114 @@
+# hot_tier.py
+"""In-process hot tier in front of the disk image cache.
+
+Keeps the ready-to-send representations of recently used cache entries
+(file paths, raw bytes and pre-encoded base64) in memory, so a repeat hit
+costs neither an index query, a file read nor a base64 encode.
+
+Bounded by IMAGE_HOT_TIER_MAX_BYTES (raw + base64 sizes) with LRU eviction.
+The owning ImageStore invalidates entries it deletes, evicts or replaces.
+Other workers' deletions are not seen, so entries are revalidated against
+the index after IMAGE_HOT_TIER_MAX_AGE seconds.
+
+Hits are counted here and flushed to the index in batches
+(ImageStore.flush_hits, run by the janitor) to keep the disk tier's LRU/LFU
+order accurate without a write per hit.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class HotTier:
+    def __init__(self, max_bytes, max_age):
+        self.max_bytes = int(max_bytes or 0)
+        self.max_age = float(max_age or 0)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> {'files', 'ts', 'blobs', 'b64', 'size', 'loaded'}
+        self._bytes = 0
+        self._pending_hits = {}
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _size(self, entry):
+        return sum(len(b) for b in entry.get('blobs') or ()) + sum(len(b) for b in entry.get('b64') or ())
+
+    def get(self, key, ttl_seconds=None, need=None):
+        """Return the entry for key if fresh and holding `need` ('blobs'/'b64'), else None."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expired = ttl_seconds and now - entry['ts'] > ttl_seconds
+                stale = self.max_age and now - entry['loaded'] > self.max_age
+                if expired or stale:
+                    self._drop_locked(key)
+                    entry = None
+            if entry is None or (need and entry.get(need) is None):
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            self._pending_hits[key] = self._pending_hits.get(key, 0) + 1
+            return entry
+
+    def put(self, key, files, ts, blobs=None, b64=None):
+        """Remember an entry (merging representations already held for key)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['files'] != list(files) or entry['ts'] != ts:
+                if entry is not None:
+                    self._drop_locked(key, count=False)
+                entry = {'files': list(files), 'ts': ts, 'blobs': None, 'b64': None,
+                         'size': 0, 'loaded': time.time()}
+                self._entries[key] = entry
+            if blobs is not None:
+                entry['blobs'] = list(blobs)
+            if b64 is not None:
+                entry['b64'] = list(b64)
+            self._bytes -= entry['size']
+            entry['size'] = self._size(entry)
+            self._bytes += entry['size']
+            self._entries.move_to_end(key)
+            if entry['size'] > self.max_bytes:
+                self._drop_locked(key, count=False)  # never worth holding
+                return
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop_locked(oldest, count=False)
+                self.stats['evictions'] += 1
+
+    def _drop_locked(self, key, count=True):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry['size']
+            if count:
+                self.stats['invalidations'] += 1
+
+    def invalidate(self, keys=None):
+        """Forget the given keys (or everything when keys is None)."""
+        with self._lock:
+            if keys is None:
+                self.stats['invalidations'] += len(self._entries)
+                self._entries.clear()
+                self._bytes = 0
+                return
+            for key in keys:
+                self._drop_locked(key)
+
+    def take_pending_hits(self):
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+        return pending
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes)
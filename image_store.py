@@ -0,0 +1,791 @@
+# image_store.py
+"""Indexed, content-addressed store for the generated-image cache.
+
+Layout (under static/uploads so the files stay servable as static URLs):
+
+    blobs/<sha[0:2]>/<sha[2:4]>/<sha256>.<ext>   image bytes, named by content
+
+plus a single SQLite index (IMAGE_CACHE_INDEX_PATH, default
+<instance>/image_cache_<dir hash>.sqlite3, outside the public static
+folder) with
+
+    entries(key, prompt, provider, params, ts, size, hits, last_access)
+    entry_blobs(key, idx, sha256, path, size)
+    blobs(sha256, path, size, refs)
+    blob_variants(sha256, width, format, path, size, digest)   see image_variants.py
+
+The content hashes recorded here double as strong ETags for
+/api/ai/images, so conditional requests never rehash or read a file.
+
+Lookups, listings and deletions are index queries instead of opening one
+JSON file per entry or listing the whole directory. The index runs in WAL
+mode with a busy timeout, and every mutation happens inside a
+BEGIN IMMEDIATE transaction, so several gunicorn workers can write safely.
+Blobs are written to a temp file and renamed into place before the
+transaction that references them, so no worker holds the write lock across
+file I/O; a blob is only unlinked (inside a transaction) once no entry
+references it.
+
+Identical images (e.g. the deterministic Picsum fallbacks that many keys
+end up with) are stored once: blobs.refs counts the entry_blobs rows that
+point at a blob, a put of known bytes only bumps the count instead of
+writing the file again, and stats() reports the dedup ratio and bytes saved.
+
+Legacy entries (cache_<key>.json + img_<key>_<n>.png in the uploads root)
+are still read and deleted by exact path. Until migrate() has run for an
+uploads directory, listings and full clears also scan for them; migrate()
+(tools/migrate_image_cache.py) imports them once and records that it ran.
+
+Disk use is bounded by a background janitor (one per store and process):
+it deletes entries older than IMAGE_CACHE_TTL_SECONDS, then evicts least
+recently (IMAGE_CACHE_EVICTION=lru) or least frequently (lfu) used entries
+until the cache is within IMAGE_CACHE_MAX_BYTES / IMAGE_CACHE_MAX_ENTRIES,
+in small batches so readers and writers are never blocked for long.
+
+Bulk invalidation (select_keys + delete_batches) resolves provider, age and
+key-prefix filters through the entries indexes; prompt substring and regex
+filters are only applied to the rows those leave. Matches are deleted in
+transactions of a few hundred entries, so other workers interleave.
+
+In front of the disk sits a per-store in-memory hot tier (hot_tier.py,
+IMAGE_HOT_TIER_MAX_BYTES): repeat hits are answered from memory, and every
+put/delete/evict/clear here drops the affected keys from it.
+"""
+
+import base64
+import functools
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+from flask import current_app
+
+from hot_tier import HotTier
+
+BLOB_DIR = 'blobs'
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    prompt TEXT,
+    provider TEXT,
+    params TEXT,
+    ts INTEGER NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    hits INTEGER NOT NULL DEFAULT 0,
+    last_access REAL
+);
+CREATE INDEX IF NOT EXISTS entries_ts ON entries(ts);
+CREATE INDEX IF NOT EXISTS entries_provider ON entries(provider);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access);
+CREATE INDEX IF NOT EXISTS entries_hits ON entries(hits, last_access);
+CREATE TABLE IF NOT EXISTS entry_blobs (
+    key TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (key, idx)
+);
+CREATE INDEX IF NOT EXISTS entry_blobs_sha ON entry_blobs(sha256);
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS blob_variants (
+    sha256 TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    digest TEXT,
+    PRIMARY KEY (sha256, width, format)
+);
+CREATE TABLE IF NOT EXISTS store_meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+STATS = {'evicted': 0, 'evicted_bytes': 0, 'expired': 0, 'expired_bytes': 0, 'janitor_runs': 0,
+         'dedup_writes_avoided': 0, 'dedup_bytes_avoided': 0}
+
+# ORDER BY clauses choosing eviction victims first
+_EVICTION_ORDER = {
+    'lru': 'last_access ASC',
+    'lfu': 'hits ASC, last_access ASC',
+}
+
+
+@functools.lru_cache(maxsize=32)
+def _compile(pattern):
+    return re.compile(pattern)
+
+
+def _regexp(pattern, value):
+    """SQLite REGEXP operator: `value REGEXP pattern` (re.search semantics)."""
+    return value is not None and _compile(pattern).search(value) is not None
+
+
+def _sniff_ext(data):
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return 'png'
+
+
+def blob_path(sha, ext):
+    """Path of a blob relative to the uploads directory."""
+    return f'{BLOB_DIR}/{sha[:2]}/{sha[2:4]}/{sha}.{ext}'
+
+
+def url_for_file(rel):
+    """Public URL of a cached file: blobs go through /api/ai/images, legacy files are static."""
+    if rel.startswith(BLOB_DIR + '/'):
+        return f"/api/ai/images/{rel.rsplit('/', 1)[-1]}"
+    return f'/static/uploads/{rel}'
+
+
+class ImageStore:
+    """One uploads directory plus its SQLite index."""
+
+    def __init__(self, uploads_dir, index_path, hot_max_bytes=0, hot_max_age=0):
+        self.uploads_dir = uploads_dir
+        self.index_path = index_path
+        self.hot = HotTier(hot_max_bytes, hot_max_age)
+        self._local = threading.local()
+        self.janitor = None
+        self._budget = (0, 0)
+        os.makedirs(uploads_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        db = self._conn()
+        db.executescript(_SCHEMA)
+        if 'digest' not in {c['name'] for c in db.execute('PRAGMA table_info(blob_variants)')}:
+            db.execute('ALTER TABLE blob_variants ADD COLUMN digest TEXT')
+        if db.execute("SELECT 1 FROM store_meta WHERE name = 'blob_refs'").fetchone() is None:
+            # Indexes written before reference counting: derive the counts once
+            with self._tx() as tx:
+                tx.execute('INSERT OR REPLACE INTO blobs (sha256, path, size, refs) '
+                           'SELECT sha256, MIN(path), MAX(size), COUNT(*) FROM entry_blobs GROUP BY sha256')
+                tx.execute("INSERT OR REPLACE INTO store_meta (name, value) VALUES ('blob_refs', '1')")
+
+    # --- connection / transaction helpers ---
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            conn.create_function('regexp', 2, _regexp, deterministic=True)
+            self._local.conn = conn
+        return conn
+
+    class _Tx:
+        def __init__(self, conn):
+            self.conn = conn
+
+        def __enter__(self):
+            self.conn.execute('BEGIN IMMEDIATE')
+            return self.conn
+
+        def __exit__(self, exc_type, exc, tb):
+            self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+            return False
+
+    def _tx(self):
+        return self._Tx(self._conn())
+
+    def _abs(self, rel):
+        return os.path.join(self.uploads_dir, *rel.split('/'))
+
+    # --- blobs ---
+
+    def _write_blob(self, data):
+        """Write data under its content hash (atomically); return (sha, rel path)."""
+        sha = hashlib.sha256(data).hexdigest()
+        rel = blob_path(sha, _sniff_ext(data))
+        path = self._abs(rel)
+        if os.path.exists(path) and os.path.getsize(path) == len(data):
+            return sha, rel
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return sha, rel
+
+    def _stage_blob(self, data):
+        """Make sure data is on disk under its content hash; return (sha, rel path).
+
+        Runs before the index transaction, so the write lock is never held
+        across file I/O. A blob staged for a put that then fails is left
+        unreferenced.
+        """
+        sha = hashlib.sha256(data).hexdigest()
+        rel = blob_path(sha, _sniff_ext(data))
+        path = self._abs(rel)
+        if not (os.path.exists(path) and os.path.getsize(path) == len(data)):
+            self._write_blob(data)
+        return sha, rel
+
+    def _ref_blob(self, db, sha, rel, data):
+        """Take a reference on a staged blob (inside a transaction); return its rel path."""
+        row = db.execute('SELECT path FROM blobs WHERE sha256 = ?', (sha,)).fetchone()
+        if row is not None:
+            db.execute('UPDATE blobs SET refs = refs + 1 WHERE sha256 = ?', (sha,))
+            with _stats_lock:
+                STATS['dedup_writes_avoided'] += 1
+                STATS['dedup_bytes_avoided'] += len(data)
+            rel = row['path']
+        else:
+            db.execute('INSERT INTO blobs (sha256, path, size, refs) VALUES (?, ?, ?, 1)', (sha, rel, len(data)))
+        if not os.path.exists(self._abs(rel)):
+            # Released and unlinked by another worker after it was staged
+            self._write_blob(data)
+        return rel
+
+    def _unlink_blob(self, db, sha, rel):
+        """Remove a blob, its variants and their index rows; return True if the file was removed."""
+        removed = False
+        try:
+            os.remove(self._abs(rel))
+            removed = True
+        except OSError:
+            pass
+        for variant in db.execute('SELECT path FROM blob_variants WHERE sha256 = ?', (sha,)).fetchall():
+            if variant['path'] != rel:
+                try:
+                    os.remove(self._abs(variant['path']))
+                except OSError:
+                    pass
+        db.execute('DELETE FROM blob_variants WHERE sha256 = ?', (sha,))
+        db.execute('DELETE FROM blobs WHERE sha256 = ?', (sha,))
+        return removed
+
+    def _release_blobs(self, db, rows):
+        """Drop one reference per entry_blobs row; unlink blobs nobody references any more."""
+        removed = []
+        for row in rows:
+            db.execute('UPDATE blobs SET refs = refs - 1 WHERE sha256 = ?', (row['sha256'],))
+            ref = db.execute('SELECT refs FROM blobs WHERE sha256 = ?', (row['sha256'],)).fetchone()
+            if ref is not None and ref['refs'] > 0:
+                continue
+            if self._unlink_blob(db, row['sha256'], row['path']):
+                removed.append(row['path'])
+        return removed
+
+    # --- variants (see image_variants.py) ---
+
+    def add_variants(self, sha, variants):
+        """Record rendered [(width, format, path, size, digest)] for a blob, unless it was released meanwhile."""
+        with self._tx() as db:
+            if db.execute('SELECT 1 FROM blobs WHERE sha256 = ? AND refs > 0', (sha,)).fetchone():
+                db.executemany('INSERT OR REPLACE INTO blob_variants (sha256, width, format, path, size, digest) '
+                               'VALUES (?, ?, ?, ?, ?, ?)', [(sha,) + tuple(v) for v in variants])
+                return True
+        for _, _, rel, _, _ in variants[1:]:
+            try:
+                os.remove(self._abs(rel))
+            except OSError:
+                pass
+        return False
+
+    def variants(self, sha):
+        return self._conn().execute(
+            'SELECT width, format, path, size, digest FROM blob_variants WHERE sha256 = ?', (sha,)).fetchall()
+
+    def blobs(self, key):
+        """[(sha256, path)] of an indexed entry."""
+        return [(r['sha256'], r['path']) for r in self._conn().execute(
+            'SELECT sha256, path FROM entry_blobs WHERE key = ? ORDER BY idx', (key,)).fetchall()]
+
+    def blobs_missing_variants(self, limit=100):
+        """[(sha256, path)] of blobs that have not been rendered yet (for backfills)."""
+        return [(r['sha256'], r['path']) for r in self._conn().execute(
+            'SELECT sha256, path FROM blobs '
+            'WHERE refs > 0 AND sha256 NOT IN (SELECT sha256 FROM blob_variants) LIMIT ?',
+            (int(limit),)).fetchall()]
+
+    # --- legacy flat-file entries ---
+
+    def _legacy_meta_path(self, key):
+        return os.path.join(self.uploads_dir, f'cache_{key}.json')
+
+    def _legacy_meta(self, key):
+        try:
+            with open(self._legacy_meta_path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def _legacy_keys(self):
+        try:
+            names = os.listdir(self.uploads_dir)
+        except OSError:
+            return []
+        return [n[len('cache_'):-len('.json')] for n in names if n.startswith('cache_') and n.endswith('.json')]
+
+    def _delete_legacy(self, key):
+        removed = []
+        meta = self._legacy_meta(key)
+        for fname in (meta or {}).get('files', []):
+            try:
+                os.remove(os.path.join(self.uploads_dir, fname))
+                removed.append(fname)
+            except OSError:
+                pass
+        try:
+            os.remove(self._legacy_meta_path(key))
+            removed.append(f'cache_{key}.json')
+        except OSError:
+            pass
+        return removed
+
+    def migrated(self):
+        row = self._conn().execute("SELECT value FROM store_meta WHERE name = 'legacy_migrated'").fetchone()
+        return row is not None
+
+    # --- entries ---
+
+    def put(self, key, blobs, prompt=None, provider=None, params=None, ts=None, encoded=None):
+        """Store image bytes for key, replacing any previous entry.
+
+        `encoded` (the same images as base64 strings, when the caller already
+        has them) seeds the hot tier so the next hit needs no disk read.
+        """
+        ts = int(ts if ts is not None else time.time())
+        self.hot.invalidate([key])
+        files = []
+        staged = [self._stage_blob(data) for data in blobs]
+        with self._tx() as db:
+            old = db.execute('SELECT sha256, path FROM entry_blobs WHERE key = ?', (key,)).fetchall()
+            db.execute('DELETE FROM entry_blobs WHERE key = ?', (key,))
+            total = 0
+            for idx, (data, (sha, rel)) in enumerate(zip(blobs, staged)):
+                rel = self._ref_blob(db, sha, rel, data)
+                files.append(rel)
+                db.execute('INSERT INTO entry_blobs (key, idx, sha256, path, size) VALUES (?, ?, ?, ?, ?)',
+                           (key, idx, sha, rel, len(data)))
+                total += len(data)
+            db.execute(
+                'INSERT OR REPLACE INTO entries (key, prompt, provider, params, ts, size, hits, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?, 0, ?)',
+                (key, prompt, provider, json.dumps(params, sort_keys=True) if params is not None else None,
+                 ts, total, time.time()))
+            self._release_blobs(db, old)
+        self._delete_legacy(key)  # the indexed entry supersedes a flat-file one
+        self.hot.invalidate([key])  # a reader may have cached the old entry meanwhile
+        if encoded is not None:
+            self.hot.put(key, files, ts, b64=encoded)
+        if self.janitor is not None and any(self._budget):
+            entries, total = self.totals()
+            max_bytes, max_entries = self._budget
+            if (max_bytes and total > max_bytes) or (max_entries and entries > max_entries):
+                self.janitor.wake()
+
+    def start_janitor(self, config):
+        """Start the background janitor once per store (IMAGE_CACHE_JANITOR_INTERVAL > 0)."""
+        if self.janitor is not None or float(config.get('IMAGE_CACHE_JANITOR_INTERVAL', 60) or 0) <= 0:
+            return
+        self._budget = (int(config.get('IMAGE_CACHE_MAX_BYTES', 0) or 0),
+                        int(config.get('IMAGE_CACHE_MAX_ENTRIES', 0) or 0))
+        self.janitor = _Janitor(self, config)
+        self.janitor.start()
+
+    def _entry(self, key):
+        db = self._conn()
+        row = db.execute('SELECT * FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        blobs = db.execute('SELECT path, sha256, size FROM entry_blobs WHERE key = ? ORDER BY idx', (key,)).fetchall()
+        return row, blobs
+
+    def meta(self, key):
+        """Metadata dict for key (key, prompt, provider, params, ts, files, ...), or None."""
+        found = self._entry(key)
+        if found is None:
+            return self._legacy_meta(key)
+        row, blobs = found
+        return {
+            'key': row['key'], 'prompt': row['prompt'], 'provider': row['provider'],
+            'params': json.loads(row['params']) if row['params'] else None,
+            'ts': row['ts'], 'size': row['size'], 'hits': row['hits'], 'last_access': row['last_access'],
+            'files': [b['path'] for b in blobs], 'sha256': [b['sha256'] for b in blobs],
+        }
+
+    def files(self, key):
+        meta = self.meta(key)
+        return list(meta.get('files', [])) if meta else []
+
+    def path(self, rel):
+        """Absolute path of a file given relative to the uploads directory."""
+        return self._abs(rel)
+
+    def _record_hit(self, key, count=1):
+        try:
+            self._conn().execute('UPDATE entries SET hits = hits + ?, last_access = ? WHERE key = ?',
+                                 (count, time.time(), key))
+        except sqlite3.OperationalError:
+            pass  # a busy index must not turn a hit into a miss
+
+    def flush_hits(self):
+        """Write hot-tier hits to the index so disk eviction sees them; return the key count."""
+        pending = self.hot.take_pending_hits()
+        for key, count in pending.items():
+            self._record_hit(key, count)
+        return len(pending)
+
+    def locate(self, key, ttl_seconds=None):
+        """Return the relative file paths of a fresh, complete entry (a hit), or None."""
+        entry = self.hot.get(key, ttl_seconds)
+        if entry is not None:
+            return list(entry['files'])
+        found = self._locate_disk(key, ttl_seconds)
+        if found is None:
+            return None
+        self.hot.put(key, *found)
+        return found[0]
+
+    def _locate_disk(self, key, ttl_seconds=None):
+        """(files, ts) of a fresh, complete entry from the index and disk, or None."""
+        meta = self.meta(key)
+        if not meta:
+            return None
+        if ttl_seconds and int(time.time()) - int(meta.get('ts') or 0) > ttl_seconds:
+            return None
+        files = meta.get('files', [])
+        if not all(os.path.isfile(self._abs(rel)) for rel in files):
+            return None
+        if 'hits' in meta:
+            self._record_hit(key)
+        return files, meta.get('ts') or 0
+
+    def _read(self, files):
+        out = []
+        for rel in files:
+            try:
+                with open(self._abs(rel), 'rb') as f:
+                    out.append(f.read())
+            except OSError:
+                return None
+        return out
+
+    def get(self, key, ttl_seconds=None):
+        """Return the list of image bytes for key, or None (missing/expired/broken)."""
+        entry = self.hot.get(key, ttl_seconds, need='blobs')
+        if entry is not None:
+            return list(entry['blobs'])
+        found = self._locate_disk(key, ttl_seconds)
+        blobs = self._read(found[0]) if found is not None else None
+        if blobs is not None:
+            self.hot.put(key, *found, blobs=blobs)
+        return blobs
+
+    def get_base64(self, key, ttl_seconds=None):
+        """Like get(), but base64 strings; the encoded form is what the hot tier keeps."""
+        entry = self.hot.get(key, ttl_seconds, need='b64')
+        if entry is not None:
+            return list(entry['b64'])
+        found = self._locate_disk(key, ttl_seconds)
+        blobs = self._read(found[0]) if found is not None else None
+        if blobs is None:
+            return None
+        encoded = [base64.b64encode(b).decode('utf-8') for b in blobs]
+        self.hot.put(key, *found, b64=encoded)
+        return encoded
+
+    def _delete_keys(self, db, keys):
+        """Delete indexed entries inside a transaction; return (removed files, bytes)."""
+        rows = []
+        freed = 0
+        for key in keys:
+            size = db.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            freed += size['size'] if size else 0
+            rows.extend(db.execute('SELECT sha256, path FROM entry_blobs WHERE key = ?', (key,)).fetchall())
+            db.execute('DELETE FROM entry_blobs WHERE key = ?', (key,))
+            db.execute('DELETE FROM entries WHERE key = ?', (key,))
+        self.hot.invalidate(keys)
+        return self._release_blobs(db, rows), freed
+
+    def delete(self, key):
+        """Remove key (indexed and legacy forms); return the removed file names."""
+        self.hot.invalidate([key])
+        with self._tx() as db:
+            removed, _ = self._delete_keys(db, [key])
+        return removed + self._delete_legacy(key)
+
+    def select_keys(self, provider=None, older_than=None, newer_than=None, prefix=None,
+                    contains=None, pattern=None):
+        """Indexed entries matching every given filter: [(key, size)].
+
+        older_than/newer_than are ages in seconds; contains is a
+        case-insensitive prompt substring and pattern a regular expression
+        searched in the prompt. Legacy (unmigrated) entries are not matched.
+        """
+        where, args = [], []
+        now = int(time.time())
+        if provider is not None:
+            where.append('provider = ?')
+            args.append(provider)
+        if older_than is not None:
+            where.append('ts < ?')
+            args.append(now - int(older_than))
+        if newer_than is not None:
+            where.append('ts >= ?')
+            args.append(now - int(newer_than))
+        if prefix:
+            where.append('key >= ? AND key < ?')
+            args.extend([prefix, prefix + '\U0010ffff'])
+        if contains:
+            where.append('instr(lower(prompt), ?) > 0')
+            args.append(contains.lower())
+        if pattern:
+            where.append('prompt REGEXP ?')
+            args.append(pattern)
+        sql = 'SELECT key, size FROM entries' + (' WHERE ' + ' AND '.join(where) if where else '')
+        return [(r['key'], r['size']) for r in self._conn().execute(sql, args).fetchall()]
+
+    def delete_batches(self, keys, batch=100):
+        """Delete keys in transactions of `batch` entries.
+
+        Yields (keys, removed files, freed bytes) after each transaction.
+        """
+        keys = list(keys)
+        batch = max(1, int(batch))
+        for start in range(0, len(keys), batch):
+            chunk = keys[start:start + batch]
+            with self._tx() as db:
+                removed, freed = self._delete_keys(db, chunk)
+            yield chunk, removed, freed
+
+    def totals(self):
+        row = self._conn().execute('SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes FROM entries').fetchone()
+        return row['entries'], row['bytes']
+
+    def purge_expired(self, ttl_seconds, batch=100):
+        """Delete up to `batch` entries older than ttl_seconds; return (count, bytes)."""
+        if not ttl_seconds:
+            return 0, 0
+        cutoff = int(time.time()) - int(ttl_seconds)
+        with self._tx() as db:
+            keys = [r['key'] for r in db.execute(
+                'SELECT key FROM entries WHERE ts < ? ORDER BY ts LIMIT ?', (cutoff, int(batch))).fetchall()]
+            _, freed = self._delete_keys(db, keys)
+        if keys:
+            with _stats_lock:
+                STATS['expired'] += len(keys)
+                STATS['expired_bytes'] += freed
+        return len(keys), freed
+
+    def evict(self, max_bytes=0, max_entries=0, policy='lru', batch=100):
+        """Delete up to `batch` entries (least recently/frequently used first)
+        while the cache is over max_bytes or max_entries; return (count, bytes)."""
+        self.flush_hits()  # hot-tier hits count towards recency/frequency
+        order = _EVICTION_ORDER.get(policy, _EVICTION_ORDER['lru'])
+        with self._tx() as db:
+            row = db.execute('SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes FROM entries').fetchone()
+            entries, total = row['entries'], row['bytes']
+            over_bytes = max_bytes and total > max_bytes
+            over_entries = max_entries and entries > max_entries
+            if not over_bytes and not over_entries:
+                return 0, 0
+            keys = []
+            for victim in db.execute(f'SELECT key, size FROM entries ORDER BY {order} LIMIT ?', (int(batch),)):
+                if not ((max_bytes and total > max_bytes) or (max_entries and entries > max_entries)):
+                    break
+                keys.append(victim['key'])
+                total -= victim['size']
+                entries -= 1
+            _, freed = self._delete_keys(db, keys)
+        with _stats_lock:
+            STATS['evicted'] += len(keys)
+            STATS['evicted_bytes'] += freed
+        return len(keys), freed
+
+    def clear(self):
+        """Remove every entry; return the removed file names."""
+        with self._tx() as db:
+            removed = [row['path'] for row in db.execute('SELECT sha256, path FROM blobs').fetchall()
+                       if self._unlink_blob(db, row['sha256'], row['path'])]
+            db.execute('DELETE FROM entry_blobs')
+            db.execute('DELETE FROM entries')
+        self.hot.invalidate()
+        if not self.migrated():
+            for key in self._legacy_keys():
+                removed.extend(self._delete_legacy(key))
+        return removed
+
+    def list_entries(self, limit=None, offset=0):
+        """Entries newest first: [{key, prompt, provider, ts, size, hits, files}]."""
+        db = self._conn()
+        sql = 'SELECT key, prompt, provider, ts, size, hits FROM entries ORDER BY ts DESC'
+        args = ()
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            args = (int(limit), int(offset))
+        entries = []
+        for row in db.execute(sql, args).fetchall():
+            files = [r['path'] for r in db.execute(
+                'SELECT path FROM entry_blobs WHERE key = ? ORDER BY idx', (row['key'],)).fetchall()]
+            entries.append(dict(row, files=files))
+        if not self.migrated():
+            indexed = {e['key'] for e in entries}
+            for key in self._legacy_keys():
+                meta = self._legacy_meta(key)
+                if meta and key not in indexed:
+                    entries.append({'key': meta.get('key') or key, 'prompt': meta.get('prompt'),
+                                    'provider': meta.get('provider'), 'ts': meta.get('ts'),
+                                    'size': None, 'hits': None, 'files': meta.get('files', [])})
+            entries.sort(key=lambda e: e.get('ts') or 0, reverse=True)
+        return entries
+
+    def scoped_prompts(self):
+        """(key, prompt, provider, params) for entries that recorded provider/params."""
+        out = [(r['key'], r['prompt'], r['provider'], json.loads(r['params']) if r['params'] else {})
+               for r in self._conn().execute(
+                   'SELECT key, prompt, provider, params FROM entries '
+                   'WHERE provider IS NOT NULL AND prompt IS NOT NULL').fetchall()]
+        if not self.migrated():
+            for key in self._legacy_keys():
+                meta = self._legacy_meta(key)
+                if meta and meta.get('provider') is not None and meta.get('prompt'):
+                    out.append((meta.get('key') or key, meta['prompt'], meta['provider'], meta.get('params')))
+        return out
+
+    def migrate(self):
+        """Import legacy cache_<key>.json entries into the store (one-shot)."""
+        imported = skipped = 0
+        for key in self._legacy_keys():
+            meta = self._legacy_meta(key)
+            if not meta:
+                skipped += 1
+                continue
+            try:
+                blobs = []
+                for fname in meta.get('files', []):
+                    with open(os.path.join(self.uploads_dir, fname), 'rb') as f:
+                        blobs.append(f.read())
+            except OSError:
+                skipped += 1
+                continue
+            self.put(meta.get('key') or key, blobs, meta.get('prompt'), meta.get('provider'),
+                     meta.get('params'), ts=meta.get('ts') or time.time())
+            self._delete_legacy(key)
+            imported += 1
+        with self._tx() as db:
+            db.execute("INSERT OR REPLACE INTO store_meta (name, value) VALUES ('legacy_migrated', ?)",
+                       (str(int(time.time())),))
+        return {'imported': imported, 'skipped': skipped}
+
+    def stats(self):
+        entries, total = self.totals()
+        blobs = self._conn().execute(
+            'SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS physical, COALESCE(SUM(size * refs), 0) AS logical '
+            'FROM blobs WHERE refs > 0').fetchone()
+        with _stats_lock:
+            counters = dict(STATS)
+        return dict(counters, entries=entries, bytes=total, blobs=blobs['n'], migrated=self.migrated(),
+                    blob_bytes=blobs['physical'], dedup_bytes_saved=blobs['logical'] - blobs['physical'],
+                    dedup_ratio=round(blobs['logical'] / blobs['physical'], 3) if blobs['physical'] else None,
+                    hot_tier=self.hot.snapshot())
+
+
+class _Janitor(threading.Thread):
+    """Background reclaimer: expired entries first, then eviction down to budget.
+
+    Works in transactions of IMAGE_CACHE_JANITOR_BATCH entries with a short
+    pause between them, so it never holds the index lock for long. Runs every
+    IMAGE_CACHE_JANITOR_INTERVAL seconds, or sooner when a write pushes the
+    cache over budget (see wake()).
+    """
+
+    def __init__(self, store, config):
+        super().__init__(name='image-cache-janitor', daemon=True)
+        self.store = store
+        self.config = config
+        self._wake = threading.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    def run_once(self):
+        cfg = self.config
+        self.store.flush_hits()
+        batch = int(cfg.get('IMAGE_CACHE_JANITOR_BATCH', 100))
+        pause = float(cfg.get('IMAGE_CACHE_JANITOR_PAUSE', 0.05))
+        ttl = int(cfg.get('IMAGE_CACHE_TTL_SECONDS', 60 * 60 * 24) or 0)
+        while self.store.purge_expired(ttl, batch)[0] == batch:
+            time.sleep(pause)
+        while True:
+            count, _ = self.store.evict(int(cfg.get('IMAGE_CACHE_MAX_BYTES', 0) or 0),
+                                        int(cfg.get('IMAGE_CACHE_MAX_ENTRIES', 0) or 0),
+                                        cfg.get('IMAGE_CACHE_EVICTION', 'lru'), batch)
+            if count < batch:
+                break
+            time.sleep(pause)
+        with _stats_lock:
+            STATS['janitor_runs'] += 1
+
+    def run(self):
+        interval = float(self.config.get('IMAGE_CACHE_JANITOR_INTERVAL', 60))
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[CACHE JANITOR] {str(e)}")
+
+
+def _index_path(config, uploads_dir):
+    configured = config.get('IMAGE_CACHE_INDEX_PATH')
+    if configured:
+        return configured
+    # Outside the static folder so the index is never served publicly; one
+    # index per uploads directory
+    digest = hashlib.sha1(os.path.abspath(uploads_dir).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(current_app.instance_path, f'image_cache_{digest}.sqlite3')
+
+
+def get_store(uploads_dir=None, config=None):
+    """Return the ImageStore for the app's uploads directory (created once)."""
+    if uploads_dir is None:
+        uploads_dir = os.path.join(current_app.static_folder, 'uploads')
+    if config is None:
+        config = current_app.config
+    index_path = os.path.abspath(_index_path(config, uploads_dir))
+    key = (os.path.abspath(uploads_dir), index_path)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = _stores[key] = ImageStore(key[0], index_path,
+                                                  int(config.get('IMAGE_HOT_TIER_MAX_BYTES', 0) or 0),
+                                                  float(config.get('IMAGE_HOT_TIER_MAX_AGE', 300) or 0))
+                store.start_janitor(config)
+    return store
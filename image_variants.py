@@ -0,0 +1,200 @@
+# image_variants.py
+"""Compressed, multi-resolution variants of cached images.
+
+Generated images are stored as full-size PNGs (~1.6 MB for a 1024x1024
+Stability result). After a blob is persisted, it is handed to a process pool
+(IMAGE_VARIANT_WORKERS, off the request thread and outside the GIL) that
+renders, for every width in IMAGE_VARIANT_WIDTHS plus the full width:
+
+  - WebP (and AVIF when "avif" is in IMAGE_VARIANT_FORMATS and the installed
+    Pillow can encode it), lossy at IMAGE_VARIANT_QUALITY;
+  - a losslessly optimized PNG (kept at full width only if it is smaller).
+
+Variants are written next to their blob (blobs/aa/bb/<sha>_<width>.<fmt>)
+and recorded in the store's blob_variants table; they are removed together
+with the blob. /api/ai/images/<sha>.<ext> picks one with choose() from the
+Accept header and an optional ?w=<pixels>.
+
+Pillow is optional: without it nothing is rendered and the originals are
+served as before. Existing uploads are backfilled with
+tools/backfill_image_variants.py.
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, features
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+_lock = threading.Lock()
+_executor = None
+_inflight = set()
+STATS = {'scheduled': 0, 'skipped': 0, 'completed': 0, 'failed': 0, 'original_bytes': 0, 'variant_bytes': 0}
+
+_DEFAULT_WIDTHS = (256, 768)
+_LOSSY_FORMATS = ('webp', 'avif')
+
+
+def enabled(config):
+    return PIL_AVAILABLE and bool(config.get('IMAGE_VARIANTS_ENABLED', True))
+
+
+def _widths(config):
+    configured = config.get('IMAGE_VARIANT_WIDTHS')
+    if isinstance(configured, str):
+        configured = [w for w in configured.split(',') if w.strip()]
+    return sorted({int(w) for w in (configured or _DEFAULT_WIDTHS) if int(w) > 0})
+
+
+def _formats(config):
+    configured = config.get('IMAGE_VARIANT_FORMATS') or 'webp'
+    if isinstance(configured, str):
+        configured = configured.split(',')
+    return [f.strip().lower() for f in configured if f.strip().lower() in _LOSSY_FORMATS]
+
+
+def _renderable(formats):
+    """The formats render() will actually produce (AVIF needs Pillow support)."""
+    return [f for f in formats if f != 'avif' or features.check('avif')]
+
+
+def _has_variants(store, sha, formats):
+    rendered = {row['format'] for row in store.variants(sha)}
+    return bool(rendered) and set(formats) <= rendered
+
+
+def variant_path(sha, width, fmt):
+    """Path of a variant relative to the uploads directory (next to its blob)."""
+    return f'blobs/{sha[:2]}/{sha[2:4]}/{sha}_{width}.{fmt}'
+
+
+def _save(img, path, fmt, quality):
+    """Encode img to path atomically; return (size, sha256 of the bytes)."""
+    buf = io.BytesIO()
+    if fmt == 'png':
+        img.save(buf, 'PNG', optimize=True)
+    else:
+        img.save(buf, fmt.upper(), quality=quality)
+    data = buf.getvalue()
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return len(data), hashlib.sha256(data).hexdigest()
+
+
+def render(uploads_dir, sha, rel, widths, formats, quality):
+    """Render the variants of one blob (runs in a worker process).
+
+    Returns [(width, format, rel path, size, sha256)], starting with the original.
+    """
+    src = os.path.join(uploads_dir, *rel.split('/'))
+    ext = rel.rsplit('.', 1)[-1]
+    out = []
+    with Image.open(src) as im:
+        im.load()
+        full_w, full_h = im.size
+        out.append((full_w, ext, rel, os.path.getsize(src), sha))
+        if im.mode not in ('RGB', 'RGBA'):
+            im = im.convert('RGBA' if 'transparency' in im.info else 'RGB')
+        formats = _renderable(formats)
+        for width in [w for w in widths if w < full_w] + [full_w]:
+            img = im if width == full_w else im.resize((width, max(1, round(full_h * width / full_w))), Image.LANCZOS)
+            for fmt in formats + ['png']:
+                vrel = variant_path(sha, width, fmt)
+                path = os.path.join(uploads_dir, *vrel.split('/'))
+                size, digest = _save(img, path, fmt, quality)
+                if fmt == 'png' and width == full_w and size >= out[0][3]:
+                    os.remove(path)  # optimizing did not beat the original
+                    continue
+                out.append((width, fmt, vrel, size, digest))
+    return out
+
+
+def _get_executor(config):
+    global _executor
+    if _executor is None:
+        workers = int(config.get('IMAGE_VARIANT_WORKERS', 2) or 2)
+        _executor = ProcessPoolExecutor(max_workers=workers)
+    return _executor
+
+
+def _record(store, sha, future):
+    with _lock:
+        _inflight.discard(sha)
+    try:
+        variants = future.result()
+        store.add_variants(sha, variants)
+    except Exception as e:
+        print(f"[VARIANTS] ❌ {sha[:12]}: {str(e)}")
+        with _lock:
+            STATS['failed'] += 1
+        return
+    with _lock:
+        STATS['completed'] += 1
+        STATS['original_bytes'] += variants[0][3]
+        STATS['variant_bytes'] += sum(v[3] for v in variants[1:])
+
+
+def schedule(store, blobs, config):
+    """Queue variant rendering for [(sha, rel)] blobs of a store; returns the futures.
+
+    Blobs that already have the configured formats (a deduplicated put) are skipped.
+    """
+    if not enabled(config):
+        return []
+    widths, formats = _widths(config), _formats(config)
+    quality = int(config.get('IMAGE_VARIANT_QUALITY', 80))
+    wanted = _renderable(formats)
+    futures = []
+    for sha, rel in blobs:
+        if _has_variants(store, sha, wanted):
+            with _lock:
+                STATS['skipped'] += 1
+            continue
+        with _lock:
+            if sha in _inflight:
+                continue
+            _inflight.add(sha)
+            STATS['scheduled'] += 1
+        future = _get_executor(config).submit(render, store.uploads_dir, sha, rel, widths, formats, quality)
+        future.add_done_callback(lambda f, sha=sha: _record(store, sha, f))
+        futures.append(future)
+    return futures
+
+
+def choose(rows, width=None, accept=''):
+    """Pick the variant row to serve, or None for the original.
+
+    rows are the blob_variants rows of one blob (width, format, path, size, digest).
+    Formats are limited to what the Accept header allows (PNG/JPEG always);
+    with ?w the narrowest variant at least that wide wins, else the widest;
+    ties go to the smallest file.
+    """
+    accept = (accept or '').lower()
+    allowed = {'png', 'jpg'} | {f for f in _LOSSY_FORMATS if f'image/{f}' in accept}
+    candidates = [r for r in rows if r['format'] in allowed]
+    if not candidates:
+        return None
+    wide_enough = [r['width'] for r in candidates if width and r['width'] >= width]
+    target = min(wide_enough) if wide_enough else max(r['width'] for r in candidates)
+    return min((r for r in candidates if r['width'] == target), key=lambda r: r['size'])
+
+
+def stats():
+    with _lock:
+        return dict(STATS, available=PIL_AVAILABLE, inflight=len(_inflight))
@@ -0,0 +1,118 @@
+# llm_cache.py
+"""Exact-match cache for generate-prompt responses.
+
+Opt-in (LLM_CACHE_ENABLED). Entries are keyed on a SHA-256 of the provider,
+the model and a canonical form of the payload (sorted keys, None values
+dropped, whitespace in strings collapsed), so payloads that differ only in
+formatting share an entry. Each entry stores the already-normalized
+candidate ({narrative, image_prompt, summary_point}), not the raw upstream
+response.
+
+Memory is bounded by LLM_CACHE_MAX_ENTRIES with LRU eviction; entries also
+expire after LLM_CACHE_TTL_SECONDS.
+
+Temperature decides how much is reused:
+  - above LLM_CACHE_MAX_TEMPERATURE the cache is bypassed entirely;
+  - up to LLM_CACHE_VARIETY_TEMPERATURE one answer per key is served;
+  - in between, the first LLM_CACHE_VARIANTS answers for a key still go
+    upstream and are all kept, then hits rotate through them, so repeated
+    creative prompts don't always get the same story.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # key -> {'candidates': [...], 'expires': float, 'next': int}
+STATS = {'hits': 0, 'misses': 0, 'bypassed': 0, 'stores': 0, 'evictions': 0, 'expired': 0}
+
+
+def enabled(config):
+    return bool(config.get('LLM_CACHE_ENABLED', False))
+
+
+def _canonical(value):
+    if isinstance(value, dict):
+        return {k: _canonical(v) for k, v in sorted(value.items()) if v is not None}
+    if isinstance(value, list):
+        return [_canonical(v) for v in value]
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    return value
+
+
+def key_for(provider, model, payload):
+    """Return the cache key for a provider/model/payload triple."""
+    canonical = json.dumps(
+        {'provider': provider, 'model': model, 'payload': _canonical(payload)},
+        sort_keys=True, separators=(',', ':'), ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _variants_for(temperature, config):
+    if temperature <= float(config.get('LLM_CACHE_VARIETY_TEMPERATURE', 0.3)):
+        return 1
+    return max(1, int(config.get('LLM_CACHE_VARIANTS', 3)))
+
+
+def bypass(temperature, config):
+    """True if a request at `temperature` should not use the cache at all."""
+    if temperature > float(config.get('LLM_CACHE_MAX_TEMPERATURE', 1.0)):
+        with _lock:
+            STATS['bypassed'] += 1
+        return True
+    return False
+
+
+def lookup(key, temperature, config):
+    """Return a cached normalized candidate for key, or None on a miss."""
+    now = time.time()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry['expires'] <= now:
+            del _entries[key]
+            STATS['expired'] += 1
+            entry = None
+        if entry is None or len(entry['candidates']) < _variants_for(temperature, config):
+            STATS['misses'] += 1
+            return None
+        _entries.move_to_end(key)
+        idx = entry['next'] % len(entry['candidates'])
+        entry['next'] = idx + 1
+        STATS['hits'] += 1
+        return dict(entry['candidates'][idx])
+
+
+def store(key, candidate, temperature, config):
+    """Remember a normalized candidate produced for key."""
+    if not candidate:
+        return
+    ttl = float(config.get('LLM_CACHE_TTL_SECONDS', 3600))
+    max_entries = max(1, int(config.get('LLM_CACHE_MAX_ENTRIES', 1000)))
+    variants = _variants_for(temperature, config)
+    now = time.time()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or entry['expires'] <= now:
+            entry = _entries[key] = {'candidates': [], 'expires': now + ttl, 'next': 0}
+        if len(entry['candidates']) < variants and candidate not in entry['candidates']:
+            entry['candidates'].append(dict(candidate))
+        _entries.move_to_end(key)
+        STATS['stores'] += 1
+        while len(_entries) > max_entries:
+            _entries.popitem(last=False)
+            STATS['evictions'] += 1
+
+
+def stats():
+    with _lock:
+        return dict(STATS, entries=len(_entries))
+
+
+def clear():
+    with _lock:
+        _entries.clear()
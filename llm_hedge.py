@@ -0,0 +1,183 @@
+# llm_hedge.py
+"""Hedged LLM requests across two configured providers.
+
+When LLM_HEDGE_ENABLED is set, generate-prompt sends the request to the
+primary provider and waits up to its recent p-th percentile latency
+(LLM_HEDGE_PERCENTILE). If no answer has arrived by then, the same payload
+is sent to LLM_HEDGE_PROVIDER and whichever succeeds first is returned; the
+other is cancelled (if it hasn't started) or its result discarded. A fast
+failure of the primary also triggers the secondary immediately.
+
+A started call cannot be interrupted, so every hedged attempt runs under
+provider_client.timeout_cap(LLM_HEDGE_CALL_TIMEOUT): a losing call holds its
+worker for at most that long. When every worker is busy (losers piling up
+under sustained slowness), the primary runs on the request thread without a
+hedge instead of queueing behind them; HEDGE_STATS counts those requests
+(pool_saturated) and the losers left running (losers_abandoned).
+
+Latency samples come from provider_client, which records every call made
+through the shared session (and the ASGI client).
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from flask import current_app, jsonify
+
+import provider_client
+
+# Same mapping as ai_service.LLM_KEY_NAMES; kept local to avoid an import cycle
+_KEY_NAMES = {
+    'gemini': 'GEMINI_API_KEY',
+    'groq': 'GROQ_API_KEY',
+    'openai': 'OPENAI_API_KEY',
+    'anthropic': 'ANTHROPIC_API_KEY',
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+HEDGE_STATS = {'requests': 0, 'hedges_fired': 0, 'primary_wins': 0, 'secondary_wins': 0, 'failures': 0,
+               'pool_saturated': 0, 'losers_abandoned': 0}
+_outstanding = 0  # hedge calls submitted and not finished (queued or running)
+
+
+def _get_executor(config):
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = int(config.get('LLM_HEDGE_MAX_WORKERS', 32) or 32)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='llm-hedge')
+    return _executor
+
+
+def _bump(name, count=1):
+    with _stats_lock:
+        HEDGE_STATS[name] += count
+
+
+def _saturated(config):
+    with _stats_lock:
+        return _outstanding >= int(config.get('LLM_HEDGE_MAX_WORKERS', 32) or 32)
+
+
+def _finished(future):
+    global _outstanding
+    with _stats_lock:
+        _outstanding -= 1
+
+
+def hedge_provider_for(primary, config):
+    """Return the secondary provider to hedge with, or None if hedging is off."""
+    if not config.get('LLM_HEDGE_ENABLED', False):
+        return None
+    secondary = config.get('LLM_HEDGE_PROVIDER')
+    if not secondary or secondary == primary or secondary not in _KEY_NAMES:
+        return None
+    if not config.get(_KEY_NAMES[secondary]):
+        return None
+    return secondary
+
+
+def hedge_delay_seconds(provider, config):
+    """How long to wait on the primary before firing the hedge request."""
+    pct = float(config.get('LLM_HEDGE_PERCENTILE', 95))
+    min_samples = int(config.get('LLM_HEDGE_MIN_SAMPLES', 20))
+    observed_ms = provider_client.latency_percentile(provider, pct, min_samples=min_samples)
+    if observed_ms is None:
+        observed_ms = float(config.get('LLM_HEDGE_DEFAULT_DELAY_MS', 2000))
+    floor_ms = float(config.get('LLM_HEDGE_MIN_DELAY_MS', 250))
+    return max(observed_ms, floor_ms) / 1000.0
+
+
+def call_with_hedge(primary, secondary, payload, call):
+    """Run `call(provider, payload)` hedged across two providers.
+
+    `call` is ai_service._call_llm and returns a Flask (response, status)
+    tuple. Returns the first successful tuple, tagged with X-LLM-Provider,
+    or the primary's error if both fail.
+    """
+    app = current_app._get_current_object()
+    config = app.config
+    executor = _get_executor(config)
+    delay = hedge_delay_seconds(primary, config)
+    call_timeout = float(config.get('LLM_HEDGE_CALL_TIMEOUT', 15) or 15)
+    _bump('requests')
+
+    if _saturated(config):
+        _bump('pool_saturated')
+        print(f"[LLM HEDGE] Pool saturated, calling {primary} without a hedge")
+        return call(primary, payload)
+
+    def run(provider):
+        with app.app_context(), provider_client.timeout_cap(call_timeout):
+            return call(provider, payload)
+
+    futures = {}
+
+    def submit(provider):
+        global _outstanding
+        with _stats_lock:
+            _outstanding += 1
+        future = executor.submit(run, provider)
+        future.add_done_callback(_finished)
+        futures[future] = provider
+
+    submit(primary)
+    hedged = False
+    errors = {}
+
+    def fire_hedge():
+        if _saturated(config):
+            _bump('pool_saturated')
+            return
+        submit(secondary)
+        _bump('hedges_fired')
+        print(f"[LLM HEDGE] {primary} slow/failed, hedging with {secondary}")
+
+    pending = set(futures)
+    done, pending = wait(pending, timeout=delay)
+    if not done:
+        fire_hedge()
+        hedged = True
+        pending = set(futures)
+        done = set()
+
+    while True:
+        for fut in done:
+            provider = futures[fut]
+            try:
+                resp, status = fut.result()
+            except Exception:
+                resp, status = None, 500
+            if status == 200:
+                # Not-started losers are cancelled; running ones end within call_timeout
+                _bump('losers_abandoned', sum(1 for other in pending if not other.cancel()))
+                _bump('primary_wins' if provider == primary else 'secondary_wins')
+                try:
+                    resp.headers['X-LLM-Provider'] = provider
+                except Exception:
+                    pass
+                return resp, status
+            errors[provider] = (resp, status)
+        if not pending and not hedged:
+            # Primary failed before the hedge delay: fail over right away
+            fire_hedge()
+            hedged = True
+            pending = {f for f, p in futures.items() if p == secondary}
+        if not pending:
+            break
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    _bump('failures')
+    result = errors.get(primary)
+    if isinstance(result, tuple) and result[0] is not None:
+        return result
+    return jsonify({'error': 'All hedged LLM providers failed.', 'message': 'LLM provider failed. Real LLM is required.'}), 500
+
+
+def hedge_stats():
+    with _stats_lock:
+        return dict(HEDGE_STATS)
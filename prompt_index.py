@@ -0,0 +1,185 @@
+# prompt_index.py
+"""Near-duplicate lookup over cached image prompts (MinHash + LSH).
+
+Image cache keys only match byte-identical prompts, but LLM-written
+image_prompts for the same scene usually differ by a handful of words.
+This index lets generate-image reuse an existing cached image when a new
+prompt is similar enough (IMAGE_SIMILARITY_THRESHOLD, Jaccard similarity of
+word shingles), saving a full render.
+
+Each cached prompt is reduced to word shingles (IMAGE_SIMILARITY_SHINGLE
+words long) and a MinHash signature of NUM_PERM values. The signature is
+split into BANDS bands; prompts sharing any band land in the same bucket
+and become candidates, which are then scored with the exact Jaccard
+similarity of their shingle sets.
+
+Entries are scoped by provider and image params so a Picsum placeholder is
+never served for a Stability request, or a 16:9 image for a 1:1 one. The
+index is rebuilt from the image cache index (image_store) on first use and every
+IMAGE_SIMILARITY_REFRESH_SECONDS (so entries written by other workers show
+up), and kept current in-process by add()/discard().
+"""
+
+import hashlib
+import json
+import re
+import struct
+import threading
+import time
+
+import image_store
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_MERSENNE = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Fixed permutation coefficients so signatures are stable across processes
+_PERMS = []
+for _i in range(NUM_PERM):
+    _digest = hashlib.sha1(f'minhash-{_i}'.encode('utf-8')).digest()
+    _a, _b = struct.unpack('<QQ', _digest[:16])
+    _PERMS.append((_a % (_MERSENNE - 1) + 1, _b % _MERSENNE))
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+_lock = threading.Lock()
+_entries = {}  # key -> {'scope', 'shingles', 'bands'}
+_buckets = {}  # (band_idx, band_hash) -> set(keys)
+_state = {'built_for': None, 'built_at': 0.0}
+STATS = {'lookups': 0, 'hits': 0, 'candidates_scored': 0}
+
+
+def scope_for(provider, params):
+    """Entries only match requests with the same provider and image params."""
+    return json.dumps({'provider': provider, 'params': params or {}}, sort_keys=True)
+
+
+def shingles(text, size=2):
+    tokens = _TOKEN_RE.findall((text or '').lower())
+    if len(tokens) < size:
+        return {' '.join(tokens)} if tokens else set()
+    return {' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def signature(shingle_set):
+    hashes = [struct.unpack('<I', hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest())[0]
+              for s in shingle_set]
+    if not hashes:
+        return [_MAX_HASH] * NUM_PERM
+    return [min(((a * h + b) % _MERSENNE) & _MAX_HASH for h in hashes) for a, b in _PERMS]
+
+
+def _band_keys(sig):
+    return [(i, hash(tuple(sig[i * ROWS:(i + 1) * ROWS]))) for i in range(BANDS)]
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / float(len(a | b))
+
+
+def _add_locked(key, prompt, scope, shingle_size):
+    _discard_locked(key)
+    sh = shingles(prompt, shingle_size)
+    if not sh:
+        return
+    bands = _band_keys(signature(sh))
+    _entries[key] = {'scope': scope, 'shingles': sh, 'bands': bands}
+    for band in bands:
+        _buckets.setdefault(band, set()).add(key)
+
+
+def _discard_locked(key):
+    entry = _entries.pop(key, None)
+    if entry is None:
+        return
+    for band in entry['bands']:
+        keys = _buckets.get(band)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del _buckets[band]
+
+
+def _rebuild_locked(uploads_dir, config, shingle_size):
+    _entries.clear()
+    _buckets.clear()
+    try:
+        scoped = image_store.get_store(uploads_dir, config).scoped_prompts()
+    except Exception:
+        scoped = []
+    # Entries written before provider/params were recorded can't be scoped
+    # and are left out by scoped_prompts()
+    for key, prompt, provider, params in scoped:
+        _add_locked(key, prompt, scope_for(provider, params), shingle_size)
+    _state['built_for'] = uploads_dir
+    _state['built_at'] = time.time()
+
+
+def _ensure_built(uploads_dir, config):
+    refresh = float(config.get('IMAGE_SIMILARITY_REFRESH_SECONDS', 300))
+    stale = _state['built_for'] != uploads_dir or (refresh and time.time() - _state['built_at'] > refresh)
+    if stale:
+        _rebuild_locked(uploads_dir, config, int(config.get('IMAGE_SIMILARITY_SHINGLE', 2)))
+
+
+def add(uploads_dir, key, prompt, provider, params, config):
+    """Index a newly persisted cache entry."""
+    with _lock:
+        if _state['built_for'] != uploads_dir:
+            return  # picked up by the first rebuild
+        _add_locked(key, prompt, scope_for(provider, params), int(config.get('IMAGE_SIMILARITY_SHINGLE', 2)))
+
+
+def discard(key):
+    with _lock:
+        _discard_locked(key)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _buckets.clear()
+        _state['built_for'] = None
+
+
+def find_similar(uploads_dir, prompt, provider, params, config, exclude=None):
+    """Return [(score, key), ...] best first for prompts at/above the threshold."""
+    threshold = float(config.get('IMAGE_SIMILARITY_THRESHOLD', 0.8))
+    shingle_size = int(config.get('IMAGE_SIMILARITY_SHINGLE', 2))
+    sh = shingles(prompt, shingle_size)
+    if not sh:
+        return []
+    scope = scope_for(provider, params)
+    bands = _band_keys(signature(sh))
+    with _lock:
+        _ensure_built(uploads_dir, config)
+        STATS['lookups'] += 1
+        candidates = set()
+        for band in bands:
+            candidates.update(_buckets.get(band, ()))
+        candidates.discard(exclude)
+        matches = []
+        for key in candidates:
+            entry = _entries[key]
+            if entry['scope'] != scope:
+                continue
+            STATS['candidates_scored'] += 1
+            score = jaccard(sh, entry['shingles'])
+            if score >= threshold:
+                matches.append((score, key))
+    matches.sort(reverse=True)
+    return matches
+
+
+def record_hit():
+    with _lock:
+        STATS['hits'] += 1
+
+
+def stats():
+    with _lock:
+        return dict(STATS, entries=len(_entries))
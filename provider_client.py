@@ -0,0 +1,413 @@
+# provider_client.py
+"""Shared, pooled HTTP client for outbound AI provider calls.
+
+All provider traffic (LLMs, Stability, AUTOMATIC1111, Picsum) goes through
+one process-wide requests.Session so TCP+TLS connections stay warm between
+calls. Each known provider host gets its own HTTPAdapter so its keep-alive
+pool can be sized independently from config; everything else shares the
+default adapter.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from flask import current_app, has_app_context
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import circuit_breaker
+from config import Config
+
+# provider name -> base URL that gets a dedicated adapter/pool
+PROVIDER_HOSTS = {
+    'gemini': 'https://generativelanguage.googleapis.com',
+    'groq': 'https://api.groq.com',
+    'openai': 'https://api.openai.com',
+    'anthropic': 'https://api.anthropic.com',
+    'stability': 'https://api.stability.ai',
+    'picsum': 'https://picsum.photos',
+}
+
+_session = None
+_session_lock = threading.Lock()
+_adapters = {}  # mount prefix -> (provider, HTTPAdapter)
+
+_stats_lock = threading.Lock()
+_stats = {}  # provider -> { requests, errors, timeouts, in_flight, peak_in_flight, total_ms }
+
+# Fallback read timeouts (seconds) used until a provider has enough latency
+# samples, and the (min, max) bounds adaptive read timeouts are clamped to.
+DEFAULT_TIMEOUTS = {
+    'gemini': 8, 'groq': 15, 'openai': 20, 'anthropic': 20,
+    'stability': 60, 'imagen': 60, 'automatic1111': 60, 'alternate': 60,
+    'picsum': 20,
+}
+DEFAULT_TIMEOUT_BOUNDS = {
+    'gemini': (3, 30), 'groq': (3, 30), 'openai': (5, 45), 'anthropic': (5, 45),
+    'stability': (15, 120), 'imagen': (15, 120), 'automatic1111': (15, 180), 'alternate': (15, 120),
+    'picsum': (3, 30),
+}
+
+# Log-spaced latency buckets: 25ms, 31ms, 39ms ... ~150s
+_BUCKET_BOUNDS_MS = [25 * (1.25 ** i) for i in range(40)]
+
+_latencies = {}  # provider -> _LatencyHistogram
+
+_local = threading.local()  # .timeout_cap: see timeout_cap()
+
+
+class _LatencyHistogram:
+    """Rolling latency histogram covering the last one to two windows.
+
+    Samples land in the current generation; every `window_seconds` the
+    current generation becomes the previous one and the old previous one is
+    dropped, so percentiles track how the provider behaves right now.
+    """
+
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self.current = [0] * (len(_BUCKET_BOUNDS_MS) + 1)
+        self.previous = [0] * (len(_BUCKET_BOUNDS_MS) + 1)
+        self.rotated_at = time.monotonic()
+
+    def _rotate(self):
+        now = time.monotonic()
+        elapsed = now - self.rotated_at
+        if elapsed < self.window_seconds:
+            return
+        self.previous = self.current if elapsed < 2 * self.window_seconds else [0] * len(self.current)
+        self.current = [0] * len(self.current)
+        self.rotated_at = now
+
+    def add(self, elapsed_ms):
+        self._rotate()
+        idx = len(_BUCKET_BOUNDS_MS)
+        for i, bound in enumerate(_BUCKET_BOUNDS_MS):
+            if elapsed_ms <= bound:
+                idx = i
+                break
+        self.current[idx] += 1
+
+    def count(self):
+        self._rotate()
+        return sum(self.current) + sum(self.previous)
+
+    def percentile(self, pct):
+        """Upper bound (ms) of the bucket holding the pct-th percentile."""
+        self._rotate()
+        counts = [a + b for a, b in zip(self.current, self.previous)]
+        total = sum(counts)
+        if not total:
+            return None
+        target = pct / 100.0 * total
+        running = 0
+        for i, c in enumerate(counts):
+            running += c
+            if running >= target and c:
+                return _BUCKET_BOUNDS_MS[i] if i < len(_BUCKET_BOUNDS_MS) else _BUCKET_BOUNDS_MS[-1] * 1.25
+        return _BUCKET_BOUNDS_MS[-1] * 1.25
+
+
+def _config_value(name, default=None):
+    """Read a config value from the active app, falling back to Config."""
+    if has_app_context():
+        return current_app.config.get(name, default)
+    return getattr(Config, name, default)
+
+
+def _parse_pool_sizes(raw):
+    """Parse 'stability=20,gemini=16' into {'stability': 20, 'gemini': 16}."""
+    sizes = {}
+    if isinstance(raw, dict):
+        return {str(k): int(v) for k, v in raw.items()}
+    for item in (raw or '').split(','):
+        if '=' not in item:
+            continue
+        name, _, value = item.partition('=')
+        try:
+            sizes[name.strip()] = int(value.strip())
+        except ValueError:
+            continue
+    return sizes
+
+
+def _make_adapter(maxsize):
+    retry_strategy = Retry(
+        total=0,  # Don't retry at session level, callers handle retries manually
+        # Re-raise timeouts as-is instead of wrapping them in MaxRetryError, so
+        # callers (and the latency histogram) see requests' Timeout types
+        connect=False,
+        read=False,
+        backoff_factor=0,
+        status_forcelist=[]
+    )
+    pool_connections = int(_config_value('HTTP_POOL_CONNECTIONS', 10) or 10)
+    return HTTPAdapter(max_retries=retry_strategy, pool_connections=pool_connections, pool_maxsize=maxsize)
+
+
+def _create_session():
+    """Build the shared session with one adapter per provider host."""
+    session = requests.Session()
+    default_size = int(_config_value('HTTP_POOL_MAXSIZE', 10) or 10)
+    overrides = _parse_pool_sizes(_config_value('HTTP_POOL_SIZES', ''))
+
+    default_adapter = _make_adapter(default_size)
+    session.mount('http://', default_adapter)
+    session.mount('https://', default_adapter)
+    _adapters['http://'] = ('default', default_adapter)
+    _adapters['https://'] = ('default', default_adapter)
+
+    for provider, base_url in PROVIDER_HOSTS.items():
+        adapter = _make_adapter(overrides.get(provider, default_size))
+        session.mount(base_url, adapter)
+        _adapters[base_url] = (provider, adapter)
+    return session
+
+
+def get_session():
+    """Return the process-wide session, creating it once under a lock."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+
+def reset_session():
+    """Close and drop the shared session (used by tests and config reloads)."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            try:
+                _session.close()
+            except Exception:
+                pass
+        _session = None
+        _adapters.clear()
+
+
+def _provider_for_url(url):
+    try:
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+    except Exception:
+        return 'default'
+    for provider, base_url in PROVIDER_HOSTS.items():
+        if origin == base_url:
+            return provider
+    return 'default'
+
+
+def _provider_stats_locked(provider):
+    return _stats.setdefault(provider, {'requests': 0, 'errors': 0, 'timeouts': 0, 'in_flight': 0,
+                                        'peak_in_flight': 0, 'total_ms': 0.0})
+
+
+def _track(provider, delta, elapsed_ms=None, error=False):
+    with _stats_lock:
+        st = _provider_stats_locked(provider)
+        st['in_flight'] += delta
+        if delta > 0:
+            st['requests'] += 1
+            st['peak_in_flight'] = max(st['peak_in_flight'], st['in_flight'])
+        if elapsed_ms is not None:
+            st['total_ms'] += elapsed_ms
+        if error:
+            st['errors'] += 1
+
+
+def request(method, url, provider=None, **kwargs):
+    """Issue an HTTP request through the shared pooled session.
+
+    `provider` names the breaker, stats and timeout bucket; when omitted it is
+    derived from the URL host. Without an explicit `timeout`, the adaptive
+    timeout from timeout_for() is used. Only completed, non-streamed
+    responses feed the latency histogram (stream=True returns at the
+    headers; timeouts are counted by record_timeout). Exceptions from
+    requests propagate unchanged so callers keep their existing error
+    handling; an open breaker raises
+    circuit_breaker.CircuitOpenError, which is a requests ConnectionError.
+    """
+    provider = provider or _provider_for_url(url)
+    # Fail fast (CircuitOpenError) while the provider's breaker is open
+    circuit_breaker.check(provider)
+    if 'timeout' not in kwargs:
+        kwargs['timeout'] = timeout_for(provider)
+    cap = getattr(_local, 'timeout_cap', None)
+    if cap is not None:
+        kwargs['timeout'] = _capped_timeout(kwargs['timeout'], cap)
+    session = get_session()
+    _track(provider, 1)
+    started = time.monotonic()
+    failed = False
+    try:
+        response = session.request(method, url, **kwargs)
+    except Exception as e:
+        failed = True
+        if isinstance(e, requests.exceptions.Timeout):
+            record_timeout(provider)
+        circuit_breaker.record_exception(provider, e)
+        raise
+    finally:
+        elapsed_ms = (time.monotonic() - started) * 1000.0
+        _track(provider, -1, elapsed_ms=elapsed_ms, error=failed)
+    if response.status_code < 500 and not kwargs.get('stream'):
+        record_latency(provider, elapsed_ms)
+    error_text = ''
+    if response.status_code >= 400:
+        try:
+            error_text = response.text
+        except Exception:
+            error_text = ''
+    circuit_breaker.record_response(provider, response.status_code, error_text)
+    return response
+
+
+@contextmanager
+def timeout_cap(seconds):
+    """Cap the connect and read timeouts of every request this thread makes
+    inside the block (nested caps keep the tighter one)."""
+    previous = getattr(_local, 'timeout_cap', None)
+    _local.timeout_cap = seconds if previous is None else min(previous, seconds)
+    try:
+        yield
+    finally:
+        _local.timeout_cap = previous
+
+
+def _capped_timeout(timeout, cap):
+    if timeout is None:
+        return (cap, cap)
+    if isinstance(timeout, tuple):
+        return tuple(cap if t is None else min(t, cap) for t in timeout)
+    return min(timeout, cap)
+
+
+def record_latency(provider, elapsed_ms):
+    """Record a call's duration in the provider's histogram (also used by ASGI)."""
+    with _stats_lock:
+        hist = _latencies.get(provider)
+        if hist is None:
+            window = float(_config_value('LATENCY_WINDOW_SECONDS', 900) or 900)
+            hist = _latencies[provider] = _LatencyHistogram(window)
+        hist.add(elapsed_ms)
+
+
+def record_timeout(provider):
+    """Count a timed-out call. Timeouts are kept out of the latency histogram:
+    recording the timeout length would raise p99 towards the current timeout
+    and ratchet a hanging provider's read timeout up to its upper bound."""
+    with _stats_lock:
+        st = _provider_stats_locked(provider)
+        st['timeouts'] += 1
+
+
+def latency_percentile(provider, pct, min_samples=1):
+    """Return the pct-th percentile (ms) of recent latencies, or None."""
+    with _stats_lock:
+        hist = _latencies.get(provider)
+        if hist is None or hist.count() < max(1, min_samples):
+            return None
+        return hist.percentile(pct)
+
+
+def _timeout_bounds(provider):
+    lo, hi = DEFAULT_TIMEOUT_BOUNDS.get(provider, (3, 120))
+    raw = _config_value('PROVIDER_TIMEOUT_BOUNDS', '') or ''
+    for item in raw.split(','):
+        name, _, value = item.partition('=')
+        if name.strip() != provider or ':' not in value:
+            continue
+        try:
+            lo, hi = (float(v) for v in value.split(':', 1))
+        except ValueError:
+            pass
+    return float(lo), float(hi)
+
+
+def timeout_for(provider):
+    """Return the (connect, read) timeout in seconds for `provider`.
+
+    The read timeout is the provider's observed p99 latency times
+    ADAPTIVE_TIMEOUT_HEADROOM, clamped to its bounds. Until enough samples
+    exist (or with ADAPTIVE_TIMEOUTS_ENABLED off) the historical fixed value
+    is used. requests can't observe handshake time separately, so the
+    connect timeout is the configured PROVIDER_CONNECT_TIMEOUT.
+    """
+    read = float(DEFAULT_TIMEOUTS.get(provider, 30))
+    connect = float(_config_value('PROVIDER_CONNECT_TIMEOUT', 3.05))
+    if _config_value('ADAPTIVE_TIMEOUTS_ENABLED', True):
+        min_samples = int(_config_value('ADAPTIVE_TIMEOUT_MIN_SAMPLES', 30))
+        p99 = latency_percentile(provider, 99, min_samples=min_samples)
+        if p99 is not None:
+            lo, hi = _timeout_bounds(provider)
+            headroom = float(_config_value('ADAPTIVE_TIMEOUT_HEADROOM', 1.5))
+            read = min(max(p99 / 1000.0 * headroom, lo), hi)
+    return (min(connect, read), round(read, 2))
+
+
+def scale_timeout(provider, timeout, factor):
+    """Stretch a (connect, read) timeout for a call doing `factor` times the
+    work of the calls the histogram learned from (e.g. a multi-scene batch).
+    The read timeout grows up to the provider's upper bound, never shrinks."""
+    connect, read = timeout
+    _, hi = _timeout_bounds(provider)
+    return (connect, round(max(read, min(read * float(factor), hi)), 2))
+
+
+def get(url, provider=None, **kwargs):
+    return request('GET', url, provider=provider, **kwargs)
+
+
+def post(url, provider=None, **kwargs):
+    return request('POST', url, provider=provider, **kwargs)
+
+
+def pool_stats():
+    """Return per-provider request counters and keep-alive pool utilization."""
+    with _stats_lock:
+        stats = {name: dict(values) for name, values in _stats.items()}
+
+    for name, st in stats.items():
+        st['avg_ms'] = round(st['total_ms'] / st['requests'], 1) if st['requests'] else None
+        st['total_ms'] = round(st['total_ms'], 1)
+        p95 = latency_percentile(name, 95)
+        p99 = latency_percentile(name, 99)
+        st['p95_ms'] = round(p95, 1) if p95 is not None else None
+        st['p99_ms'] = round(p99, 1) if p99 is not None else None
+        st['timeout_s'] = timeout_for(name)
+
+    pools = {}
+    for prefix, (provider, adapter) in list(_adapters.items()):
+        if prefix == 'http://':
+            continue  # shares the https:// default adapter
+        host_pools = []
+        try:
+            manager = adapter.poolmanager
+            for pool_key in list(manager.pools.keys()):
+                pool = manager.pools.get(pool_key)
+                if pool is None:
+                    continue
+                idle = pool.pool.qsize() if pool.pool is not None else 0
+                host_pools.append({
+                    'host': pool.host,
+                    'maxsize': pool.pool.maxsize if pool.pool is not None else None,
+                    'idle': idle,
+                    'connections_opened': pool.num_connections,
+                    'requests': pool.num_requests,
+                })
+        except Exception:
+            pass
+        pools[provider] = {
+            'pool_maxsize': adapter._pool_maxsize,
+            'hosts': host_pools,
+        }
+        st = stats.get(provider)
+        if st is not None and adapter._pool_maxsize:
+            st['utilization'] = round(st['in_flight'] / adapter._pool_maxsize, 3)
+
+    return {'providers': stats, 'pools': pools}
@@ -0,0 +1,151 @@
+# singleflight.py
+"""In-flight coalescing of identical image generations.
+
+Callers that miss the image cache at the same moment for the same cache key
+(a double-click, a fetchWithRetry retry, two users with the same prompt)
+share one upstream generation: the first caller becomes the leader and runs
+the work, everyone else waits for it and receives the leader's value.
+
+One table serves the sync generate-image route, the background job thread
+and the ASGI coroutines, so a sync request and an async job for the same
+key also coalesce. Values are whatever the leader's function returns; see
+ai_service._image_response_from_flight / _job_result_from_flight for how
+the two kinds of outcome are shared.
+
+A follower that waits longer than SINGLEFLIGHT_WAIT_SECONDS stops waiting
+and runs the work itself rather than failing.
+"""
+
+import asyncio
+import threading
+
+from flask import current_app, has_app_context
+
+from config import Config
+
+_lock = threading.Lock()
+_flights = {}  # key -> _Flight
+STATS = {'leaders': 0, 'coalesced': 0, 'wait_timeouts': 0}
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.followers = 0
+        self._async_waiters = []  # (loop, future)
+
+    def finish(self, value=None, error=None):
+        self.value = value
+        self.error = error
+        with _lock:
+            self.event.set()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, fut in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, fut)
+            except RuntimeError:
+                pass  # the waiter's event loop has already closed
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def _resolve(fut):
+    if not fut.done():
+        fut.set_result(None)
+
+
+def _wait_seconds():
+    if has_app_context():
+        return float(current_app.config.get('SINGLEFLIGHT_WAIT_SECONDS', 120))
+    return float(getattr(Config, 'SINGLEFLIGHT_WAIT_SECONDS', 120))
+
+
+def _enabled():
+    if has_app_context():
+        return current_app.config.get('SINGLEFLIGHT_ENABLED', True)
+    return getattr(Config, 'SINGLEFLIGHT_ENABLED', True)
+
+
+def _join(key):
+    """Return (flight, is_leader) for key, registering a new flight if needed."""
+    with _lock:
+        flight = _flights.get(key)
+        if flight is None:
+            flight = _flights[key] = _Flight()
+            STATS['leaders'] += 1
+            return flight, True
+        flight.followers += 1
+        STATS['coalesced'] += 1
+        return flight, False
+
+
+def _leave(key, flight):
+    with _lock:
+        if _flights.get(key) is flight:
+            del _flights[key]
+
+
+def do(key, fn):
+    """Run fn() once for all concurrent callers of `key`.
+
+    Returns (value, shared); shared is True when the value came from another
+    caller's call. Exceptions raised by the leader propagate to followers.
+    """
+    if not _enabled():
+        return fn(), False
+    flight, leader = _join(key)
+    if not leader:
+        if flight.event.wait(_wait_seconds()):
+            return flight.result(), True
+        STATS['wait_timeouts'] += 1
+        return fn(), False
+    try:
+        value = fn()
+    except BaseException as e:
+        _leave(key, flight)
+        flight.finish(error=e)
+        raise
+    _leave(key, flight)
+    flight.finish(value=value)
+    return value, False
+
+
+async def do_async(key, coro_fn):
+    """Coroutine counterpart of do(); coro_fn() must return an awaitable."""
+    if not _enabled():
+        return await coro_fn(), False
+    flight, leader = _join(key)
+    if not leader:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        with _lock:
+            finished = flight.event.is_set()
+            if not finished:
+                flight._async_waiters.append((loop, fut))
+        if not finished:
+            try:
+                await asyncio.wait_for(fut, _wait_seconds())
+            except asyncio.TimeoutError:
+                STATS['wait_timeouts'] += 1
+                return await coro_fn(), False
+        return flight.result(), True
+    try:
+        value = await coro_fn()
+    except BaseException as e:
+        _leave(key, flight)
+        flight.finish(error=e)
+        raise
+    _leave(key, flight)
+    flight.finish(value=value)
+    return value, False
+
+
+def stats():
+    """Counters plus the number of generations currently in flight."""
+    with _lock:
+        return dict(STATS, in_flight=len(_flights))
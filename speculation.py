@@ -0,0 +1,129 @@
+# speculation.py
+"""Speculative image generation after generate-prompt.
+
+Most users accept the image_prompt the LLM wrote unchanged, so when
+SPECULATIVE_IMAGES_ENABLED is set, generate-prompt queues a background
+generation for that prompt (in the art style of the request) as soon as the
+normalized candidate exists. By the time the user clicks "generate", the
+async job usually finds the image already cached or still in flight
+(singleflight), instead of starting from scratch.
+
+Speculation is low priority:
+  - it runs on its own SPECULATIVE_WORKERS threads, so it never takes a slot
+    from real image requests;
+  - at most SPECULATIVE_MAX_QUEUE generations wait at any time, extra ones
+    are dropped;
+  - each user gets SPECULATIVE_MAX_PER_USER speculative generations per
+    SPECULATIVE_WINDOW_SECONDS, capping the provider spend it can cause.
+
+A speculated cache key counts as "used" when a real image job asks for it
+within SPECULATIVE_WINDOW_SECONDS; stats() reports the use rate.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+_lock = threading.Lock()
+_executor = None
+_queued = 0
+_per_user = {}  # user_id -> deque of submit timestamps
+_speculated = {}  # cache_key -> (user_id, submitted_at)
+STATS = {'submitted': 0, 'generated': 0, 'failed': 0, 'used': 0,
+         'skipped_budget': 0, 'skipped_queue_full': 0, 'skipped_cached': 0}
+
+
+def enabled(config):
+    return bool(config.get('SPECULATIVE_IMAGES_ENABLED', False))
+
+
+def _get_executor(config):
+    global _executor
+    if _executor is None:
+        workers = int(config.get('SPECULATIVE_WORKERS', 1) or 1)
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='speculative-image')
+    return _executor
+
+
+def _prune(now, window):
+    for key, (_, ts) in list(_speculated.items()):
+        if now - ts > window:
+            del _speculated[key]
+
+
+def skip_cached():
+    with _lock:
+        STATS['skipped_cached'] += 1
+
+
+def submit(user_id, cache_key, work, config):
+    """Queue work() as a speculative generation for cache_key.
+
+    work() returns True if an image was produced. Returns False when the
+    per-user budget or the queue limit rejects the speculation.
+    """
+    window = float(config.get('SPECULATIVE_WINDOW_SECONDS', 3600))
+    per_user = int(config.get('SPECULATIVE_MAX_PER_USER', 20))
+    max_queue = int(config.get('SPECULATIVE_MAX_QUEUE', 16))
+    now = time.time()
+    global _queued
+    with _lock:
+        if cache_key in _speculated:
+            return True
+        history = _per_user.setdefault(user_id, deque())
+        while history and now - history[0] > window:
+            history.popleft()
+        if len(history) >= per_user:
+            STATS['skipped_budget'] += 1
+            return False
+        if _queued >= max_queue:
+            STATS['skipped_queue_full'] += 1
+            return False
+        history.append(now)
+        _prune(now, window)
+        _speculated[cache_key] = (user_id, now)
+        _queued += 1
+        STATS['submitted'] += 1
+        executor = _get_executor(config)
+
+    def run():
+        global _queued
+        try:
+            ok = work()
+        except Exception as e:
+            print(f"[SPECULATE] ❌ {cache_key}: {str(e)}")
+            ok = False
+        with _lock:
+            _queued -= 1
+            STATS['generated' if ok else 'failed'] += 1
+
+    executor.submit(run)
+    return True
+
+
+def claim(cache_key):
+    """Record that a real request wanted cache_key; True if it was speculated."""
+    with _lock:
+        if _speculated.pop(cache_key, None) is None:
+            return False
+        STATS['used'] += 1
+        return True
+
+
+def stats():
+    with _lock:
+        submitted = STATS['submitted']
+        return dict(STATS, queued=_queued, pending_keys=len(_speculated),
+                    use_rate=round(STATS['used'] / submitted, 3) if submitted else None)
+
+
+def reset():
+    """Forget all speculation state (tests)."""
+    global _queued
+    with _lock:
+        _per_user.clear()
+        _speculated.clear()
+        _queued = 0
+        for name in STATS:
+            STATS[name] = 0
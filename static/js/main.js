@@ -22,6 +22,7 @@ let state = {
     summaryBullets: [],
     initialPrompt: '',
     artStyle: 'photorealistic cinematic',
+    storyId: null,          // Key for the server-side story context
     currentSceneData: null, // Holds LLM output while user edits prompt
     pendingSceneId: null,   // If a narration is posted before image generation
     isGenerating: false
@@ -166,14 +167,18 @@ async function fetchWithRetry(url, options = {}, retries = MAX_RETRIES) {
             if (!response.ok) {
                 // Attempt to parse text for error message, otherwise show status
                 let errorMsg = `HTTP Error ${response.status}`;
+                let contextMissing = false;
                 try {
                     const json = JSON.parse(text);
+                    contextMissing = json?.context_missing === true;
                     const candidate = json?.error || json?.message || json;
                     errorMsg = typeof candidate === 'string' ? candidate : JSON.stringify(candidate);
                 } catch (e) {
                     errorMsg = text || errorMsg;
                 }
-                throw new Error(`API call failed: ${errorMsg}`);
+                const error = new Error(`API call failed: ${errorMsg}`);
+                error.contextMissing = contextMissing;
+                throw error;
             }
 
             // Handle empty response bodies gracefully (e.g., from some POSTs)
@@ -182,6 +187,8 @@ async function fetchWithRetry(url, options = {}, retries = MAX_RETRIES) {
             return JSON.parse(text);
 
         } catch (error) {
+            // Retrying the same body can't help; the caller re-seeds the story context
+            if (error.contextMissing) throw error;
             if (i === retries - 1) {
                 throw new Error(`Max retries reached. Failed to fetch from ${url}. Original error: ${error.message}`);
             }
@@ -422,6 +429,7 @@ window.onload = initializeApp;
 
 async function saveStorySession() {
     if (!state.token) return;
+    await sceneContextWrites;
 
     // Prepare a clean copy of state data for the backend save
     const dataToSave = {
@@ -435,6 +443,7 @@ async function saveStorySession() {
         summaryBullets: state.summaryBullets.filter(s => typeof s === 'string'),
         initialPrompt: state.initialPrompt,
         artStyle: state.artStyle,
+        storyId: state.storyId,
     };
 
     try {
@@ -456,60 +465,144 @@ async function saveStorySession() {
 
 // --- AI API CALLS VIA BACKEND ---
 
-async function generateStoryData(prompt, artStyle) {
+// The server keeps each story's context (recent scenes + a rolling summary)
+// and builds the LLM prompt itself, so requests only carry the story id, the
+// new prompt and how many scenes we recorded. History is sent once per page
+// load, and again whenever the server answers context_missing (a restart, or
+// a worker that never saw our scenes), to re-seed it.
+let storyContextSynced = false;
+let storyContextScenes = 0;
+
+function ensureStoryId() {
+    if (!state.storyId) {
+        state.storyId = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `story-${Date.now()}-${Math.floor(Math.random() * 1e6)}`;
+    }
+    return state.storyId;
+}
+
+function resetStoryContext() {
+    if (state.storyId && state.token) {
+        fetch(`${API_BASE_URL}/story/context/${encodeURIComponent(state.storyId)}`, {
+            method: 'DELETE',
+            headers: { 'Authorization': `Bearer ${state.token}` }
+        }).catch(e => console.debug('Story context reset failed:', e));
+    }
+    state.storyId = null;
+    storyContextSynced = true; // a brand-new story has nothing to re-seed
+    storyContextScenes = 0;
+}
+
+// Scene context writes are chained so they reach the server in order, and
+// saveStorySession waits for them so the next-scene prefetch it triggers
+// sees the committed scene.
+let sceneContextWrites = Promise.resolve();
+
+// Record a scene posted to the storyboard as context for the next ones.
+function recordSceneContext(narrative, summaryPoint) {
+    if (!state.token || !narrative) return;
+    const url = `${API_BASE_URL}/story/context/${encodeURIComponent(ensureStoryId())}/scenes`;
+    const body = JSON.stringify({ narrative, summary_point: summaryPoint || '' });
+    storyContextScenes++;
+    sceneContextWrites = sceneContextWrites.then(() => fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${state.token}` },
+        body
+    })).catch(e => console.debug('Story context update failed:', e));
+}
+
+// Stream a story generation over Server-Sent Events. `onToken` receives
+// narrative text as the LLM produces it; resolves with the normalized
+// {narrative, image_prompt, summary_point} object from the final event.
+async function streamStoryData(requestBody, onToken) {
+    const response = await fetch(`${API_BASE_URL}/ai/generate-prompt/stream`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            ...(state.token ? { 'Authorization': `Bearer ${state.token}` } : {})
+        },
+        body: JSON.stringify(requestBody)
+    });
+    if (!response.ok || !response.body) {
+        const error = new Error(`Streaming request failed: HTTP ${response.status}`);
+        if (response.status === 409) {
+            const body = await response.json().catch(() => ({}));
+            error.contextMissing = body?.context_missing === true;
+        }
+        throw error;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+            let eventName = 'message';
+            let data = '';
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (!data) continue;
+            const parsed = JSON.parse(data);
+            if (eventName === 'token') onToken(parsed.text || '');
+            else if (eventName === 'error') throw new Error(parsed.error || 'Streaming generation failed');
+            else if (eventName === 'final') return parsed.normalized_candidate || parsed;
+        }
+    }
+    throw new Error('Stream ended without a final event');
+}
+
+async function generateStoryData(prompt, artStyle, onToken = null) {
     console.log('generateStoryData called with prompt:', prompt);
     
-    const systemPrompt = `You are an expert narrative and visual storyteller. When given a user's idea, first generate an immersive, cinematic story from that idea, then create a detailed image prompt from the story you generated. Output MUST be valid JSON with these fields:
-
-1. 'narrative': Vivid 150-200 word story paragraph generated from the user's idea with:
-   - Sensory details (sight, sound, touch, smell, taste)
-   - Clear characters/robots with physical descriptions
-   - Dynamic action showing tension and movement
-   - Cinematic pacing and descriptive language
-   - Meaningful plot advancement
-
-2. 'image_prompt': Highly detailed visual instruction (100-150 words) generated from YOUR story narrative:
-   - SPECIFIC visual elements from YOUR narrative (exact robot descriptions, clothing, features)
-   - Camera angle, lighting, composition details
-   - Environmental and atmospheric specifics
-   - Art style: ${artStyle}
-   - MUST perfectly match YOUR narrative characters and action
-   - Use descriptive adjectives: dramatic, cinematic, photorealistic, detailed
-
-3. 'summary_point': One concise sentence (max 20 words) of the scene's key event from YOUR story.`;
-
-    const contents = [{ 
-        role: "user", 
-        parts: [{ 
-            text: `Story context (last ${state.storyHistory.length} scenes): [${state.storyHistory.map(s => `"${s}"`).join(', ')}]\n\nContinue the story from this point, focusing on the next action or setting change. Prompt: ${prompt}`
-        }] 
-    }];
-
-    const aiPayload = {
-        contents: contents,
-        systemInstruction: { parts: [{ text: systemPrompt }] },
-        generationConfig: {
-            responseMimeType: "application/json",
-            temperature: 0.8,
-            topP: 0.95,
-            responseSchema: {
-                type: "OBJECT",
-                properties: {
-                    "narrative": { "type": "STRING", "description": "Vivid story paragraph with sensory details and character actions" },
-                    "image_prompt": { "type": "STRING", "description": "Detailed visual prompt matching narrative exactly" },
-                    "summary_point": { "type": "STRING", "description": "Concise event summary" }
-                },
-                required: ["narrative", "image_prompt", "summary_point"]
-            }
+    // The server counts recorded scenes, so let pending writes land first
+    await sceneContextWrites;
+    const buildRequestBody = () => {
+        const story = { id: ensureStoryId(), prompt, art_style: artStyle, scenes: storyContextScenes };
+        if (!storyContextSynced && state.storyHistory.length) {
+            story.history = state.storyHistory.slice(-5);
         }
+        storyContextSynced = true;
+        return { story };
     };
-    
+    let requestBody = buildRequestBody();
+    const reseedStoryContext = () => {
+        console.warn('Server is missing the story context, resending history');
+        storyContextSynced = false;
+        requestBody = buildRequestBody();
+    };
+
+    // Prefer token streaming so the narrative appears as it is written;
+    // fall back to the regular request if streaming is unavailable.
+    if (onToken) {
+        try {
+            return await streamStoryData(requestBody, onToken);
+        } catch (e) {
+            if (e.contextMissing) reseedStoryContext();
+            console.warn('Streaming generation failed, retrying without streaming:', e);
+        }
+    }
+
     console.log('Sending request to backend...');
-    const response = await fetchWithRetry(`${API_BASE_URL}/ai/generate-prompt`, {
+    const postStoryRequest = () => fetchWithRetry(`${API_BASE_URL}/ai/generate-prompt`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ payload: aiPayload })
+        body: JSON.stringify(requestBody)
     });
+    let response;
+    try {
+        response = await postStoryRequest();
+    } catch (e) {
+        if (!e.contextMissing) throw e;
+        reseedStoryContext();
+        response = await postStoryRequest();
+    }
     console.log('Received response from backend:', response);
 
     // Update provider banner with whether a real LLM was used for this
@@ -544,6 +637,8 @@ async function generateStoryData(prompt, artStyle) {
     return JSON.parse(jsonString);
 }
 
+// Returns a list of image sources: cache URLs when the server supports URL
+// responses, otherwise data: URLs built from base64 predictions.
 async function generateImage(prompt, artStyle, count = 1) {
     // Request `count` images in a single backend call when supported.
     // Enhance the prompt with quality settings for better image generation
@@ -562,9 +657,15 @@ async function generateImage(prompt, artStyle, count = 1) {
     const response = await fetchWithRetry(`${API_BASE_URL}/ai/generate-image`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ payload: aiPayload })
+        body: JSON.stringify({ payload: aiPayload, response: 'url' })
     });
 
+    // URL responses point at cached files; no base64 round trip needed.
+    if (Array.isArray(response?.images) && response.images.length > 0) {
+        const urls = response.images.map(img => img?.url).filter(Boolean);
+        if (urls.length) return urls;
+    }
+
     // Expect an array of predictions; normalize to an array of base64 strings.
     let base64List = [];
     try {
@@ -598,19 +699,25 @@ async function generateImage(prompt, artStyle, count = 1) {
         if (!fallbackBase64) {
             throw new Error("Image generation failed and fallback also failed.");
         }
-        return [fallbackBase64];
+        return [`data:image/png;base64,${fallbackBase64}`];
     }
 
-    return base64List;
+    return base64List.map(b64 => `data:image/png;base64,${b64}`);
 }
 
 // --- SCENE RENDERING ---
 
+// Scene cards are ~220px tall; ask the image route for a smaller variant
+// (the server falls back to the original when none was rendered)
+function sceneImageSrc(url) {
+    return url && url.startsWith('/api/ai/images/') ? `${url}?w=768` : url;
+}
+
 function renderScene(scene) {
     const hasImage = !!scene.imageUrl;
     const imageBlock = hasImage ? `
                 <div class="scene-image-wrapper">
-                    <img id="scene-img-${scene.id}" src="${scene.imageUrl}" alt="Scene ${scene.id} Visual" class="w-full rounded-lg shadow-xl border border-cyan-500/50" style="height:220px; object-fit:cover;">
+                    <img id="scene-img-${scene.id}" src="${sceneImageSrc(scene.imageUrl)}" alt="Scene ${scene.id} Visual" class="w-full rounded-lg shadow-xl border border-cyan-500/50" style="height:220px; object-fit:cover;">
                     <button class="download-btn" title="Download image" onclick="downloadImage(${scene.id})">⇩</button>
                 </div>
             ` : `
@@ -657,7 +764,8 @@ function downloadImage(sceneId) {
         }
 
         // For remote URLs (e.g., picsum), fetch as blob then download
-        fetch(src)
+        // (cached images at full resolution, not the displayed variant)
+        fetch(src.startsWith(`${window.location.origin}/api/ai/images/`) ? src.split('?')[0] : src)
             .then(res => res.blob())
             .then(blob => {
                 const url = URL.createObjectURL(blob);
@@ -704,7 +812,7 @@ function updateSceneImage(sceneId, imageUrl) {
                 placeholder.parentElement.replaceChild(img, placeholder);
             }
         }
-        img.src = imageUrl;
+        img.src = sceneImageSrc(imageUrl);
     } catch (e) {
         console.debug('Failed to update scene image', e);
     }
@@ -777,6 +885,7 @@ async function handleInitialGeneration() {
     }
 
     // Reset state for a new story
+    resetStoryContext();
     state.initialPrompt = initialPrompt;
     state.artStyle = artStyle;
     state.storyHistory = [];
@@ -796,7 +905,14 @@ async function handleStoryGeneration(prompt = 'Continue the story.') {
     
     try {
         console.log('Generating story data for prompt:', prompt);
-        const result = await generateStoryData(prompt, state.artStyle);
+        const streamingDisplay = document.getElementById('staging-narrative');
+        if (streamingDisplay) streamingDisplay.textContent = '';
+        const result = await generateStoryData(prompt, state.artStyle, (text) => {
+            if (!streamingDisplay) return;
+            // Reveal the staging area on the first token
+            stagingArea.classList.remove('hidden');
+            streamingDisplay.textContent += text;
+        });
         console.log('Received story data:', result);
         
         // Ensure we have valid data with fallbacks
@@ -860,6 +976,7 @@ async function handlePostNarration() {
     // Update state collections
     state.storyHistory.push(newScene.narrative);
     state.summaryBullets.push(newScene.summaryPoint);
+    recordSceneContext(newScene.narrative, newScene.summaryPoint);
     state.scenes.unshift(newScene);
 
     // Render immediately
@@ -946,11 +1063,10 @@ async function handleImageGeneration() {
             // If polling fails (timeout or error), fall back to synchronous generation
             console.debug('Async poll failed or timed out, falling back to synchronous generation:', pollErr);
             // Attempt a synchronous fallback to avoid leaving the user without images
-            const base64List = await generateImage(customPrompt, artStyle, desiredCount);
+            const imageSrcs = await generateImage(customPrompt, artStyle, desiredCount);
             result = { files: [], file_urls: [] };
-            if (Array.isArray(base64List) && base64List.length) {
-                // convert returned base64 images to data URLs in file_urls for rendering
-                result.file_urls = base64List.map(b64 => `data:image/png;base64,${b64}`);
+            if (Array.isArray(imageSrcs) && imageSrcs.length) {
+                result.file_urls = imageSrcs;
             }
         }
 
@@ -975,6 +1091,9 @@ async function handleImageGeneration() {
             await saveStorySession();
             renderUIFromState();
         } else {
+            // One scene however many images it got: record its context once so
+            // the copies do not crowd the real previous scenes out of the window.
+            recordSceneContext(state.currentSceneData.narrative, state.currentSceneData.summary_point);
             for (let i = 0; i < fileUrls.length; i++) {
                 showProgress(i + 1, fileUrls.length, `Rendering image ${i + 1} of ${fileUrls.length}...`);
                 const imageUrl = fileUrls[i];
@@ -1014,8 +1133,7 @@ async function handleImageGeneration() {
 async function generateImageForScene(sceneId, prompt, artStyle) {
     setLoading(true, 'Generating image...');
     try {
-        const base64List = await generateImage(prompt, artStyle, 1);
-        const imageUrl = `data:image/png;base64,${base64List[0]}`;
+        const imageUrl = (await generateImage(prompt, artStyle, 1))[0];
 
         // Update state
         const scene = state.scenes.find(s => s.id === sceneId);
@@ -1057,8 +1175,7 @@ async function handleGenerateImageFromIdea() {
         const summaryPoint = storyData?.summary_point || `Visualized idea: ${idea}`;
 
         // Then, generate the image using the refined visual prompt.
-        const base64List = await generateImage(imagePrompt, artStyle, 1);
-        const imageUrl = `data:image/png;base64,${base64List[0]}`;
+        const imageUrl = (await generateImage(imagePrompt, artStyle, 1))[0];
 
         // Build the scene with the LLM narrative and refined prompt.
         state.sceneCounter++;
@@ -1074,6 +1191,7 @@ async function handleGenerateImageFromIdea() {
         // Update State
         state.storyHistory.push(newScene.narrative);
         state.summaryBullets.push(newScene.summaryPoint);
+        recordSceneContext(newScene.narrative, newScene.summaryPoint);
         state.scenes.unshift(newScene);
 
         // Save and render
@@ -1218,7 +1336,7 @@ async function loadCacheList() {
         }
         const html = entries.map(e => {
             const ts = e.ts ? new Date(e.ts * 1000).toLocaleString() : 'n/a';
-            const filesHtml = (e.files || []).map(f => `<a class="text-xs text-cyan-200" href="/static/uploads/${f}" target="_blank">${f}</a>`).join('<br>');
+            const filesHtml = (e.files || []).map((f, i) => `<a class="text-xs text-cyan-200" href="${(e.file_urls || [])[i] || `/static/uploads/${f}`}" target="_blank">${f}</a>`).join('<br>');
             return `
                 <div class="mb-4 p-3 rounded border border-cyan-800" style="background:rgba(0,0,0,0.35)">
                     <div class="flex items-center justify-between">
@@ -0,0 +1,237 @@
+# story_context.py
+"""Server-side story context for generate-prompt.
+
+Instead of the browser inlining every previous narrative plus the long
+system prompt into each request, the client sends only
+{"story": {"id", "prompt", "art_style"}} and the server assembles the
+upstream payload from the context it keeps per (user, story):
+
+  - the last STORY_CONTEXT_RECENT_SCENES scenes verbatim;
+  - a rolling summary of everything older, one line per scene (the scene's
+    summary_point, which the LLM already writes, or its first sentence);
+
+packed newest-first into STORY_CONTEXT_TOKEN_BUDGET estimated tokens.
+Scenes are added when the client posts them to the storyboard (see
+story_manager's /context routes), so rejected drafts never become context.
+
+Contexts live in memory like STORY_SESSIONS (dev scaffold); the least
+recently used ones are dropped beyond STORY_CONTEXT_MAX_STORIES. So each
+worker only knows the scenes recorded through it: the client also sends
+`scenes`, how many scenes it has recorded, and a context that has seen
+fewer raises ContextMissing (the routes answer 409 with context_missing)
+so the client retries with its `history` to re-seed this worker.
+"""
+
+import copy
+import re
+import threading
+import time
+from collections import OrderedDict
+
+STORY_SYSTEM_PROMPT = """You are an expert narrative and visual storyteller. When given a user's idea, first generate an immersive, cinematic story from that idea, then create a detailed image prompt from the story you generated. Output MUST be valid JSON with these fields:
+
+1. 'narrative': Vivid 150-200 word story paragraph generated from the user's idea with:
+   - Sensory details (sight, sound, touch, smell, taste)
+   - Clear characters/robots with physical descriptions
+   - Dynamic action showing tension and movement
+   - Cinematic pacing and descriptive language
+   - Meaningful plot advancement
+
+2. 'image_prompt': Highly detailed visual instruction (100-150 words) generated from YOUR story narrative:
+   - SPECIFIC visual elements from YOUR narrative (exact robot descriptions, clothing, features)
+   - Camera angle, lighting, composition details
+   - Environmental and atmospheric specifics
+   - Art style: {art_style}
+   - MUST perfectly match YOUR narrative characters and action
+   - Use descriptive adjectives: dramatic, cinematic, photorealistic, detailed
+
+3. 'summary_point': One concise sentence (max 20 words) of the scene's key event from YOUR story."""
+
+STORY_GENERATION_CONFIG = {
+    'responseMimeType': 'application/json',
+    'temperature': 0.8,
+    'topP': 0.95,
+    'responseSchema': {
+        'type': 'OBJECT',
+        'properties': {
+            'narrative': {'type': 'STRING', 'description': 'Vivid story paragraph with sensory details and character actions'},
+            'image_prompt': {'type': 'STRING', 'description': 'Detailed visual prompt matching narrative exactly'},
+            'summary_point': {'type': 'STRING', 'description': 'Concise event summary'}
+        },
+        'required': ['narrative', 'image_prompt', 'summary_point']
+    }
+}
+
+_lock = threading.Lock()
+STORY_CONTEXTS = OrderedDict()  # (user_id, story_id) -> {'scenes', 'summary', 'scene_count', 'updated'}
+
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+
+
+class ContextMissing(Exception):
+    """The client has recorded scenes this worker's context has not seen."""
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) used for budgeting."""
+    return (len(text or '') + 3) // 4
+
+
+def _summary_line(narrative, summary_point=None):
+    line = (summary_point or '').strip()
+    if not line:
+        line = _SENTENCE_RE.split((narrative or '').strip(), 1)[0]
+    return line[:200]
+
+
+def _context(user_id, story_id, config, create=True):
+    key = (user_id, str(story_id))
+    ctx = STORY_CONTEXTS.get(key)
+    if ctx is None and create:
+        ctx = STORY_CONTEXTS[key] = {'scenes': [], 'summary': [], 'scene_count': 0, 'updated': time.time()}
+        max_stories = int(config.get('STORY_CONTEXT_MAX_STORIES', 10000))
+        while len(STORY_CONTEXTS) > max_stories:
+            STORY_CONTEXTS.popitem(last=False)
+    if ctx is not None:
+        STORY_CONTEXTS.move_to_end(key)
+    return ctx
+
+
+def _compact(ctx, config):
+    """Fold scenes beyond the recent window into the rolling summary."""
+    recent = max(1, int(config.get('STORY_CONTEXT_RECENT_SCENES', 3)))
+    while len(ctx['scenes']) > recent:
+        old = ctx['scenes'].pop(0)
+        ctx['summary'].append(_summary_line(old['narrative'], old.get('summary_point')))
+    max_items = max(2, int(config.get('STORY_CONTEXT_MAX_SUMMARY_ITEMS', 40)))
+    while len(ctx['summary']) > max_items:
+        # Keep the opening line; it anchors the premise of the story
+        ctx['summary'].pop(1)
+
+
+def add_scene(user_id, story_id, narrative, summary_point, config):
+    """Append an accepted scene to a story's context."""
+    with _lock:
+        ctx = _context(user_id, story_id, config)
+        ctx['scenes'].append({'narrative': narrative or '', 'summary_point': summary_point or ''})
+        ctx['scene_count'] += 1
+        ctx['updated'] = time.time()
+        _compact(ctx, config)
+        return _snapshot(ctx)
+
+
+def seed(user_id, story_id, narratives, config, scene_count=0):
+    """Initialise a context from client-held history (e.g. after a restart).
+
+    Only an empty context, or one that has seen fewer than `scene_count`
+    scenes (the rest went through another worker), is replaced.
+    """
+    with _lock:
+        ctx = _context(user_id, story_id, config)
+        if (ctx['scenes'] or ctx['summary']) and ctx['scene_count'] >= scene_count:
+            return False
+        ctx['scenes'], ctx['summary'] = [], []
+        for narrative in narratives or []:
+            if isinstance(narrative, str) and narrative.strip():
+                ctx['scenes'].append({'narrative': narrative, 'summary_point': ''})
+        ctx['scene_count'] = max(scene_count, len(ctx['scenes']))
+        ctx['updated'] = time.time()
+        _compact(ctx, config)
+        return True
+
+
+def check(user_id, story_id, scene_count):
+    """Raise ContextMissing if this worker has seen fewer than `scene_count` scenes."""
+    with _lock:
+        ctx = STORY_CONTEXTS.get((user_id, str(story_id)))
+        if scene_count > (ctx['scene_count'] if ctx is not None else 0):
+            raise ContextMissing(story_id)
+
+
+def reset(user_id, story_id):
+    with _lock:
+        return STORY_CONTEXTS.pop((user_id, str(story_id)), None) is not None
+
+
+def _snapshot(ctx):
+    return {
+        'scenes': [dict(s) for s in ctx['scenes']],
+        'summary': list(ctx['summary']),
+        'scene_count': ctx['scene_count'],
+        'updated': ctx['updated'],
+    }
+
+
+def get(user_id, story_id):
+    with _lock:
+        ctx = STORY_CONTEXTS.get((user_id, str(story_id)))
+        return _snapshot(ctx) if ctx is not None else None
+
+
+def build_prompt_text(user_id, story_id, prompt, config):
+    """Assemble the user turn for the next scene within the token budget.
+
+    The instruction and prompt always go in; then recent scenes and summary
+    lines are added newest first while they fit (the latest scene is cut
+    to its ending if it alone exceeds the budget).
+    """
+    budget = int(config.get('STORY_CONTEXT_TOKEN_BUDGET', 1500))
+    snap = get(user_id, story_id) or {'scenes': [], 'summary': []}
+    tail = f"Continue the story from this point, focusing on the next action or setting change. Prompt: {prompt}"
+    # Reserve room for the section headings and separators
+    remaining = budget - estimate_tokens(tail) - 16
+
+    recent = []
+    for scene in reversed(snap['scenes']):
+        cost = estimate_tokens(scene['narrative']) + 2
+        if cost > remaining:
+            if not recent and remaining > 16:
+                # Even the latest scene is over budget: keep its ending
+                chars = (remaining - 2) * 4
+                recent.insert(0, '...' + scene['narrative'][-(chars - 3):])
+                remaining = 0
+            break
+        recent.insert(0, scene['narrative'])
+        remaining -= cost
+
+    summary = []
+    if len(recent) == len(snap['scenes']):
+        for line in reversed(snap['summary']):
+            cost = estimate_tokens(line) + 1
+            if cost > remaining:
+                break
+            summary.insert(0, line)
+            remaining -= cost
+
+    parts = []
+    if summary:
+        parts.append('Story so far:\n' + '\n'.join(f'- {line}' for line in summary))
+    if recent:
+        parts.append(f'Most recent scenes (last {len(recent)}): [' + ', '.join(f'"{n}"' for n in recent) + ']')
+    parts.append(tail)
+    return '\n\n'.join(parts)
+
+
+def build_payload(user_id, story, config):
+    """Return the Gemini-style generate-prompt payload for a `story` request.
+
+    Raises ContextMissing when the client reports more scenes than this
+    worker has seen and sent no history to re-seed it from.
+    """
+    story_id = story.get('id')
+    art_style = story.get('art_style') or 'photorealistic cinematic'
+    prompt = story.get('prompt') or 'Continue the story.'
+    try:
+        scene_count = max(0, int(story.get('scenes') or 0))
+    except (TypeError, ValueError):
+        scene_count = 0
+    if story.get('history'):
+        seed(user_id, story_id, story['history'], config, scene_count)
+    else:
+        check(user_id, story_id, scene_count)
+    text = build_prompt_text(user_id, story_id, prompt, config)
+    return {
+        'contents': [{'role': 'user', 'parts': [{'text': text}]}],
+        'systemInstruction': {'parts': [{'text': STORY_SYSTEM_PROMPT.format(art_style=art_style)}]},
+        'generationConfig': copy.deepcopy(STORY_GENERATION_CONFIG),
+    }
@@ -1,7 +1,10 @@
 # story_manager.py
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from auth import token_required
+import story_context
+import story_prefetch
+import ai_service
 import json
 
 # Simple in-memory story storage per user for local dev
@@ -18,6 +21,7 @@ def save_session(user_id):
         return jsonify({'error': 'No data provided'}), 400
     # Save the whole session in-memory (dev only)
     STORY_SESSIONS[user_id] = data
+    ai_service._schedule_story_prefetch(user_id, data, current_app.config)
     return jsonify({'message': 'Session saved successfully'}), 200
 
 
@@ -35,4 +39,45 @@ def load_session(user_id):
             'artStyle': 'photorealistic cinematic',
             'username': 'User'
         }), 200
-    return jsonify(data), 200
\ No newline at end of file
+    return jsonify(data), 200
+
+
+@story_bp.route('/context/<story_id>', methods=['GET'])
+@token_required
+def get_context(user_id, story_id):
+    """Return the server-side context (recent scenes + rolling summary) for a story."""
+    ctx = story_context.get(user_id, story_id)
+    if ctx is None:
+        return jsonify({'error': 'Story context not found'}), 404
+    prompt_text = story_context.build_prompt_text(user_id, story_id, '', current_app.config)
+    ctx['estimated_prompt_tokens'] = story_context.estimate_tokens(prompt_text)
+    return jsonify(ctx), 200
+
+
+@story_bp.route('/context/<story_id>/scenes', methods=['POST'])
+@token_required
+def add_context_scene(user_id, story_id):
+    """Record a scene the user posted to the storyboard as story context."""
+    data = request.get_json() or {}
+    narrative = data.get('narrative')
+    if not isinstance(narrative, str) or not narrative.strip():
+        return jsonify({'error': 'narrative is required'}), 400
+    ctx = story_context.add_scene(user_id, story_id, narrative, data.get('summary_point'), current_app.config)
+    # The context moved on; anything prefetched from the old one is stale
+    story_prefetch.cancel(user_id, story_id)
+    return jsonify({'scenes': len(ctx['scenes']), 'summary_items': len(ctx['summary'])}), 200
+
+
+@story_bp.route('/context/<story_id>', methods=['DELETE'])
+@token_required
+def reset_context(user_id, story_id):
+    """Forget a story's server-side context (e.g. when starting over)."""
+    story_prefetch.cancel(user_id, story_id)
+    return jsonify({'removed': story_context.reset(user_id, story_id)}), 200
+
+
+@story_bp.route('/prefetch/<story_id>', methods=['DELETE'])
+@token_required
+def cancel_prefetch(user_id, story_id):
+    """Cancel any next-scene prefetch for a story."""
+    return jsonify({'cancelled': story_prefetch.cancel(user_id, story_id)}), 200
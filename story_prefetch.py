@@ -0,0 +1,205 @@
+# story_prefetch.py
+"""Background prefetch of the next scene's narrative.
+
+When STORY_PREFETCH_ENABLED is set, saving a session (which the UI does
+right after a scene is committed) schedules generate-prompt calls for the
+likely follow-up prompts (STORY_PREFETCH_PROMPTS, by default the plain
+"Continue the story." the Continue button sends) of that story.
+
+Each prefetched body is stored with the digest of the payload it was
+generated from (llm_cache.key_for of the assembled story payload). A later
+generate-prompt request for the same story and prompt is answered from the
+prefetch only if its own payload digest matches, so a context that moved
+on in the meantime is a miss, never a stale answer. A request with any
+other (edited) prompt discards the story's prefetches.
+
+The UI saves a session several times per scene. Rescheduling keeps an
+entry (finished or in flight) whose expected digest is unchanged, so only
+a context that actually moved on costs a new generation. A request that
+arrives while its prefetch is still running waits for it (up to
+STORY_PREFETCH_WAIT_SECONDS) instead of paying for a second LLM call.
+
+Bounded to STORY_PREFETCH_MAX_STORIES stories per user (oldest dropped)
+and STORY_PREFETCH_WORKERS concurrent generations. Prefetches are
+cancelled when a story is rescheduled, reset, or explicitly via cancel().
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+_lock = threading.Lock()
+_executor = None
+_entries = OrderedDict()  # (user_id, story_id, prompt) -> {'future', 'expected', 'digest', 'body', 'created'}
+STATS = {'scheduled': 0, 'kept': 0, 'completed': 0, 'failed': 0, 'cancelled': 0,
+         'hits': 0, 'waited_hits': 0, 'stale': 0, 'not_ready': 0, 'discarded': 0}
+
+DEFAULT_PROMPTS = ('Continue the story.',)
+
+
+def enabled(config):
+    return bool(config.get('STORY_PREFETCH_ENABLED', False))
+
+
+def normalize_prompt(prompt):
+    return ' '.join((prompt or '').lower().split()).rstrip('.')
+
+
+def prompts_for(config):
+    configured = config.get('STORY_PREFETCH_PROMPTS')
+    if isinstance(configured, str):
+        configured = [p for p in configured.split('|') if p.strip()]
+    return list(configured or DEFAULT_PROMPTS)
+
+
+def _get_executor(config):
+    global _executor
+    if _executor is None:
+        workers = int(config.get('STORY_PREFETCH_WORKERS', 2) or 2)
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='story-prefetch')
+    return _executor
+
+
+def _drop_locked(key):
+    entry = _entries.pop(key, None)
+    if entry is not None and entry['body'] is None:
+        entry['cancelled'] = True
+        if entry['future'] is not None:
+            entry['future'].cancel()
+        STATS['cancelled'] += 1
+    return entry
+
+
+def _story_keys(user_id, story_id):
+    return [k for k in _entries if k[0] == user_id and k[1] == str(story_id)]
+
+
+def schedule(user_id, story_id, build, config, digest_for=None):
+    """Prefetch the likely next prompts for a story.
+
+    build(prompt) runs on a worker thread and returns (digest, body).
+    digest_for(prompt), if given, returns the digest build would produce for
+    the current context; an existing entry with that digest is kept. Other
+    earlier prefetches for the story are cancelled.
+    """
+    story_id = str(story_id)
+    max_stories = max(1, int(config.get('STORY_PREFETCH_MAX_STORIES', 2)))
+    wanted = {}
+    for prompt in prompts_for(config):
+        wanted[(user_id, story_id, normalize_prompt(prompt))] = (prompt, digest_for(prompt) if digest_for else None)
+    with _lock:
+        for key in _story_keys(user_id, story_id):
+            entry = _entries[key]
+            expected = wanted.get(key, (None, None))[1]
+            if expected is None or entry['expected'] != expected:
+                _drop_locked(key)
+        # Bound per user: drop whole stories, oldest first
+        stories = [s for s in OrderedDict.fromkeys(k[1] for k in _entries if k[0] == user_id) if s != story_id]
+        for old in stories[:max(0, len(stories) - max_stories + 1)]:
+            for key in _story_keys(user_id, old):
+                _drop_locked(key)
+        executor = _get_executor(config)
+        for key, (prompt, expected) in wanted.items():
+            if key in _entries:
+                _entries.move_to_end(key)
+                STATS['kept'] += 1
+                continue
+            entry = {'future': None, 'expected': expected, 'digest': None, 'body': None, 'cancelled': False,
+                     'created': time.time()}
+            _entries[key] = entry
+            STATS['scheduled'] += 1
+            entry['future'] = executor.submit(_run, key, entry, prompt, build)
+
+
+def _run(key, entry, prompt, build):
+    if entry['cancelled']:
+        return
+    try:
+        digest, body = build(prompt)
+    except Exception as e:
+        print(f"[PREFETCH] ❌ {key[1]}: {str(e)}")
+        with _lock:
+            STATS['failed'] += 1
+            if _entries.get(key) is entry:
+                del _entries[key]
+        return
+    with _lock:
+        if entry['cancelled'] or _entries.get(key) is not entry:
+            return
+        entry['digest'] = digest
+        entry['body'] = body
+        STATS['completed'] += 1
+
+
+def take(user_id, story_id, prompt, digest, wait=0):
+    """Return the prefetched body answering this request, or None.
+
+    A hit is consumed. A prefetch still running for the same context is
+    waited on for up to `wait` seconds. A request whose prompt was not
+    prefetched (the user edited it) discards the story's prefetches.
+    """
+    story_id = str(story_id)
+    key = (user_id, story_id, normalize_prompt(prompt))
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            keys = _story_keys(user_id, story_id)
+            if keys:
+                STATS['discarded'] += 1
+                for other in keys:
+                    _drop_locked(other)
+            return None
+        future = None
+        if entry['body'] is None:
+            if entry['expected'] is not None and entry['expected'] != digest:
+                STATS['stale'] += 1
+                _drop_locked(key)
+                return None
+            future = entry['future']
+    if future is not None and wait:
+        try:
+            future.result(timeout=wait)  # _run handles build errors itself
+        except Exception:
+            pass
+    with _lock:
+        if _entries.get(key) is not entry:
+            STATS['not_ready'] += 1  # failed, or taken by a concurrent request
+            return None
+        if entry['body'] is None:
+            STATS['not_ready'] += 1
+            _drop_locked(key)
+            return None
+        del _entries[key]
+        if entry['digest'] != digest:
+            STATS['stale'] += 1
+            return None
+        STATS['hits'] += 1
+        if future is not None:
+            STATS['waited_hits'] += 1
+        return entry['body']
+
+
+def cancel(user_id, story_id=None):
+    """Cancel a user's prefetches (for one story, or all). Returns the count."""
+    with _lock:
+        keys = [k for k in _entries if k[0] == user_id and (story_id is None or k[1] == str(story_id))]
+        for key in keys:
+            _drop_locked(key)
+        return len(keys)
+
+
+def stats():
+    with _lock:
+        lookups = STATS['hits'] + STATS['stale'] + STATS['not_ready'] + STATS['discarded']
+        return dict(STATS, entries=len(_entries),
+                    hit_rate=round(STATS['hits'] / lookups, 3) if lookups else None)
+
+
+def reset():
+    """Forget all prefetch state (tests)."""
+    with _lock:
+        for key in list(_entries):
+            _drop_locked(key)
+        for name in STATS:
+            STATS[name] = 0
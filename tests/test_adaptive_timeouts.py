@@ -0,0 +1,79 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import circuit_breaker
+import provider_client
+from app import create_app
+
+
+class _SlowHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def _clean_state():
+    provider_client._latencies.clear()
+    circuit_breaker.reset()
+    yield
+    provider_client._latencies.clear()
+    circuit_breaker.reset()
+
+
+def test_default_timeout_until_enough_samples():
+    app = create_app()
+    app.config.update(ADAPTIVE_TIMEOUT_MIN_SAMPLES=10, PROVIDER_CONNECT_TIMEOUT=3.05)
+    with app.app_context():
+        assert provider_client.timeout_for('gemini') == (3.05, 8.0)
+        for _ in range(5):
+            provider_client.record_latency('gemini', 400)
+        assert provider_client.timeout_for('gemini') == (3.05, 8.0)
+
+
+def test_timeout_follows_p99_within_bounds():
+    app = create_app()
+    app.config.update(ADAPTIVE_TIMEOUT_MIN_SAMPLES=10, ADAPTIVE_TIMEOUT_HEADROOM=2.0,
+                      PROVIDER_TIMEOUT_BOUNDS='groq=1:30')
+    with app.app_context():
+        for _ in range(50):
+            provider_client.record_latency('groq', 2000)
+        connect, read = provider_client.timeout_for('groq')
+        assert 4.0 <= read <= 5.0  # bucket upper bound x headroom
+        for _ in range(2000):
+            provider_client.record_latency('groq', 100000)
+        assert provider_client.timeout_for('groq')[1] == 30.0
+        app.config['ADAPTIVE_TIMEOUTS_ENABLED'] = False
+        assert provider_client.timeout_for('groq')[1] == 15.0
+
+
+def test_timeouts_are_counted_but_not_latency_samples():
+    _SlowHandler.delay = 0.5
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/'
+    app = create_app()
+    try:
+        with app.app_context():
+            with pytest.raises(requests.exceptions.Timeout):
+                provider_client.get(url, provider='slowtest', timeout=(1, 0.1))
+            # A timeout must not push p99 (and so the next timeout) upwards
+            assert provider_client.latency_percentile('slowtest', 50) is None
+            assert provider_client.pool_stats()['providers']['slowtest']['timeouts'] == 1
+            # stream=True returns at the headers: not a full-latency sample either
+            provider_client.get(url, provider='streamtest', timeout=(1, 2), stream=True).close()
+            assert provider_client.latency_percentile('streamtest', 50) is None
+    finally:
+        server.shutdown()
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+import ai_service
+import auth
+import story_prefetch
+from app import create_app
+
+
+class _FakeGroqHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        content = json.dumps({'narrative': 'A fox runs.', 'image_prompt': 'fox in snow', 'summary_point': 'Fox runs'})
+        body = json.dumps({'choices': [{'message': {'content': content}}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+async def _login(client):
+    await client.post('/api/auth/register', json={'username': 'asgiuser', 'password': 'password123'})
+    resp = await client.post('/api/auth/login', json={'username': 'asgiuser', 'password': 'password123'})
+    assert resp.status_code == 200
+    return {'Authorization': f"Bearer {resp.json()['token']}"}
+
+
+def test_asgi_generate_prompt_uses_async_client(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _FakeGroqHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setitem(ai_service.LLM_ENDPOINTS, 'groq', f'http://127.0.0.1:{server.server_address[1]}/chat')
+
+    app = create_app(asgi=True)
+    app.config['LLM_PROVIDER'] = 'groq'
+    app.config['GROQ_API_KEY'] = 'test-key'
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+            headers = await _login(client)
+            payload = {'contents': [{'parts': [{'text': 'a fox'}]}]}
+            resp = await client.post('/api/ai/generate-prompt', json={'payload': payload}, headers=headers)
+            unauthorized = await client.post('/api/ai/generate-prompt', json={'payload': payload})
+        await app.aclose()
+        return resp, unauthorized
+
+    try:
+        resp, unauthorized = asyncio.run(run())
+    finally:
+        server.shutdown()
+
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body['normalized_candidate']['image_prompt'] == 'fox in snow'
+    assert body['used_real_llm'] is True
+    assert unauthorized.status_code == 401
+
+
+def test_asgi_falls_back_to_flask_for_other_routes():
+    app = create_app(asgi=True)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+            return await client.get('/api/ai/status')
+
+    resp = asyncio.run(run())
+    assert resp.status_code == 200
+    assert 'image_provider' in resp.json()
+
+
+def test_asgi_pending_prefetch_does_not_block_other_requests():
+    story_prefetch.reset()
+    app = create_app(asgi=True)
+    app.config.update(LLM_PROVIDER='mock', STORY_PREFETCH_ENABLED=True, STORY_PREFETCH_WAIT_SECONDS=5,
+                      LLM_CACHE_ENABLED=False, SPECULATIVE_IMAGES_ENABLED=False)
+    release = threading.Event()
+
+    def build(prompt):
+        release.wait(5)
+        return 'unused', {'normalized_candidate': {'narrative': 'prefetched'}}
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+            headers = await _login(client)
+            with app.flask_app.app_context():
+                user_id, _ = auth.resolve_session_user(headers['Authorization'])
+            story_prefetch.schedule(user_id, 'slow-story', build, app.config)
+            waiting = asyncio.ensure_future(client.post(
+                '/api/ai/generate-prompt', json={'story': {'id': 'slow-story', 'prompt': 'Continue the story.'}},
+                headers=headers))
+            started = time.monotonic()
+            await asyncio.sleep(0.1)  # let the story request reach the pending prefetch
+            other = await client.post('/api/ai/generate-prompt',
+                                      json={'payload': {'contents': [{'parts': [{'text': 'a fox'}]}]}}, headers=headers)
+            elapsed = time.monotonic() - started
+            release.set()
+            await waiting
+        await app.aclose()
+        return other, elapsed
+
+    other, elapsed = asyncio.run(run())
+    assert other.status_code == 200
+    assert elapsed < 2
@@ -0,0 +1,130 @@
+import base64
+import fnmatch
+import socketserver
+import threading
+import time
+
+import pytest
+
+import ai_service
+import cache_backend
+from app import create_app
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 4
+
+
+class _RespStandIn(socketserver.ThreadingTCPServer):
+    """In-process stand-in for a Redis server (the commands RedisBackend uses)."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _RespHandler)
+        self.data = {}  # key -> (value, expires_at or None)
+        self.lock = threading.Lock()
+
+    def live(self, key):
+        value = self.data.get(key)
+        if value and value[1] is not None and value[1] < time.time():
+            del self.data[key]
+            return None
+        return value[0] if value else None
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            size = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def _bulk(self, value):
+        return b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+
+    def handle(self):
+        server = self.server
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            cmd, rest = args[0].upper(), args[1:]
+            with server.lock:
+                if cmd == b'SET':
+                    expires = time.time() + int(rest[3]) if len(rest) > 3 and rest[2].upper() == b'EX' else None
+                    server.data[rest[0]] = (rest[1], expires)
+                    reply = b'+OK\r\n'
+                elif cmd == b'GET':
+                    reply = self._bulk(server.live(rest[0]))
+                elif cmd == b'MGET':
+                    reply = b'*%d\r\n' % len(rest) + b''.join(self._bulk(server.live(k)) for k in rest)
+                elif cmd == b'DEL':
+                    count = sum(1 for k in rest if server.data.pop(k, None) is not None)
+                    reply = b':%d\r\n' % count
+                elif cmd == b'SCAN':
+                    pattern = rest[rest.index(b'MATCH') + 1].decode()
+                    keys = [k for k in list(server.data) if fnmatch.fnmatchcase(k.decode(), pattern)]
+                    reply = b'*2\r\n$1\r\n0\r\n*%d\r\n' % len(keys) + b''.join(self._bulk(k) for k in keys)
+                else:
+                    reply = b'-ERR unknown command\r\n'
+            self.wfile.write(reply)
+
+
+@pytest.fixture
+def resp_server():
+    server = _RespStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _node(tmp_path, name, resp_server):
+    app = create_app()
+    app.static_folder = str(tmp_path / name)
+    app.config.update(CACHE_BACKEND='redis', CACHE_REDIS_URL=f'redis://127.0.0.1:{resp_server.server_address[1]}/0',
+                      CACHE_KEY_PREFIX=f'test-{id(resp_server)}:',
+                      IMAGE_CACHE_INDEX_PATH=str(tmp_path / f'{name}.sqlite3'), IMAGE_CACHE_JANITOR_INTERVAL=0)
+    return app
+
+
+def test_images_and_jobs_are_shared_between_nodes(tmp_path, resp_server):
+    node_a, node_b = _node(tmp_path, 'a', resp_server), _node(tmp_path, 'b', resp_server)
+    b64 = base64.b64encode(PNG).decode('utf-8')
+    with node_a.app_context():
+        ai_service._persist_image_cache('k1', [b64], 'a lighthouse', 'free', {'sampleCount': 1})
+        ai_service.JOBS['job-1'] = {'status': 'done', 'result': {'key': 'k1'}, 'ts': 1, 'user_id': 'u1'}
+        ai_service._publish_job('job-1')
+        url = ai_service._image_url_body('k1')['images'][0]['url']
+    del ai_service.JOBS['job-1']  # as if node B never saw it
+
+    with node_b.app_context():
+        # Node B's image route can serve the blob before it has the entry
+        resp = node_b.test_client().get(url)
+        assert resp.status_code == 200 and resp.data == PNG and 'immutable' in resp.headers['Cache-Control']
+        # A local miss is filled from the shared backend instead of regenerating
+        assert ai_service._load_image_cache('k1') == [b64]
+        assert ai_service.image_store.get_store().meta('k1')['prompt'] == 'a lighthouse'
+        assert ai_service._find_job('job-1')['result'] == {'key': 'k1'}
+
+        backend = cache_backend.get_backend()
+        backend.delete_images('k1')
+        assert backend.get_images('k1') is None
+        assert backend.stats()['image_hits'] == 1
+
+
+def test_filesystem_backend_shares_job_state_between_workers(tmp_path):
+    app = create_app()
+    app.static_folder = str(tmp_path)
+    app.config.update(IMAGE_CACHE_INDEX_PATH=str(tmp_path / 'index.sqlite3'), JOB_STATE_DIR=str(tmp_path / 'jobs'))
+    with app.app_context():
+        backend = cache_backend.get_backend()
+        assert backend.shared is False
+        backend.put_job('j', {'status': 'running', 'user_id': 'u'})
+        assert backend.get_job('j') == {'status': 'running', 'user_id': 'u'}
+        assert backend.get_job('missing') is None
@@ -0,0 +1,79 @@
+import time
+
+from app import create_app
+import image_store
+
+PNG = b'\x89PNG\r\n\x1a\n'
+
+
+def _app(tmp_path, **config):
+    app = create_app()
+    app.static_folder = str(tmp_path)
+    app.config.update(IMAGE_CACHE_INDEX_PATH=str(tmp_path / 'index.sqlite3'), IMAGE_CACHE_JANITOR_INTERVAL=0,
+                      **config)
+    return app
+
+
+def _headers(client, name):
+    client.post('/api/auth/register', json={'username': name, 'password': 'password123'})
+    token = client.post('/api/auth/login', json={'username': name, 'password': 'password123'}).get_json()['token']
+    return {'Authorization': f'Bearer {token}'}
+
+
+def test_filters_resolve_through_the_index(tmp_path):
+    app = _app(tmp_path)
+    now = time.time()
+    with app.app_context():
+        store = image_store.get_store()
+        store.put('aa1', [PNG + b'1'], 'A red Dragon at dawn', 'stability', {}, ts=now - 7200)
+        store.put('aa2', [PNG + b'2'], 'a castle', 'picsum', {}, ts=now - 7200)
+        store.put('bb1', [PNG + b'3'], 'blue dragon', 'picsum', {}, ts=now)
+
+        def keys(**filters):
+            return sorted(k for k, _ in store.select_keys(**filters))
+
+        assert keys(provider='picsum') == ['aa2', 'bb1']
+        assert keys(older_than=3600) == ['aa1', 'aa2']
+        assert keys(newer_than=3600) == ['bb1']
+        assert keys(prefix='aa') == ['aa1', 'aa2']
+        assert keys(contains='DRAGON') == ['aa1', 'bb1']
+        assert keys(pattern=r'^a\b', provider='picsum') == ['aa2']
+        assert keys() == ['aa1', 'aa2', 'bb1']
+
+
+def test_dry_run_inline_and_background_invalidation(tmp_path):
+    app = _app(tmp_path, CACHE_INVALIDATE_SYNC_MAX=2, CACHE_INVALIDATE_BATCH=2)
+    client = app.test_client()
+    headers = _headers(client, 'bulkinval')
+    with app.app_context():
+        store = image_store.get_store()
+        for i in range(5):
+            store.put(f'old{i}', [PNG + bytes([i])], f'old scene {i}', 'picsum', {}, ts=time.time() - 7200)
+        store.put('new0', [PNG + b'new'], 'new scene', 'picsum', {})
+
+    body = client.post('/api/ai/cache/invalidate', json={'filter': {'older_than': 3600}, 'dry_run': True},
+                       headers=headers).get_json()
+    assert body['dry_run'] and body['matched'] == 5 and len(body['keys']) == 5
+    with app.app_context():
+        assert store.totals()[0] == 6
+
+    bad = client.post('/api/ai/cache/invalidate', json={'filter': {'pattern': '('}}, headers=headers)
+    assert bad.status_code == 400
+    assert client.post('/api/ai/cache/invalidate', json={'filter': {}}, headers=headers).status_code == 400
+
+    resp = client.post('/api/ai/cache/invalidate', json={'filter': {'older_than': 3600}}, headers=headers)
+    assert resp.status_code == 202
+    job_id = resp.get_json()['job_id']
+    for _ in range(100):
+        body = client.get(f'/api/ai/cache/invalidate/{job_id}', headers=headers).get_json()
+        if body['status'] == 'done':
+            break
+        time.sleep(0.05)
+    assert body['status'] == 'done'
+    assert body['progress']['deleted'] == body['progress']['total'] == 5
+    assert body['result']['deleted'] == 5
+    with app.app_context():
+        assert [k for k, _ in store.select_keys()] == ['new0']
+
+    inline = client.post('/api/ai/cache/invalidate', json={'filter': {'prefix': 'new'}}, headers=headers)
+    assert inline.status_code == 200 and inline.get_json()['deleted'] == 1
@@ -0,0 +1,50 @@
+import base64
+import json
+
+import ai_service
+import cache_warmup
+from app import create_app
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'warm'
+
+
+def test_warmup_generates_missing_keys_once_and_resumes(tmp_path, monkeypatch):
+    app = create_app()
+    app.static_folder = str(tmp_path)
+    app.config.update(IMAGE_PROVIDER='free', IMAGE_CACHE_INDEX_PATH=str(tmp_path / 'index.sqlite3'),
+                      IMAGE_CACHE_JANITOR_INTERVAL=0)
+    prompts = tmp_path / 'prompts.txt'
+    prompts.write_text('\n'.join([
+        '# starter prompts',
+        'a lighthouse in a storm',
+        json.dumps({'prompt': 'a lighthouse in a storm'}),  # same key as above
+        json.dumps({'prompt': 'a desert caravan', 'art_style': 'watercolor'}),
+        json.dumps({'prompt': 'a neon alley', 'params': {'sampleCount': 2}}),
+    ]))
+    calls = []
+
+    def fake_generate(prompt_text, provider, params, cache_key):
+        calls.append(prompt_text)
+        if prompt_text == 'a neon alley':
+            return None
+        ai_service._persist_image_cache(cache_key, [base64.b64encode(PNG).decode('utf-8')], prompt_text, provider, params)
+        return ai_service._cache_job_result(cache_key)
+
+    monkeypatch.setattr(ai_service, '_generate_job_image', fake_generate)
+    state = tmp_path / 'state.jsonl'
+    with app.app_context():
+        items = cache_warmup.load_items(prompts)
+        summary = cache_warmup.warm(items, concurrency=2, state_path=str(state), report=lambda msg: None)
+        assert summary['unique'] == 3 and summary['generated'] == 2 and summary['failed'] == 1
+        assert sorted(calls) == ['a desert caravan, in the style of watercolor', 'a lighthouse in a storm', 'a neon alley']
+
+        # Entries are real cache entries under the key of the payload main.js sends
+        payload = {'instances': [{'prompt': 'a desert caravan, in the style of watercolor'}],
+                   'parameters': {'sampleCount': 3, 'aspectRatio': '16:9'}}
+        assert ai_service._load_image_cache(ai_service._job_image_key(payload)[3]) is not None
+
+        calls.clear()
+        again = cache_warmup.warm(items, concurrency=2, state_path=str(state), report=lambda msg: None)
+        assert calls == ['a neon alley']  # only the failure is retried
+        assert again['resumed'] == 2
+    assert [json.loads(line)['status'] for line in state.read_text().splitlines()].count('done') == 2
@@ -0,0 +1,67 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import circuit_breaker
+import provider_client
+
+
+class _BillingErrorHandler(BaseHTTPRequestHandler):
+    hits = 0
+
+    def do_POST(self):
+        type(self).hits += 1
+        body = b'{"error": "Imagen API is only accessible to billed users at this time."}'
+        self.send_response(400)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_classify_error():
+    assert circuit_breaker.classify_error(200) == 'ok'
+    assert circuit_breaker.classify_error(400, 'only accessible to billed users') == 'permanent'
+    assert circuit_breaker.classify_error(401) == 'permanent'
+    assert circuit_breaker.classify_error(429, 'rate limited') == 'transient'
+    assert circuit_breaker.classify_error(503) == 'transient'
+    assert circuit_breaker.classify_error(400, 'bad prompt') == 'client'
+
+
+def test_breaker_opens_after_threshold_and_half_opens(monkeypatch):
+    monkeypatch.setattr(circuit_breaker.Config, 'BREAKER_FAILURE_THRESHOLD', 2, raising=False)
+    monkeypatch.setattr(circuit_breaker.Config, 'BREAKER_RESET_SECONDS', 0.05, raising=False)
+    circuit_breaker.reset('unit')
+    for _ in range(2):
+        assert circuit_breaker.allow_request('unit')
+        circuit_breaker.record_failure('unit', reason='timeout')
+    assert circuit_breaker.snapshot()['unit']['state'] == 'open'
+    assert not circuit_breaker.allow_request('unit')
+
+    time.sleep(0.06)
+    assert circuit_breaker.allow_request('unit')  # the single half-open probe
+    assert not circuit_breaker.allow_request('unit')
+    circuit_breaker.record_success('unit')
+    assert circuit_breaker.snapshot()['unit']['state'] == 'closed'
+
+
+def test_permanent_error_is_negatively_cached():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _BillingErrorHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    circuit_breaker.reset('imagen-test')
+    url = f'http://127.0.0.1:{server.server_address[1]}/predict'
+    try:
+        resp = provider_client.post(url, provider='imagen-test', json={}, timeout=5)
+        assert resp.status_code == 400
+        with pytest.raises(circuit_breaker.CircuitOpenError):
+            provider_client.post(url, provider='imagen-test', json={}, timeout=5)
+    finally:
+        server.shutdown()
+    state = circuit_breaker.snapshot()['imagen-test']
+    assert state['state'] == 'open' and state['permanent'] is True
+    assert _BillingErrorHandler.hits == 1
+    circuit_breaker.reset('imagen-test')
@@ -0,0 +1,58 @@
+import threading
+import time
+
+import ai_service
+from app import create_app
+
+
+def test_batch_resolves_hits_and_bounds_concurrency(monkeypatch):
+    app = create_app()
+    app.config.update(IMAGE_BATCH_CONCURRENCY=2, IMAGE_PROVIDER='picsum')
+    monkeypatch.setattr(ai_service, '_image_batch_executor', None)
+
+    def fake_cached(prompt_text, provider, params, cache_key):
+        return {'key': cache_key, 'files': ['hit.png']} if prompt_text.startswith('cached') else None
+
+    lock = threading.Lock()
+    running = {'now': 0, 'max': 0}
+
+    def fake_generate(prompt_text, provider, params, cache_key):
+        with lock:
+            running['now'] += 1
+            running['max'] = max(running['max'], running['now'])
+        time.sleep(0.05)
+        with lock:
+            running['now'] -= 1
+        if prompt_text == 'broken':
+            return None
+        return {'key': cache_key, 'files': [f'{prompt_text}.png']}
+
+    monkeypatch.setattr(ai_service, '_cached_job_result', fake_cached)
+    monkeypatch.setattr(ai_service, '_generate_job_image', fake_generate)
+
+    client = app.test_client()
+    client.post('/api/auth/register', json={'username': 'batchimg', 'password': 'password123'})
+    token = client.post('/api/auth/login', json={'username': 'batchimg', 'password': 'password123'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    items = ['cached one', 'broken'] + [f'scene {i}' for i in range(6)] + [{'payload': {'instances': [{'prompt': 'cached two'}]}}]
+    resp = client.post('/api/ai/generate-image-batch', json={'items': items}, headers=headers)
+    assert resp.status_code == 202
+    body = resp.get_json()
+    assert body['items'][0]['status'] == 'done' and body['items'][0]['cached']
+    assert body['items'][8]['status'] == 'done'
+    job_id = body['job_id']
+
+    for _ in range(100):
+        body = client.get(f'/api/ai/generate-image-job/{job_id}', headers=headers).get_json()
+        if body['status'] == 'done':
+            break
+        time.sleep(0.05)
+    assert body['status'] == 'done'
+    assert body['progress'] == {'pending': 0, 'running': 0, 'done': 8, 'error': 1, 'total': 9}
+    assert body['items'][1]['status'] == 'error'
+    assert body['items'][2]['result']['files'] == ['scene 0.png']
+    assert running['max'] <= 2
+
+    too_many = client.post('/api/ai/generate-image-batch', json={'items': ['x'] * 500}, headers=headers)
+    assert too_many.status_code == 400
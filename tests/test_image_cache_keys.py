@@ -0,0 +1,107 @@
+import base64
+
+import ai_service
+from app import create_app
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'keys'
+
+
+def _app(tmp_path):
+    app = create_app()
+    app.static_folder = str(tmp_path)
+    app.config.update(IMAGE_PROVIDER='free', IMAGE_CACHE_INDEX_PATH=str(tmp_path / 'index.sqlite3'),
+                      IMAGE_CACHE_JANITOR_INTERVAL=0)
+    return app
+
+
+def test_equivalent_requests_share_one_key():
+    key = ai_service._make_image_cache_key
+    base = key('A castle at dusk, in the style of Watercolor', 'free', {'sampleCount': 1, 'aspectRatio': '16:9'})
+    assert base.startswith('v2-')
+    assert key('  a castle   at dusk ,  In The Style Of watercolor. ', 'free', {'sampleCount': '1', 'aspectRatio': '16:9'}) == base
+    assert key('A castle at dusk, in the style of Watercolor', 'free', {'samples': 1, 'aspectRatio': '16:9'}) == base
+    # Anything that changes the image still changes the key
+    assert key('A castle at dusk, in the style of oil painting', 'free', {'sampleCount': 1, 'aspectRatio': '16:9'}) != base
+    assert key('A castle at dusk, in the style of Watercolor', 'free', {'sampleCount': 2, 'aspectRatio': '16:9'}) != base
+    assert key('A castle at dusk, in the style of Watercolor', 'stability', {'sampleCount': 1, 'aspectRatio': '16:9'}) != base
+
+
+def test_async_jobs_warm_the_sync_route(tmp_path):
+    app = _app(tmp_path)
+    payload = {'instances': [{'prompt': 'a fox in snow'}], 'parameters': {'sampleCount': 1, 'aspectRatio': '16:9'}}
+    with app.app_context():
+        prompt_text, provider, params, job_key = ai_service._job_image_key(payload)
+        sync_key = ai_service._make_image_cache_key(prompt_text, provider, ai_service._image_params_from_payload(payload))
+        assert job_key == sync_key
+
+
+def test_v1_entries_are_found_and_copied_to_v2(tmp_path):
+    app = _app(tmp_path)
+    b64 = base64.b64encode(PNG).decode('utf-8')
+    with app.app_context():
+        # An entry an older async job wrote under its v1 key
+        old_key = ai_service._make_image_cache_key_v1('a fox in snow', 'free', {'sampleCount': 1})
+        ai_service._persist_image_cache(old_key, [b64], 'a fox in snow', 'free', {'sampleCount': 1})
+
+        new_key = ai_service._make_image_cache_key('a fox in snow', 'free', {'sampleCount': 1, 'aspectRatio': '16:9'})
+        before = dict(ai_service.KEY_STATS)
+        assert ai_service._load_image_cache(new_key) == [b64]
+        assert ai_service.KEY_STATS['compat_hits'] == before['compat_hits'] + 1
+        store = ai_service.image_store.get_store()
+        assert store.meta(new_key)['files'] == store.meta(old_key)['files']  # same blob, no second write
+
+        app.config['IMAGE_CACHE_KEY_COMPAT'] = False
+        other = ai_service._make_image_cache_key_v1('a hare in snow', 'free', {'sampleCount': 1})
+        ai_service._persist_image_cache(other, [b64], 'a hare in snow', 'free', {'sampleCount': 1})
+        assert ai_service._load_image_cache(ai_service._make_image_cache_key('a hare in snow', 'free', {'sampleCount': 1})) is None
+
+
+def test_speculative_payload_keys_like_the_ui(tmp_path):
+    app = _app(tmp_path)
+    app.config.update(SPECULATIVE_IMAGE_SAMPLE_COUNT=1)
+    # Exactly what handleImageGeneration sends once the narration is posted
+    ui_payload = {'instances': [{'prompt': 'a fox in snow, in the style of watercolor'}],
+                  'parameters': {'sampleCount': 1, 'aspectRatio': '16:9'}}
+    with app.app_context():
+        spec_payload = ai_service._speculative_payload('a fox in snow', 'watercolor', app.config)
+        assert ai_service._job_image_key(spec_payload)[3] == ai_service._job_image_key(ui_payload)[3]
+
+
+def test_jobs_generate_what_the_shared_key_promises(tmp_path, monkeypatch):
+    app = _app(tmp_path)
+    app.config.update(STABILITY_API_KEY='test-key')
+    requested = {}
+
+    class _Resp:
+        status_code = 200
+        content = PNG
+        text = ''
+
+        def __init__(self, body=None):
+            self._body = body
+
+        def json(self):
+            return self._body
+
+    def fake_post(url, provider=None, **kwargs):
+        requested['samples'] = kwargs['json']['samples']
+        images = [base64.b64encode(PNG + bytes([i])).decode('utf-8') for i in range(requested['samples'])]
+        return _Resp({'artifacts': [{'base64': b64} for b64 in images]})
+
+    def fake_get(url, provider=None, **kwargs):
+        requested['picsum'] = url
+        return _Resp()
+
+    monkeypatch.setattr(ai_service.provider_client, 'post', fake_post)
+    monkeypatch.setattr(ai_service.provider_client, 'get', fake_get)
+    payload = {'instances': [{'prompt': 'a fox in snow'}], 'parameters': {'sampleCount': 3, 'aspectRatio': '16:9'}}
+    with app.app_context():
+        prompt_text, _, params, key = ai_service._job_image_key(payload)
+        ai_service._generate_job_image(prompt_text, 'stability', params, key)
+        assert requested['samples'] == 3
+        assert len(ai_service._load_image_cache(key)) == 3
+
+        # The free path fetches the same Picsum image the sync route would
+        prompt_text, _, params, key = ai_service._job_image_key(dict(payload, instances=[{'prompt': 'a hare'}]))
+        ai_service._generate_job_image(prompt_text, 'free', params, key)
+        assert requested['picsum'] == ai_service._picsum_url(prompt_text, 800, 450)
@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+
+import image_store
+from app import create_app
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'pixels'
+
+
+def _store(tmp_path):
+    app = create_app()
+    app.static_folder = str(tmp_path / 'static')
+    app.config.update(IMAGE_CACHE_INDEX_PATH=str(tmp_path / 'index.sqlite3'))
+    return app
+
+
+def test_put_get_delete_shares_identical_blobs(tmp_path):
+    app = _store(tmp_path)
+    with app.app_context():
+        store = image_store.get_store()
+        store.put('k1', [PNG], 'a prompt', 'stability', {'sampleCount': 1})
+        store.put('k2', [PNG], 'another prompt', 'free', {})
+        files = store.files('k1')
+        assert files == store.files('k2') and files[0].startswith('blobs/') and files[0].endswith('.png')
+        assert store.get('k1') == [PNG]
+        assert store.meta('k1')['hits'] == 1
+        assert sorted(e['key'] for e in store.list_entries()) == ['k1', 'k2']
+
+        # The blob survives while another entry still references it
+        store.delete('k1')
+        assert store.get('k1') is None
+        assert store.get('k2') == [PNG]
+        assert store.delete('k2') == files
+        assert not os.path.exists(os.path.join(store.uploads_dir, files[0]))
+
+
+def test_legacy_entries_readable_then_migrated(tmp_path):
+    app = _store(tmp_path)
+    uploads = tmp_path / 'static' / 'uploads'
+    uploads.mkdir(parents=True)
+    (uploads / 'img_old_0.png').write_bytes(PNG)
+    (uploads / 'cache_old.json').write_text(json.dumps(
+        {'key': 'old', 'files': ['img_old_0.png'], 'prompt': 'legacy', 'ts': 1}))
+    with app.app_context():
+        store = image_store.get_store()
+        assert store.get('old') == [PNG]
+        assert [e['key'] for e in store.list_entries()] == ['old']
+
+        assert store.migrate() == {'imported': 1, 'skipped': 0}
+        assert not (uploads / 'cache_old.json').exists()
+        assert store.get('old') == [PNG] and store.files('old')[0].startswith('blobs/')
+        assert store.stats()['migrated'] is True
+
+
+def test_concurrent_writers(tmp_path):
+    app = _store(tmp_path)
+    with app.app_context():
+        store = image_store.get_store()
+
+    def write(i):
+        for j in range(10):
+            store.put(f'key-{i}-{j}', [PNG + bytes([i, j])], f'prompt {i} {j}')
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert store.stats()['entries'] == 40
+
+
+def test_janitor_expires_then_evicts_least_recently_used(tmp_path):
+    app = _store(tmp_path)
+    app.config.update(IMAGE_CACHE_TTL_SECONDS=3600, IMAGE_CACHE_MAX_BYTES=3 * 100,
+                      IMAGE_CACHE_JANITOR_INTERVAL=0, IMAGE_CACHE_JANITOR_BATCH=2)
+    with app.app_context():
+        store = image_store.get_store()
+    assert store.janitor is None  # interval 0: no background thread
+
+    store.put('stale', [b'x' * 100], ts=1)
+    for i in range(5):
+        store.put(f'k{i}', [bytes([i]) * 100])
+    store.get('k0')  # recently used; survives the LRU pass
+    before = store.stats()
+
+    image_store._Janitor(store, app.config).run_once()
+    after = store.stats()
+    assert store.meta('stale') is None
+    assert after['entries'] == 3 and after['bytes'] <= 300
+    assert store.meta('k0') is not None
+    assert after['expired'] - before['expired'] == 1
+    assert after['evicted'] - before['evicted'] == 2 and after['evicted_bytes'] - before['evicted_bytes'] == 200
+
+
+def test_lfu_eviction_keeps_popular_entries(tmp_path):
+    app = _store(tmp_path)
+    with app.app_context():
+        store = image_store.get_store()
+    for i in range(3):
+        store.put(f'k{i}', [bytes([i]) * 10])
+    for _ in range(3):
+        store.get('k0')
+    store.get('k2')
+    assert store.evict(max_entries=1, policy='lfu') == (2, 20)
+    assert store.meta('k0') is not None
+
+
+def test_hot_tier_serves_repeat_hits_from_memory(tmp_path):
+    app = _store(tmp_path)
+    app.config.update(IMAGE_HOT_TIER_MAX_BYTES=100, IMAGE_CACHE_JANITOR_INTERVAL=0)
+    with app.app_context():
+        store = image_store.get_store()
+    store.put('k1', [PNG], 'a prompt', encoded=['seeded'])
+    assert store.get_base64('k1') == ['seeded']  # seeded on put, no disk read
+
+    # Remove the file behind the index's back: repeat hits must not touch disk
+    os.remove(store.path(store.files('k1')[0]))
+    assert store.get_base64('k1') == ['seeded']
+    assert store.hot.snapshot()['hits'] == 2
+
+    # Invalidation reaches the hot tier (and hits were counted for eviction)
+    assert store.flush_hits() == 1 and store.meta('k1')['hits'] == 2
+    store.delete('k1')
+    assert store.get_base64('k1') is None
+
+    # Byte budget: the least recently used entry goes first
+    store.put('a', [PNG], encoded=['a' * 40])
+    store.put('b', [PNG], encoded=['b' * 40])
+    store.get_base64('a')
+    store.put('c', [PNG], encoded=['c' * 40])
+    snap = store.hot.snapshot()
+    assert snap['bytes'] <= 100 and snap['evictions'] == 1
+    assert store.hot.get('b') is None and store.hot.get('a') is not None
+
+
+def test_identical_images_are_stored_and_written_once(tmp_path, monkeypatch):
+    app = _store(tmp_path)
+    app.config.update(IMAGE_CACHE_JANITOR_INTERVAL=0)
+    with app.app_context():
+        store = image_store.get_store()
+    fallback = PNG + b'same picsum fallback' * 10
+    store.put('k1', [fallback])
+    writes = []
+    monkeypatch.setattr(store, '_write_blob', lambda data: writes.append(data))
+    store.put('k2', [fallback])
+    store.put('k3', [fallback, fallback])
+    assert writes == []  # known bytes only gain a reference
+
+    stats = store.stats()
+    assert stats['blobs'] == 1 and stats['blob_bytes'] == len(fallback)
+    assert stats['dedup_ratio'] == 4.0 and stats['dedup_bytes_saved'] == 3 * len(fallback)
+
+    path = store.path(store.files('k1')[0])
+    store.delete('k1')
+    store.delete('k3')
+    assert os.path.exists(path)
+    store.delete('k2')
+    assert not os.path.exists(path) and store.stats()['blobs'] == 0
+
+    # Indexes from before reference counting get their counts derived once
+    monkeypatch.undo()
+    store.put('a', [PNG])
+    store.put('b', [PNG])
+    db = store._conn()
+    db.execute('DELETE FROM blobs')
+    db.execute("DELETE FROM store_meta WHERE name = 'blob_refs'")
+    reopened = image_store.ImageStore(store.uploads_dir, store.index_path)
+    assert reopened.stats()['dedup_ratio'] == 2.0
+    reopened.delete('a')
+    assert reopened.get('b') == [PNG]
+
+
+def test_blobs_are_written_outside_the_index_transaction(tmp_path, monkeypatch):
+    app = _store(tmp_path)
+    app.config.update(IMAGE_CACHE_JANITOR_INTERVAL=0)
+    with app.app_context():
+        store = image_store.get_store()
+    write_blob = store._write_blob
+    in_tx = []
+
+    def tracking_write(data):
+        in_tx.append(store._conn().in_transaction)
+        return write_blob(data)
+
+    monkeypatch.setattr(store, '_write_blob', tracking_write)
+    store.put('k', [PNG + b'outside'])
+    assert in_tx == [False]
+
+    # A blob unlinked by another worker between staging and the transaction is rewritten
+    stage_blob = store._stage_blob
+
+    def stage_then_lose(data):
+        sha, rel = stage_blob(data)
+        os.remove(store.path(rel))
+        return sha, rel
+
+    monkeypatch.setattr(store, '_stage_blob', stage_then_lose)
+    store.put('k2', [PNG + b'raced'])
+    assert store.get('k2') == [PNG + b'raced']
@@ -0,0 +1,66 @@
+import base64
+
+import ai_service
+from app import create_app
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 4
+
+
+def test_url_mode_and_image_route(tmp_path):
+    app = create_app()
+    app.static_folder = str(tmp_path)
+    app.config.update(IMAGE_PROVIDER='free', IMAGE_CACHE_INDEX_PATH=str(tmp_path / 'index.sqlite3'))
+    payload = {'instances': [{'prompt': 'a harbour at dawn'}], 'parameters': {'sampleCount': 1}}
+    with app.app_context():
+        params = ai_service._image_params_from_payload(payload)
+        key = ai_service._make_image_cache_key('a harbour at dawn', 'free', params)
+        ai_service._persist_image_cache(key, [base64.b64encode(PNG).decode('utf-8')], 'a harbour at dawn', 'free', params)
+
+    client = app.test_client()
+    client.post('/api/auth/register', json={'username': 'urluser', 'password': 'password123'})
+    token = client.post('/api/auth/login', json={'username': 'urluser', 'password': 'password123'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    legacy = client.post('/api/ai/generate-image', json={'payload': payload}, headers=headers).get_json()
+    assert base64.b64decode(legacy['predictions'][0]['bytesBase64Encoded']) == PNG
+
+    body = client.post('/api/ai/generate-image', json={'payload': payload, 'response': 'url'}, headers=headers).get_json()
+    assert 'predictions' not in body and body['cached'] is True
+    url = body['images'][0]['url']
+    assert url.startswith('/api/ai/images/') and url.endswith('.png')
+
+    full = client.get(url)
+    assert full.status_code == 200 and full.data == PNG and full.mimetype == 'image/png'
+    partial = client.get(url, headers={'Range': 'bytes=0-7'})
+    assert partial.status_code == 206 and partial.data == PNG[:8]
+    assert client.get('/api/ai/images/' + '0' * 64 + '.png').status_code == 404
+    assert client.get('/api/ai/images/../config.py').status_code == 404
+
+    app.config['IMAGE_ACCEL_REDIRECT_PREFIX'] = '/internal-uploads/'
+    accel = client.get(url)
+    assert accel.headers['X-Accel-Redirect'].startswith('/internal-uploads/blobs/')
+    assert accel.data == b''
+
+
+def test_image_route_sends_strong_etag_and_304(tmp_path, monkeypatch):
+    app = create_app()
+    app.static_folder = str(tmp_path)
+    app.config.update(IMAGE_CACHE_INDEX_PATH=str(tmp_path / 'index.sqlite3'))
+    with app.app_context():
+        ai_service._persist_image_cache('k', [base64.b64encode(PNG).decode('utf-8')], 'p')
+        rel = ai_service.image_store.get_store().files('k')[0]
+    url = '/api/ai/images/' + rel.rsplit('/', 1)[-1]
+    sha = rel.rsplit('/', 1)[-1].split('.')[0]
+
+    client = app.test_client()
+    first = client.get(url)
+    assert first.headers['ETag'] == f'"{sha}"'
+    assert first.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+
+    # A revalidation is answered from the index alone
+    def no_file_access(*args, **kwargs):
+        raise AssertionError('file opened for a 304')
+    monkeypatch.setattr(ai_service, 'send_file', no_file_access)
+    again = client.get(url, headers={'If-None-Match': f'"{sha}"'})
+    assert again.status_code == 304 and again.data == b''
+    assert again.headers['ETag'] == f'"{sha}"' and 'immutable' in again.headers['Cache-Control']
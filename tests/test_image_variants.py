@@ -0,0 +1,106 @@
+import hashlib
+import os
+
+import pytest
+
+import image_store
+import image_variants
+from app import create_app
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 4
+
+
+def _app(tmp_path):
+    app = create_app()
+    app.static_folder = str(tmp_path)
+    app.config.update(IMAGE_CACHE_INDEX_PATH=str(tmp_path / 'index.sqlite3'), IMAGE_CACHE_JANITOR_INTERVAL=0)
+    return app
+
+
+def _write(store, rel, data):
+    path = store.path(rel)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return (rel, len(data), hashlib.sha256(data).hexdigest())
+
+
+def test_route_negotiates_variants_and_drops_them_with_the_blob(tmp_path):
+    app = _app(tmp_path)
+    with app.app_context():
+        store = image_store.get_store()
+    store.put('k', [PNG])
+    (sha, rel), = store.blobs('k')
+    variants = [(1024, 'png', rel, len(PNG), sha)]
+    for width, fmt, data in ((256, 'webp', b'RIFF0000WEBPthumb'), (768, 'webp', b'RIFF0000WEBPmedium'),
+                             (1024, 'webp', b'RIFF0000WEBPfull'), (256, 'png', PNG[:200])):
+        vrel = image_variants.variant_path(sha, width, fmt)
+        variants.append((width, fmt) + _write(store, vrel, data))
+    assert store.add_variants(sha, variants) is True
+    assert store.blobs_missing_variants() == []
+
+    client = app.test_client()
+    url = '/api/ai/images/' + rel.rsplit('/', 1)[-1]
+    webp = 'image/avif,image/webp,*/*'
+    thumb = client.get(url + '?w=200', headers={'Accept': webp})
+    assert thumb.data == b'RIFF0000WEBPthumb' and thumb.mimetype == 'image/webp'
+    assert 'Accept' in thumb.headers['Vary']
+    assert client.get(url + '?w=500', headers={'Accept': webp}).data == b'RIFF0000WEBPmedium'
+    full = client.get(url, headers={'Accept': webp})
+    assert full.data == b'RIFF0000WEBPfull'
+    assert full.headers['ETag'] == '"%s"' % hashlib.sha256(b'RIFF0000WEBPfull').hexdigest()
+    assert client.get(url, headers={'Accept': webp, 'If-None-Match': full.headers['ETag']}).status_code == 304
+    # No WebP in Accept: the PNG thumbnail, or the original at full size
+    assert client.get(url + '?w=200').data == PNG[:200]
+    assert client.get(url).data == PNG
+
+    variant_file = store.path(image_variants.variant_path(sha, 256, 'webp'))
+    store.delete('k')
+    assert not os.path.exists(variant_file) and store.variants(sha) == []
+
+
+def test_render_produces_smaller_variants(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    import io
+    buf = io.BytesIO()
+    Image.new('RGB', (1024, 1024), (20, 120, 200)).save(buf, 'PNG')
+    app = _app(tmp_path)
+    with app.app_context():
+        store = image_store.get_store()
+    store.put('k', [buf.getvalue()])
+    (sha, rel), = store.blobs('k')
+    variants = image_variants.render(store.uploads_dir, sha, rel, [256, 768], ['webp'], 80)
+    assert variants[0] == (1024, 'png', rel, len(buf.getvalue()), sha)
+    assert {(w, f) for w, f, _, _, _ in variants[1:]} >= {(256, 'webp'), (768, 'webp'), (1024, 'webp')}
+    assert all(os.path.isfile(store.path(v[2])) for v in variants)
+
+
+def test_schedule_skips_blobs_that_already_have_variants(tmp_path, monkeypatch):
+    from concurrent.futures import Future
+    submitted = []
+
+    class _Executor:
+        def submit(self, fn, uploads_dir, sha, *args):
+            submitted.append(sha)
+            return Future()
+
+    monkeypatch.setattr(image_variants, 'PIL_AVAILABLE', True)
+    monkeypatch.setattr(image_variants, '_get_executor', lambda config: _Executor())
+    monkeypatch.setattr(image_variants, '_inflight', set())
+    app = _app(tmp_path)
+    app.config.update(IMAGE_VARIANT_FORMATS='webp')
+    with app.app_context():
+        store = image_store.get_store()
+    store.put('a', [PNG])
+    (sha, rel), = store.blobs('a')
+    vrel = image_variants.variant_path(sha, 1024, 'webp')
+    store.add_variants(sha, [(1024, 'png', rel, len(PNG), sha), (1024, 'webp') + _write(store, vrel, b'RIFF0000WEBP')])
+
+    # A deduplicated put of the same bytes under another key renders nothing
+    store.put('b', [PNG])
+    assert image_variants.schedule(store, store.blobs('b'), app.config) == []
+    assert submitted == []
+    assert image_variants.stats()['skipped'] >= 1
+
+    # A blob without variants is still rendered
+    store.put('c', [PNG + b'new'])
+    assert len(image_variants.schedule(store, store.blobs('c'), app.config)) == 1
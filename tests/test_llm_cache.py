@@ -0,0 +1,65 @@
+from flask import jsonify
+
+import ai_service
+import llm_cache
+from app import create_app
+
+CONFIG = {'LLM_CACHE_ENABLED': True, 'LLM_CACHE_MAX_ENTRIES': 2, 'LLM_CACHE_TTL_SECONDS': 60,
+          'LLM_CACHE_MAX_TEMPERATURE': 1.0, 'LLM_CACHE_VARIETY_TEMPERATURE': 0.3, 'LLM_CACHE_VARIANTS': 2}
+
+
+def _payload(text, temperature=0.2):
+    return {'contents': [{'parts': [{'text': text}]}], 'generationConfig': {'temperature': temperature}}
+
+
+def test_key_ignores_formatting_but_not_content():
+    a = llm_cache.key_for('groq', 'm', _payload('a  fox\n'))
+    assert a == llm_cache.key_for('groq', 'm', _payload('a fox'))
+    assert a != llm_cache.key_for('groq', 'm', _payload('a wolf'))
+    assert a != llm_cache.key_for('openai', 'm', _payload('a fox'))
+
+
+def test_lru_eviction_and_variants():
+    llm_cache.clear()
+    llm_cache.store('k1', {'narrative': 'one'}, 0.2, CONFIG)
+    llm_cache.store('k2', {'narrative': 'two'}, 0.2, CONFIG)
+    assert llm_cache.lookup('k1', 0.2, CONFIG) == {'narrative': 'one'}
+    llm_cache.store('k3', {'narrative': 'three'}, 0.2, CONFIG)  # evicts k2 (least recently used)
+    assert llm_cache.lookup('k2', 0.2, CONFIG) is None
+    assert llm_cache.lookup('k1', 0.2, CONFIG) is not None
+
+    # Creative temperature: needs two distinct answers before serving, then rotates
+    llm_cache.store('hot', {'narrative': 'a'}, 0.8, CONFIG)
+    assert llm_cache.lookup('hot', 0.8, CONFIG) is None
+    llm_cache.store('hot', {'narrative': 'b'}, 0.8, CONFIG)
+    served = {llm_cache.lookup('hot', 0.8, CONFIG)['narrative'] for _ in range(2)}
+    assert served == {'a', 'b'}
+    assert llm_cache.bypass(1.5, CONFIG)
+
+
+def test_generate_prompt_served_from_cache(monkeypatch):
+    llm_cache.clear()
+    app = create_app()
+    app.config.update(CONFIG, LLM_PROVIDER='gemini', GEMINI_API_KEY='test-key')
+    calls = []
+
+    def fake_call(provider, payload):
+        calls.append(provider)
+        return jsonify(ai_service._normalized_llm_body({'narrative': 'N', 'image_prompt': 'I', 'summary_point': 'S'})), 200
+
+    monkeypatch.setattr(ai_service, '_call_llm', fake_call)
+    client = app.test_client()
+    client.post('/api/auth/register', json={'username': 'cacheuser', 'password': 'password123'})
+    token = client.post('/api/auth/login', json={'username': 'cacheuser', 'password': 'password123'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    hits_before = llm_cache.stats()['hits']
+
+    first = client.post('/api/ai/generate-prompt', json={'payload': _payload('a fox')}, headers=headers)
+    second = client.post('/api/ai/generate-prompt', json={'payload': _payload('a fox')}, headers=headers)
+    fresh = client.post('/api/ai/generate-prompt', json={'payload': _payload('a fox'), 'cache': False}, headers=headers)
+
+    assert calls == ['gemini', 'gemini']
+    assert second.get_json()['cached'] is True
+    assert second.get_json()['normalized_candidate'] == first.get_json()['normalized_candidate']
+    assert 'cached' not in fresh.get_json()
+    assert llm_cache.stats()['hits'] == hits_before + 1
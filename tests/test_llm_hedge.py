@@ -0,0 +1,82 @@
+import time
+
+from flask import jsonify
+
+import llm_hedge
+import provider_client
+from app import create_app
+
+
+def _app():
+    app = create_app()
+    app.config.update(
+        LLM_HEDGE_ENABLED=True,
+        LLM_HEDGE_PROVIDER='groq',
+        GROQ_API_KEY='test-key',
+        LLM_HEDGE_DEFAULT_DELAY_MS=100,
+        LLM_HEDGE_MIN_DELAY_MS=50,
+    )
+    return app
+
+
+def _fake_call(delays, calls):
+    def call(provider, payload):
+        calls.append(provider)
+        time.sleep(delays[provider])
+        return jsonify({'provider': provider}), 200
+    return call
+
+
+def test_slow_primary_is_hedged_and_secondary_wins():
+    app = _app()
+    calls = []
+    with app.test_request_context():
+        assert llm_hedge.hedge_provider_for('gemini', app.config) == 'groq'
+        resp, status = llm_hedge.call_with_hedge('gemini', 'groq', {}, _fake_call({'gemini': 1.0, 'groq': 0.0}, calls))
+    assert status == 200
+    assert resp.get_json()['provider'] == 'groq'
+    assert resp.headers['X-LLM-Provider'] == 'groq'
+    assert calls == ['gemini', 'groq']
+
+
+def test_fast_primary_does_not_fire_hedge():
+    app = _app()
+    calls = []
+    before = llm_hedge.hedge_stats()['hedges_fired']
+    with app.test_request_context():
+        resp, status = llm_hedge.call_with_hedge('gemini', 'groq', {}, _fake_call({'gemini': 0.0, 'groq': 0.0}, calls))
+    assert resp.get_json()['provider'] == 'gemini'
+    assert calls == ['gemini']
+    assert llm_hedge.hedge_stats()['hedges_fired'] == before
+
+
+def test_hedging_disabled_without_secondary_key():
+    app = _app()
+    app.config['GROQ_API_KEY'] = None
+    assert llm_hedge.hedge_provider_for('gemini', app.config) is None
+
+
+def test_saturated_pool_runs_primary_inline(monkeypatch):
+    app = _app()
+    app.config['LLM_HEDGE_MAX_WORKERS'] = 1
+    monkeypatch.setattr(llm_hedge, '_outstanding', 1)  # a loser still holds the only worker
+    calls = []
+    before = llm_hedge.hedge_stats()['pool_saturated']
+    with app.test_request_context():
+        resp, status = llm_hedge.call_with_hedge('gemini', 'groq', {}, _fake_call({'gemini': 0.0, 'groq': 0.0}, calls))
+    assert status == 200 and calls == ['gemini']
+    assert llm_hedge.hedge_stats()['pool_saturated'] == before + 1
+
+
+def test_hedged_calls_run_under_a_timeout_cap():
+    app = _app()
+    app.config['LLM_HEDGE_CALL_TIMEOUT'] = 2
+    seen = []
+
+    def call(provider, payload):
+        seen.append(provider_client._capped_timeout((3.05, 30.0), provider_client._local.timeout_cap))
+        return jsonify({'provider': provider}), 200
+
+    with app.test_request_context():
+        llm_hedge.call_with_hedge('gemini', 'groq', {}, call)
+    assert seen == [(2, 2)]
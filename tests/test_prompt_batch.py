@@ -0,0 +1,84 @@
+import json
+
+from flask import jsonify
+
+import ai_service
+import provider_client
+from app import create_app
+
+
+class _FakeResponse:
+    def __init__(self, body):
+        self._body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._body
+
+
+def _scene(i):
+    return {'narrative': f'Scene {i} narrative', 'image_prompt': f'Scene {i} image', 'summary_point': f'Event {i}'}
+
+
+def _client(monkeypatch, username):
+    app = create_app()
+    app.config.update(LLM_PROVIDER='groq', GROQ_API_KEY='test-key', LLM_CACHE_ENABLED=False)
+    client = app.test_client()
+    client.post('/api/auth/register', json={'username': username, 'password': 'password123'})
+    token = client.post('/api/auth/login', json={'username': username, 'password': 'password123'}).get_json()['token']
+    return client, {'Authorization': f'Bearer {token}'}
+
+
+PAYLOAD = {'contents': [{'parts': [{'text': 'A lighthouse keeper finds a robot'}]}]}
+
+
+def test_batch_uses_one_structured_call(monkeypatch):
+    client, headers = _client(monkeypatch, 'batchuser')
+    posts = []
+    timeouts = []
+
+    def fake_post(url, provider=None, **kwargs):
+        posts.append(kwargs['json'])
+        timeouts.append(kwargs['timeout'])
+        content = json.dumps({'scenes': [_scene(i) for i in range(3)]})
+        return _FakeResponse({'choices': [{'message': {'content': content}}]})
+
+    monkeypatch.setattr(provider_client, 'post', fake_post)
+    monkeypatch.setattr(ai_service, '_call_llm', lambda *a: (_ for _ in ()).throw(AssertionError('no single calls')))
+
+    resp = client.post('/api/ai/generate-prompt/batch', json={'payload': PAYLOAD, 'count': 3}, headers=headers)
+    body = resp.get_json()
+    assert resp.status_code == 200
+    assert body['mode'] == 'batch'
+    assert [s['summary_point'] for s in body['scenes']] == ['Event 0', 'Event 1', 'Event 2']
+    assert len(posts) == 1
+    assert '"scenes"' in posts[0]['messages'][0]['content']
+    # Three scenes' worth of read timeout (15s each for groq), capped at its 30s bound
+    assert timeouts[0][1] == 30.0
+
+
+def test_batch_falls_back_to_parallel_single_calls(monkeypatch):
+    client, headers = _client(monkeypatch, 'batchfallback')
+
+    def fake_post(url, provider=None, **kwargs):
+        content = json.dumps({'scenes': [_scene(0)]})  # short batch
+        return _FakeResponse({'choices': [{'message': {'content': content}}]})
+
+    def fake_call(provider, payload):
+        text = payload['contents'][-1]['parts'][0]['text']
+        index = int(text.split('This is scene ')[1].split(' ')[0]) - 1
+        return jsonify(ai_service._normalized_llm_body(_scene(index))), 200
+
+    monkeypatch.setattr(provider_client, 'post', fake_post)
+    monkeypatch.setattr(ai_service, '_call_llm', fake_call)
+
+    resp = client.post('/api/ai/generate-prompt/batch', json={'payload': PAYLOAD, 'count': 3}, headers=headers)
+    body = resp.get_json()
+    assert resp.status_code == 200
+    assert body['mode'] == 'mixed'
+    assert [s['summary_point'] for s in body['scenes']] == ['Event 0', 'Event 1', 'Event 2']
+
+    too_many = client.post('/api/ai/generate-prompt/batch', json={'payload': PAYLOAD, 'count': 99}, headers=headers)
+    assert too_many.status_code == 400
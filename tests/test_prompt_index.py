@@ -0,0 +1,45 @@
+import base64
+
+import ai_service
+import prompt_index
+from app import create_app
+
+PROMPT = ('A lone lighthouse keeper climbs the spiral stairs at dusk, lantern in hand, '
+          'storm clouds gathering over a jagged coastline, cinematic lighting, photorealistic detail')
+
+
+def _app(tmp_path):
+    app = create_app()
+    app.static_folder = str(tmp_path)
+    app.config.update(IMAGE_SIMILARITY_ENABLED=True, IMAGE_SIMILARITY_THRESHOLD=0.7,
+                      IMAGE_CACHE_INDEX_PATH=str(tmp_path / 'index.sqlite3'))
+    prompt_index.clear()
+    return app
+
+
+def test_similarity_scores():
+    a = prompt_index.shingles('a red fox jumps over the fence')
+    assert prompt_index.jaccard(a, prompt_index.shingles('A red fox jumps over the fence!')) == 1.0
+    assert prompt_index.jaccard(a, prompt_index.shingles('a blue whale sings')) == 0.0
+
+
+def test_near_duplicate_prompt_reuses_cached_image(tmp_path):
+    app = _app(tmp_path)
+    params = {'sampleCount': 1}
+    b64 = base64.b64encode(b'png-bytes').decode('utf-8')
+    with app.app_context():
+        key = ai_service._make_image_cache_key(PROMPT, 'stability', params)
+        assert ai_service._persist_image_cache(key, [b64], PROMPT, 'stability', params)
+
+        variant = PROMPT.replace('at dusk', 'at twilight')
+        other_key = ai_service._make_image_cache_key(variant, 'stability', params)
+        match = ai_service._find_similar_cached(variant, 'stability', params, other_key)
+        assert match is not None and match[0] == key and match[2] == [b64]
+
+        # Different provider or an unrelated prompt never match
+        assert ai_service._find_similar_cached(variant, 'free', params, 'x') is None
+        assert ai_service._find_similar_cached('a cat asleep on a sofa', 'stability', params, 'y') is None
+
+        # The index can be rebuilt from the cache index
+        prompt_index.clear()
+        assert ai_service._find_similar_cached(variant, 'stability', params, other_key)[0] == key
@@ -0,0 +1,76 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ai_service
+from app import create_app
+
+
+def _login(client):
+    client.post('/api/auth/register', json={'username': 'streamuser', 'password': 'password123'})
+    login = client.post('/api/auth/login', json={'username': 'streamuser', 'password': 'password123'})
+    return {'Authorization': f"Bearer {login.get_json()['token']}"}
+
+
+def _parse_sse(text):
+    events = []
+    for block in text.split('\n\n'):
+        lines = [l for l in block.split('\n') if l and not l.startswith(':')]
+        if not lines:
+            continue
+        name = lines[0].split(': ', 1)[1]
+        data = json.loads(lines[1].split(': ', 1)[1])
+        events.append((name, data))
+    return events
+
+
+def test_narrative_extractor_handles_split_escapes():
+    extractor = ai_service._NarrativeStreamExtractor()
+    chunks = ['```json\n{"narr', 'ative": "He said \\', '"hi\\', 'n\\u00e9', 'x" , "image_prompt": "ignored"}']
+    assert ''.join(extractor.feed(c) for c in chunks) == 'He said "hi\né' + 'x'
+
+
+class _FakeOpenAIStream(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        assert body['stream'] is True
+        content = json.dumps({'narrative': 'The tide rose.', 'image_prompt': 'tide', 'summary_point': 'Tide rises'})
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        for i in range(0, len(content), 7):
+            delta = {'choices': [{'delta': {'content': content[i:i + 7]}}]}
+            self.wfile.write(f"data: {json.dumps(delta)}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_stream_route_emits_tokens_then_normalized_final(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _FakeOpenAIStream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setitem(ai_service.LLM_ENDPOINTS, 'openai', f'http://127.0.0.1:{server.server_address[1]}/v1')
+    app = create_app()
+    app.config.update(LLM_PROVIDER='openai', OPENAI_API_KEY='test-key')
+    client = app.test_client()
+    try:
+        resp = client.post('/api/ai/generate-prompt/stream', json={'payload': {'contents': []}}, headers=_login(client))
+        events = _parse_sse(resp.get_data(as_text=True))
+    finally:
+        server.shutdown()
+
+    assert resp.mimetype == 'text/event-stream'
+    tokens = ''.join(d['text'] for name, d in events if name == 'token')
+    assert tokens == 'The tide rose.'
+    name, final = events[-1]
+    assert name == 'final'
+    assert final['normalized_candidate'] == {'narrative': 'The tide rose.', 'image_prompt': 'tide', 'summary_point': 'Tide rises'}
+
+
+def test_stream_route_rejects_missing_payload():
+    app = create_app()
+    client = app.test_client()
+    resp = client.post('/api/ai/generate-prompt/stream', json={}, headers=_login(client))
+    assert resp.status_code == 400
+    assert resp.get_json() == {'error': 'payload or story is required'}
@@ -0,0 +1,63 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import provider_client
+
+
+class _OkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_session_created_once_under_threads():
+    provider_client.reset_session()
+    seen = []
+    barrier = threading.Barrier(8)
+
+    def worker():
+        barrier.wait()
+        seen.append(provider_client.get_session())
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len({id(s) for s in seen}) == 1
+
+
+def test_pool_sizes_override_per_provider(monkeypatch):
+    monkeypatch.setattr(provider_client.Config, 'HTTP_POOL_SIZES', 'stability=3', raising=False)
+    provider_client.reset_session()
+    session = provider_client.get_session()
+    adapter = session.get_adapter('https://api.stability.ai/v1/generation')
+    assert adapter._pool_maxsize == 3
+    provider_client.reset_session()
+
+
+def test_requests_reuse_keep_alive_connection():
+    provider_client.reset_session()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _OkHandler)
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/'
+        for _ in range(3):
+            assert provider_client.get(url, provider='local', timeout=5).status_code == 200
+        stats = provider_client.pool_stats()
+        assert stats['providers']['local']['requests'] == 3
+        hosts = stats['pools']['default']['hosts']
+        local = [h for h in hosts if h['host'] == '127.0.0.1']
+        assert local and local[0]['connections_opened'] == 1
+    finally:
+        server.shutdown()
+        provider_client.reset_session()
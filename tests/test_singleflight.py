@@ -0,0 +1,85 @@
+import asyncio
+import threading
+import time
+
+from flask import jsonify
+
+import ai_service
+import singleflight
+from app import create_app
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'kind': 'job', 'result': {'files': ['a.png']}}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(singleflight.do('sf-unit', work))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert all(value['result'] == {'files': ['a.png']} for value, _ in results)
+    assert singleflight.stats()['in_flight'] == 0
+
+
+def test_async_follower_joins_thread_leader():
+    started = threading.Event()
+
+    def work():
+        started.set()
+        time.sleep(0.2)
+        return 'from-thread'
+
+    leader = threading.Thread(target=lambda: singleflight.do('sf-mixed', work))
+    leader.start()
+    started.wait()
+
+    async def never():
+        raise AssertionError('follower must not run the work')
+
+    value, shared = asyncio.run(singleflight.do_async('sf-mixed', never))
+    leader.join()
+    assert (value, shared) == ('from-thread', True)
+
+
+def test_generate_image_route_coalesces(monkeypatch):
+    app = create_app()
+    app.config['IMAGE_PROVIDER'] = 'free'
+    calls = []
+
+    def fake_uncached(payload, provider, prompt_text, params, cache_key):
+        calls.append(cache_key)
+        time.sleep(0.3)
+        return jsonify({'predictions': [{'bytesBase64Encoded': 'AAAA'}]}), 200
+
+    monkeypatch.setattr(ai_service, '_generate_image_uncached', fake_uncached)
+    monkeypatch.setattr(ai_service, '_load_image_cache', lambda key, ttl_seconds=0: None)
+
+    client = app.test_client()
+    client.post('/api/auth/register', json={'username': 'sfuser', 'password': 'password123'})
+    token = client.post('/api/auth/login', json={'username': 'sfuser', 'password': 'password123'}).get_json()['token']
+
+    statuses = []
+
+    def hit():
+        resp = app.test_client().post(
+            '/api/ai/generate-image',
+            json={'payload': {'instances': [{'prompt': 'a lighthouse in fog'}]}},
+            headers={'Authorization': f'Bearer {token}'},
+        )
+        statuses.append((resp.status_code, resp.get_json()['predictions'][0]['bytesBase64Encoded']))
+
+    threads = [threading.Thread(target=hit) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert statuses == [(200, 'AAAA')] * 4
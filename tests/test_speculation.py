@@ -0,0 +1,47 @@
+import time
+
+import ai_service
+import speculation
+from app import create_app
+
+
+def test_speculated_image_is_used_by_the_next_job(monkeypatch):
+    speculation.reset()
+    app = create_app()
+    app.config.update(LLM_PROVIDER='mock', IMAGE_PROVIDER='picsum', SPECULATIVE_IMAGES_ENABLED=True,
+                      SPECULATIVE_MAX_PER_USER=1)
+    generated = []
+
+    def fake_generate(prompt_text, provider, params, cache_key):
+        generated.append(prompt_text)
+        return {'key': cache_key, 'files': ['spec.png']}
+
+    monkeypatch.setattr(ai_service, '_generate_job_image', fake_generate)
+    monkeypatch.setattr(ai_service, '_load_image_cache', lambda key, ttl_seconds=0: None)
+    monkeypatch.setattr(ai_service, '_find_similar_cached', lambda *a: None)
+
+    client = app.test_client()
+    client.post('/api/auth/register', json={'username': 'specuser', 'password': 'password123'})
+    token = client.post('/api/auth/login', json={'username': 'specuser', 'password': 'password123'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    story = {'id': 'spec-story', 'prompt': 'a fox in the snow', 'art_style': 'watercolor'}
+    body = client.post('/api/ai/generate-prompt', json={'story': story}, headers=headers).get_json()
+    image_prompt = body['normalized_candidate']['image_prompt']
+    for _ in range(50):
+        if speculation.stats()['generated']:
+            break
+        time.sleep(0.02)
+    assert generated == [f'{image_prompt}, in the style of watercolor']
+
+    # Budget of one per user: the second candidate is not speculated
+    client.post('/api/ai/generate-prompt', json={'story': dict(story, prompt='a wolf')}, headers=headers)
+    assert speculation.stats()['skipped_budget'] == 1
+
+    with app.app_context():
+        # Exactly what handleImageGeneration sends for a new scene
+        payload = {'instances': [{'prompt': f'{image_prompt}, in the style of watercolor'}],
+                   'parameters': {'sampleCount': 3, 'aspectRatio': '16:9'}}
+        ai_service._run_image_job(payload)
+    stats = speculation.stats()
+    assert stats['used'] == 1 and stats['use_rate'] == 1.0
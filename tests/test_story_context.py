@@ -0,0 +1,97 @@
+from flask import jsonify
+
+import ai_service
+import auth
+import story_context
+from app import create_app
+
+CONFIG = {'STORY_CONTEXT_RECENT_SCENES': 2, 'STORY_CONTEXT_TOKEN_BUDGET': 400,
+          'STORY_CONTEXT_MAX_SUMMARY_ITEMS': 3}
+
+
+def test_older_scenes_fold_into_rolling_summary():
+    story_context.reset('u1', 's1')
+    for i in range(6):
+        story_context.add_scene('u1', 's1', f'Scene {i} narrative. More detail here.', f'Point {i}', CONFIG)
+    ctx = story_context.get('u1', 's1')
+    assert [s['narrative'][:7] for s in ctx['scenes']] == ['Scene 4', 'Scene 5']
+    # Capped at three lines, keeping the opening one
+    assert ctx['summary'] == ['Point 0', 'Point 2', 'Point 3']
+
+    text = story_context.build_prompt_text('u1', 's1', 'The storm breaks.', CONFIG)
+    assert 'Story so far:\n- Point 0' in text
+    assert 'Scene 5 narrative' in text
+    assert text.endswith('Prompt: The storm breaks.')
+
+
+def test_prompt_respects_token_budget():
+    story_context.reset('u1', 's2')
+    for i in range(3):
+        story_context.add_scene('u1', 's2', ('long words ' * 200) + str(i), f'Point {i}', CONFIG)
+    text = story_context.build_prompt_text('u1', 's2', 'Next.', CONFIG)
+    assert story_context.estimate_tokens(text) <= CONFIG['STORY_CONTEXT_TOKEN_BUDGET']
+    assert text.count('long words') > 0  # the newest scene still fits
+
+
+def test_generate_prompt_assembles_payload_from_story_context(monkeypatch):
+    app = create_app()
+    sent = []
+
+    def fake_call(provider, payload):
+        sent.append(payload)
+        return jsonify(ai_service._normalized_llm_body({'narrative': 'N', 'image_prompt': 'I', 'summary_point': 'S'})), 200
+
+    monkeypatch.setattr(ai_service, '_call_llm', fake_call)
+    client = app.test_client()
+    client.post('/api/auth/register', json={'username': 'ctxuser', 'password': 'password123'})
+    token = client.post('/api/auth/login', json={'username': 'ctxuser', 'password': 'password123'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    resp = client.post('/api/story/context/story-9/scenes', json={'narrative': 'The fox found a key.', 'summary_point': 'Fox finds key'}, headers=headers)
+    assert resp.status_code == 200
+
+    resp = client.post('/api/ai/generate-prompt', json={'story': {'id': 'story-9', 'prompt': 'Open the door', 'art_style': 'watercolor'}}, headers=headers)
+    assert resp.status_code == 200
+    payload = sent[0]
+    assert 'The fox found a key.' in payload['contents'][0]['parts'][0]['text']
+    assert 'Art style: watercolor' in payload['systemInstruction']['parts'][0]['text']
+
+    assert client.delete('/api/story/context/story-9', headers=headers).get_json()['removed'] is True
+    assert client.get('/api/story/context/story-9', headers=headers).status_code == 404
+
+
+def test_context_miss_is_reported_so_the_client_reseeds(monkeypatch):
+    app = create_app()
+    sent = []
+
+    def fake_call(provider, payload):
+        sent.append(payload)
+        return jsonify(ai_service._normalized_llm_body({'narrative': 'N', 'image_prompt': 'I', 'summary_point': 'S'})), 200
+
+    monkeypatch.setattr(ai_service, '_call_llm', fake_call)
+    client = app.test_client()
+    client.post('/api/auth/register', json={'username': 'ctxmiss', 'password': 'password123'})
+    token = client.post('/api/auth/login', json={'username': 'ctxmiss', 'password': 'password123'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    user_id = auth.resolve_session_user(headers['Authorization'])[0]
+
+    # Two scenes recorded through another worker; this one only saw the second
+    story_context.reset(user_id, 'story-10')
+    client.post('/api/story/context/story-10/scenes', json={'narrative': 'The gate creaked open.'}, headers=headers)
+    story = {'id': 'story-10', 'prompt': 'Go inside', 'scenes': 2}
+
+    for route in ('/api/ai/generate-prompt', '/api/ai/generate-prompt/stream', '/api/ai/generate-prompt/batch'):
+        resp = client.post(route, json={'story': story}, headers=headers)
+        assert resp.status_code == 409 and resp.get_json()['context_missing'] is True
+    assert sent == []
+
+    history = ['The fox found a key.', 'The gate creaked open.']
+    resp = client.post('/api/ai/generate-prompt', json={'story': dict(story, history=history)}, headers=headers)
+    assert resp.status_code == 200
+    assert 'The fox found a key.' in sent[0]['contents'][0]['parts'][0]['text']
+
+    # Re-seeded: the next request needs no history
+    client.post('/api/story/context/story-10/scenes', json={'narrative': 'Inside, a lantern.'}, headers=headers)
+    resp = client.post('/api/ai/generate-prompt', json={'story': dict(story, scenes=3)}, headers=headers)
+    assert resp.status_code == 200
+    assert story_context.get(user_id, 'story-10')['scene_count'] == 3
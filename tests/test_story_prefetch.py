@@ -0,0 +1,91 @@
+import threading
+import time
+
+import story_prefetch
+from app import create_app
+
+
+def _wait_ready():
+    for _ in range(100):
+        if story_prefetch.stats()['completed']:
+            return
+        time.sleep(0.02)
+
+
+def test_continue_is_served_from_prefetch_and_edits_discard_it():
+    story_prefetch.reset()
+    app = create_app()
+    app.config.update(LLM_PROVIDER='mock', STORY_PREFETCH_ENABLED=True, LLM_CACHE_ENABLED=False,
+                      SPECULATIVE_IMAGES_ENABLED=False)
+    client = app.test_client()
+    client.post('/api/auth/register', json={'username': 'prefetcher', 'password': 'password123'})
+    token = client.post('/api/auth/login', json={'username': 'prefetcher', 'password': 'password123'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    story = {'id': 'pf-1', 'art_style': 'ink'}
+
+    client.post('/api/story/context/pf-1/scenes', json={'narrative': 'The ship left port.'}, headers=headers)
+    client.post('/api/story/save-session', json={'storyId': 'pf-1', 'artStyle': 'ink'}, headers=headers)
+    _wait_ready()
+    hit = client.post('/api/ai/generate-prompt', json={'story': dict(story, prompt='Continue the story.')}, headers=headers)
+    assert hit.get_json().get('prefetched') is True
+
+    # Consumed: the same request now goes upstream
+    again = client.post('/api/ai/generate-prompt', json={'story': dict(story, prompt='Continue the story.')}, headers=headers)
+    assert 'prefetched' not in again.get_json()
+
+    # An edited prompt discards the prefetch
+    client.post('/api/story/save-session', json={'storyId': 'pf-1', 'artStyle': 'ink'}, headers=headers)
+    _wait_ready()
+    edited = client.post('/api/ai/generate-prompt', json={'story': dict(story, prompt='The ship sinks.')}, headers=headers)
+    assert 'prefetched' not in edited.get_json()
+    stats = story_prefetch.stats()
+    assert stats['hits'] == 1 and stats['discarded'] == 1 and stats['entries'] == 0
+
+
+def test_stale_context_and_cancel():
+    story_prefetch.reset()
+    app = create_app()
+    app.config.update(LLM_PROVIDER='mock', STORY_PREFETCH_ENABLED=True)
+    calls = []
+
+    def build(prompt):
+        calls.append(prompt)
+        return 'digest-a', {'normalized_candidate': {'narrative': 'n'}}
+
+    story_prefetch.schedule('u1', 's1', build, app.config)
+    _wait_ready()
+    assert story_prefetch.take('u1', 's1', 'continue the story', 'digest-b') is None
+    assert story_prefetch.stats()['stale'] == 1
+
+    story_prefetch.schedule('u1', 's1', build, app.config)
+    assert story_prefetch.cancel('u1') == 1
+    assert story_prefetch.stats()['entries'] == 0
+
+
+def test_unchanged_context_keeps_prefetch_and_take_waits_for_it():
+    story_prefetch.reset()
+    app = create_app()
+    app.config.update(LLM_PROVIDER='mock', STORY_PREFETCH_ENABLED=True)
+    release = threading.Event()
+    calls = []
+
+    def build(prompt):
+        calls.append(prompt)
+        release.wait(2)
+        return 'digest-a', {'normalized_candidate': {'narrative': 'n'}}
+
+    # The UI saves several times per scene: the in-flight prefetch is kept
+    for _ in range(3):
+        story_prefetch.schedule('u2', 's2', build, app.config, digest_for=lambda prompt: 'digest-a')
+    assert story_prefetch.stats()['scheduled'] == 1 and story_prefetch.stats()['kept'] == 2
+
+    # The request arrives before it finished: it waits instead of going upstream
+    threading.Timer(0.1, release.set).start()
+    assert story_prefetch.take('u2', 's2', 'Continue the story.', 'digest-a', wait=2) is not None
+    assert story_prefetch.stats()['waited_hits'] == 1
+    assert len(calls) == 1
+
+    # A context that moved on is rescheduled
+    story_prefetch.schedule('u2', 's2', build, app.config, digest_for=lambda prompt: 'digest-a')
+    story_prefetch.schedule('u2', 's2', build, app.config, digest_for=lambda prompt: 'digest-b')
+    assert story_prefetch.stats()['scheduled'] == 3
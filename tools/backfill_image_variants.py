@@ -0,0 +1,36 @@
+"""Render WebP/AVIF variants for image cache blobs that do not have them yet.
+
+New images get their variants when they are persisted; this backfills the
+blobs that were cached before (run tools/migrate_image_cache.py first so
+legacy cache_*.json entries are in the indexed store). Requires Pillow.
+
+Usage: python tools/backfill_image_variants.py [batch_size]
+Safe to re-run; blobs that already have variants are skipped.
+"""
+import os
+import sys
+from concurrent.futures import wait
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app  # noqa: E402
+import image_store  # noqa: E402
+import image_variants  # noqa: E402
+
+batch = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+app = create_app()
+with app.app_context():
+    if not image_variants.enabled(app.config):
+        sys.exit('Pillow is not installed or IMAGE_VARIANTS_ENABLED is off; nothing to do.')
+    store = image_store.get_store()
+    print('uploads:', store.uploads_dir)
+    tried = set()
+    while True:
+        pending = [b for b in store.blobs_missing_variants(batch + len(tried)) if b[0] not in tried][:batch]
+        if not pending:
+            break
+        tried.update(sha for sha, _ in pending)
+        wait(image_variants.schedule(store, pending, app.config))
+        print('rendered', len(tried), 'blobs so far:', image_variants.stats())
+    print('done:', image_variants.stats())
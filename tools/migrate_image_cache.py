@@ -0,0 +1,26 @@
+"""One-shot migration of legacy image cache entries into the indexed store.
+
+Imports every static/uploads/cache_<key>.json (+ img_<key>_<n>.png) pair
+into image_store (content-addressed blobs + SQLite index), removes the flat
+files, and records that the migration ran so the server stops scanning the
+uploads directory for legacy entries.
+
+Usage: python tools/migrate_image_cache.py
+Safe to re-run; entries already migrated are not touched again.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app  # noqa: E402
+import image_store  # noqa: E402
+
+app = create_app()
+with app.app_context():
+    store = image_store.get_store()
+    print('uploads:', store.uploads_dir)
+    print('index:  ', store.index_path)
+    result = store.migrate()
+    print('imported', result['imported'], 'skipped', result['skipped'])
+    print('store:', store.stats())
@@ -0,0 +1,34 @@
+"""Pre-seed the image cache from a file of prompts (see cache_warmup.py).
+
+Input: one prompt per line, or JSON lines {"prompt", "art_style", "params"}.
+Entries are generated with the server's configured IMAGE_PROVIDER and keys,
+so the server hits them afterwards.
+
+Usage: python tools/warm_image_cache.py prompts.txt [--concurrency 4]
+           [--state warmup-state.jsonl] [--dry-run]
+Re-running skips prompts that are already cached; --state also records
+progress so an interrupted run can be resumed.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app  # noqa: E402
+import cache_warmup  # noqa: E402
+
+parser = argparse.ArgumentParser(description='Pre-seed the image cache from a prompt list.')
+parser.add_argument('prompts', help='file with one prompt or JSON object per line')
+parser.add_argument('--concurrency', type=int, default=4, help='parallel generations (default 4)')
+parser.add_argument('--state', help='JSON-lines progress file used to resume interrupted runs')
+parser.add_argument('--dry-run', action='store_true', help='only report what would be generated')
+args = parser.parse_args()
+
+app = create_app()
+with app.app_context():
+    items = cache_warmup.load_items(args.prompts)
+    print('provider:', app.config.get('IMAGE_PROVIDER'), 'items:', len(items))
+    summary = cache_warmup.warm(items, args.concurrency, args.state, args.dry_run)
+    print('summary:', summary)
+    sys.exit(1 if summary['failed'] else 0)